@@ -0,0 +1,60 @@
+"""
+Measure the cold start of SAM: the time it takes a fresh interpreter to import sam (which creates the app),
+with every component enabled and with only some of them (see sam/components.py).
+Also lists which of the heavier third party modules each configuration ended up importing.
+
+    $ python benchmarks/import_time.py -n 5
+    $ python benchmarks/import_time.py --components none weather music,calendar auto
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('aiohttp', 'apiai', 'dateutil', 'requests_oauthlib', 'cachecontrol')
+
+IMPORT_SAM = f'''
+import sys
+from time import perf_counter
+start = perf_counter()
+import sam
+elapsed = perf_counter() - start
+print(elapsed, ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+'''
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def cold_import(components: str) -> tuple:
+    """
+    :returns: (seconds it took to import sam, heavy modules it imported), in a fresh interpreter
+    """
+    env = dict(os.environ, SAM_COMPONENTS=components)
+    out = subprocess.run([sys.executable, '-c', IMPORT_SAM], cwd=ROOT, env=env, check=True,
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout
+    elapsed, _, modules = out.strip().splitlines()[-1].partition(' ')
+    return float(elapsed), modules.split(',') if modules else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('--components', nargs='+', default=['weather,music,calendar,dialogflow', 'weather', 'none'],
+                        help="SAM_COMPONENTS values to compare ('none' enables no component)")
+    args = parser.parse_args()
+
+    baseline = None
+    for components in args.components:
+        timings, modules = [], []
+        for _ in range(args.runs):
+            elapsed, modules = cold_import(components)
+            timings.append(elapsed)
+        median = statistics.median(timings)
+        baseline = baseline or median
+        print(f'{components:>36}: {median * 1000:6.0f} ms ({(1 - median / baseline) * 100:3.0f}% faster), '
+              f'imports {", ".join(modules) or "none of " + ", ".join(HEAVY_MODULES)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare the CPU time the JSON backends (see sam/json_.py) spend per request,
+on large upstream payloads: a week of events from several calendars and a full Dark Sky forecast.
+Every request decodes the upstream body and encodes the webhook response.
+
+    $ python benchmarks/json_backend.py -n 2000
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from time import process_time
+
+from sam.json_ import BACKENDS, orjson
+
+
+def calendar_payload(events: int=400) -> dict:
+    start = datetime(2018, 9, 17, 8)
+    items = []
+    for i in range(events):
+        begin = start + timedelta(hours=i % 12, days=i // 60)
+        items.append({
+            'kind': 'calendar#event',
+            'id': f'event{i:05d}',
+            'status': 'confirmed',
+            'htmlLink': f'https://www.google.com/calendar/event?eid=event{i:05d}',
+            'summary': f'Lecture {i % 17} - Distributed Systems',
+            'location': f'Building {i % 9}, Room {100 + i % 40}',
+            'creator': {'email': 'someone@example.com'},
+            'start': {'dateTime': begin.isoformat() + '+02:00'},
+            'end': {'dateTime': (begin + timedelta(hours=2)).isoformat() + '+02:00'},
+            'reminders': {'useDefault': True},
+        })
+    return {'kind': 'calendar#events', 'summary': 'SAM', 'timeZone': 'Europe/Amsterdam', 'items': items}
+
+
+def forecast_payload() -> dict:
+    rng = random.Random(0)
+
+    def data_point(time_):
+        return {
+            'time': time_, 'summary': 'Partly Cloudy', 'icon': 'partly-cloudy-day',
+            'precipIntensity': rng.random(), 'precipProbability': rng.random(),
+            'temperature': rng.uniform(5, 25), 'apparentTemperature': rng.uniform(5, 25),
+            'dewPoint': rng.uniform(0, 15), 'humidity': rng.random(), 'pressure': rng.uniform(990, 1030),
+            'windSpeed': rng.uniform(0, 20), 'windGust': rng.uniform(0, 30), 'windBearing': rng.randint(0, 359),
+            'cloudCover': rng.random(), 'uvIndex': rng.randint(0, 8), 'visibility': rng.uniform(5, 16),
+            'ozone': rng.uniform(250, 350),
+        }
+
+    now = 1537430400
+    return {
+        'latitude': 52.3702157, 'longitude': 4.8951679, 'timezone': 'Europe/Amsterdam',
+        'currently': data_point(now),
+        'minutely': {'summary': 'Clear', 'data': [data_point(now + 60 * i) for i in range(61)]},
+        'hourly': {'summary': 'Rain tomorrow', 'data': [data_point(now + 3600 * i) for i in range(169)]},
+        'daily': {'summary': 'Rain all week', 'data': [data_point(now + 86400 * i) for i in range(8)]},
+        'flags': {'sources': ['meteoalarm', 'cmc', 'gfs'], 'units': 'si'},
+    }
+
+
+def cpu_per_request(backend, body: bytes, response: dict, requests: int) -> float:
+    """
+    :returns: CPU seconds per request: decoding ```body``` and encoding ```response```
+    """
+    start = process_time()
+    for _ in range(requests):
+        backend.loads(body)
+        backend.dumpb(response)
+    return (process_time() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    backends = [BACKENDS['json']()] + ([BACKENDS['orjson']()] if orjson is not None else [])
+    if orjson is None:
+        print('orjson is not installed, only the stdlib backend is measured')
+    response = {'fulfillmentText': 'Lecture 3 - Distributed Systems from 10:00 until 12:00 at Building 3'}
+    for name, payload in (('calendar', calendar_payload()), ('forecast', forecast_payload())):
+        body = BACKENDS['json']().dumpb(payload)
+        print(f'{name} payload: {len(body) / 1024:.0f} KiB')
+        baseline = None
+        for backend in backends:
+            cpu = cpu_per_request(backend, body, response, args.requests)
+            baseline = baseline or cpu
+            print(f'    {backend.name:>6}: {cpu * 1e6:8.0f} us CPU/request, '
+                  f'saves {(baseline - cpu) * 1e6:6.0f} us ({(1 - cpu / baseline) * 100:.0f}%)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Compare the Flask (WSGI) and ASGI entry points under slow upstreams.
+
+1. Start a fake, slow Geocoding/Dark Sky upstream:
+    $ python benchmarks/webhook_concurrency.py upstream --delay 0.5
+
+2. Start SAM against it, once per entry point (same number of workers):
+    $ export GOOGLE_MAPS_GEOCODE_URL=http://localhost:8081/geocode DARK_SKY_URL=http://localhost:8081/forecast/
+    $ gunicorn sam:app --workers=1 --bind localhost:5000
+    $ uvicorn sam.asgi:app --workers=1 --port 5000
+
+3. Fire concurrent weather webhooks at it:
+    $ python benchmarks/webhook_concurrency.py load --url http://localhost:5000/dialogflow_webhook -n 200 -c 50
+
+Every webhook asks for the weather in another (made up) location, which the fake upstream gives other coordinates,
+so the intent cache, the HTTP cache and the deduplication of identical requests don't hide the upstream latency.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import statistics
+import zlib
+from time import perf_counter
+from uuid import uuid4
+
+import aiohttp
+from aiohttp import web
+
+SAMPLE_REQUEST = os.path.join(os.path.dirname(__file__), '..', 'static', 'sample_dialogflow_requests',
+                              'weather_current.json')
+
+FORECAST_RESPONSE = {'currently': {'summary': 'Clear', 'apparentTemperature': 18.3}}
+
+
+def geocode_response(address: str) -> dict:
+    # Every address gets coordinates of its own, so that the forecast requests differ too
+    offset = zlib.crc32(address.encode()) / 2 ** 32
+    return {'results': [{'geometry': {'location': {'lat': 52 + offset, 'lng': 4 + offset}}}]}
+
+
+def run_upstream(port: int, delay: float):
+    async def handle(request):
+        await asyncio.sleep(delay)
+        if request.path.startswith('/geocode'):
+            return web.json_response(geocode_response(request.query.get('address', '')))
+        return web.json_response(FORECAST_RESPONSE)
+
+    upstream = web.Application()
+    upstream.router.add_get('/{tail:.*}', handle)
+    web.run_app(upstream, port=port)
+
+
+def webhook_body(sample: dict, location: str) -> dict:
+    body = copy.deepcopy(sample)
+    body['queryResult']['parameters']['location'] = {'city': location}
+    for context in body['queryResult']['outputContexts']:
+        context['parameters'].update({'location.original': location,
+                                      'location': {'city': location, 'city.original': location}})
+    return body
+
+
+async def run_load(url: str, requests: int, concurrency: int):
+    with open(SAMPLE_REQUEST) as file_:
+        sample = json.load(file_)
+    # Unique across runs too: the HTTP cache is kept on disk
+    run_id = uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(session, i):
+        nonlocal errors
+        body = webhook_body(sample, f'City {run_id}-{i}')
+        async with semaphore:
+            start = perf_counter()
+            async with session.post(url, json=body) as res:
+                await res.read()
+                if res.status != 200:
+                    errors += 1
+            latencies.append(perf_counter() - start)
+
+    async with aiohttp.ClientSession() as session:
+        start = perf_counter()
+        await asyncio.gather(*(one(session, i) for i in range(requests)))
+        elapsed = perf_counter() - start
+
+    latencies.sort()
+    print(f'{requests} requests, concurrency {concurrency}, {errors} errors')
+    print(f'throughput: {requests / elapsed:.1f} req/s')
+    print(f'latency p50: {statistics.median(latencies) * 1000:.0f} ms, '
+          f'p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    upstream = subparsers.add_parser('upstream', help='Run a fake slow upstream')
+    upstream.add_argument('--port', type=int, default=8081)
+    upstream.add_argument('--delay', type=float, default=0.5, help='Seconds every upstream response takes')
+    load = subparsers.add_parser('load', help='Fire concurrent webhooks')
+    load.add_argument('--url', default='http://localhost:5000/dialogflow_webhook')
+    load.add_argument('-n', '--requests', type=int, default=200)
+    load.add_argument('-c', '--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == 'upstream':
+        run_upstream(args.port, args.delay)
+    elif args.command == 'load':
+        asyncio.get_event_loop().run_until_complete(run_load(args.url, args.requests, args.concurrency))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,60 @@
-from ..exceptions import InvalidDataFormatError
+from ..constants import INTENT_CACHE_TTLS
+from ..intents import intent
 from ..wrappers import calendar_
 from dateutil import parser as date_parser
 from datetime import datetime
 
 
+def now_rfc3339() -> str:
+    now = datetime.utcnow().isoformat()
+    if not now.endswith('Z') and '+' not in now:
+        now += 'Z'
+    return now
+
+
+def summarize_next_event(events: list) -> str:
+    if not events:
+        return 'No upcoming events planned'
+    return generate_event_summary(events[0], specify_day=True)
+
+
+@intent('calendar.next', cache_ttl=INTENT_CACHE_TTLS['calendar'])
 def get_next_event() -> str:
     """
     Get the summary for the next event
     """
-    now = datetime.utcnow().isoformat()
-    if not now.endswith('Z') and '+' not in now:
-        now += 'Z'
-    events = calendar_.get_events(time_min=now)
+    events = calendar_.get_events(time_min=now_rfc3339())
+    return summarize_next_event(events)
+
+
+@intent('calendar.next', cache_ttl=INTENT_CACHE_TTLS['calendar'])
+async def get_next_event_async() -> str:
+    """
+    asyncio version of get_next_event
+    """
+    events = await calendar_.get_events_async(time_min=now_rfc3339())
+    return summarize_next_event(events)
+
+
+def day_bounds(date_: str) -> tuple:
+    """
+    :returns: tuple - (date_, the end of its day), see get_events_summary
+    """
+    # TODO: Ensure that timezone is present in date_start and date_end
+    date_start = date_
+    # date_end will be 23:59:59 hours ahead of date_start
+    date_end = date_parser.parse(date_).replace(hour=23, minute=59, second=59).isoformat()
+    return date_start, date_end
+
 
+def summarize_events(date_: str, events: list) -> str:
     if not events:
-        res = 'No upcoming events planned'
-    else:
-        res = generate_event_summary(events[0], specify_day=True)
-    return res
+        return date_parser.parse(date_).strftime('No events planned for %B %d')
+    return '. '.join(generate_event_summary(event) for event in events)
 
 
+# Summarizing a day needs the events of every calendar
+@intent('calendar.generic', params={'date_': 'date'}, cache_ttl=INTENT_CACHE_TTLS['calendar'], deferred=True)
 def get_events_summary(date_: str) -> str:
     """
     Get a summary of the events for the given date_
@@ -28,19 +63,21 @@ def get_events_summary(date_: str) -> str:
                     Must be an RFC3339 timestamp
     e.g.:           2018-09-20T12:00:00+02:00 or 2018-09-20T12:00:00Z
     """
-
-    # TODO: Ensure that timezone is present in date_start and date_end
-    date_start = date_
-    # date_end will be 23:59:59 hours ahead of date_start
-    date_end = date_parser.parse(date_).replace(hour=23, minute=59, second=59).isoformat()
+    date_start, date_end = day_bounds(date_)
     events = calendar_.get_events(time_min=date_start,
                                   time_max=date_end)
+    return summarize_events(date_, events)
 
-    if not events:
-        res = date_parser.parse(date_).strftime('No events planned for %B %d')
-    else:
-        res = '. '.join(generate_event_summary(event) for event in events)
-    return res
+
+@intent('calendar.generic', params={'date_': 'date'}, cache_ttl=INTENT_CACHE_TTLS['calendar'], deferred=True)
+async def get_events_summary_async(date_: str) -> str:
+    """
+    asyncio version of get_events_summary
+    """
+    date_start, date_end = day_bounds(date_)
+    events = await calendar_.get_events_async(time_min=date_start,
+                                              time_max=date_end)
+    return summarize_events(date_, events)
 
 
 def get_by_type(event_type: str, time_min: str, specify_time: bool=True,
@@ -133,38 +170,19 @@ def generate_event_summary(event: dict, specify_time: bool=True,
     return res
 
 
-def calender_action(query_result):
-    """
-    Perform a calendar action
-    :param query_result:    dict -  All information necessary to perform the calendar_action.
-                                    Depending on the action, different key-value pairs are needed.
-                                    The below example shows all possible parameters.
-                                    Note that not ALL of these are needed, depending on the action.
-    e.g.:
-        "action": "calendar",
-        "parameters": {
-          "date": "2018-09-20T12:00:00+02:00"
-        }
-    """
-    if 'queryResult' in query_result:
-        query_result = query_result['queryResult']
-
-    action = query_result.get('action').split('.')[1]
-
-    if not action:
-        raise InvalidDataFormatError('No specific calendar was provided.')
-
-    if 'parameters' in query_result:
-        parameters = query_result.get('parameters')
-        date = None if parameters.get('date', '') == '' else parameters.get('date')
-        event_type = None if parameters.get('event', '') == '' else parameters.get('event')
-
-    if action == 'generic':
-        res = get_events_summary(date)
-    elif action == 'next':
-        res = get_next_event()
-    elif action == 'time':
-        res = get_by_type(event_type, date, specify_time=True, specify_day=True, specify_location=False)
-    elif action == 'location':
-        res = get_by_type(event_type, date, specify_time=False, specify_day=False, specify_location=True)
-    return res
+@intent('calendar.time', params={'event_type': 'event', 'time_min': 'date'},
+        cache_ttl=INTENT_CACHE_TTLS['calendar'])
+def get_time_by_type(event_type: str, time_min: str=None) -> str:
+    """
+    Get the time and day of the next event of type ```event_type```, on ```time_min``` if specified
+    """
+    return get_by_type(event_type, time_min, specify_time=True, specify_day=True, specify_location=False)
+
+
+@intent('calendar.location', params={'event_type': 'event', 'time_min': 'date'},
+        cache_ttl=INTENT_CACHE_TTLS['calendar'])
+def get_location_by_type(event_type: str, time_min: str=None) -> str:
+    """
+    Get the location of the next event of type ```event_type```, on ```time_min``` if specified
+    """
+    return get_by_type(event_type, time_min, specify_time=False, specify_day=False, specify_location=True)
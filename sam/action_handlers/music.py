@@ -1,10 +1,26 @@
 from ..exceptions import InvalidDataFormatError, InvalidDataValueError
+from ..intents import intent
 from ..utils import normalize_volume_value
 from ..wrappers import spotify
+from ..wrappers.playback_queue import playback_queue
+from ..wrappers.playlist_buffer import playlist_buffer
 
 
+@intent('music.play', params={'artist': 'artist', 'song': 'song', 'album': 'album',
+                             'playlist': 'playlist', 'device': 'device'},
+        utterances=('play {song} by {artist}', 'play the album {album}', 'play album {album}',
+                    'play the playlist {playlist}', 'play playlist {playlist}', 'play my {playlist} playlist'))
 def play(artist=None, song=None, album=None, playlist=None, device: dict=None):
-    if artist:
+    # Dialogflow sends list parameters: only several songs are played as a list, other lists are unwrapped
+    if isinstance(song, list) and len(song) <= 1:
+        song = _unwrap(song)
+    if not isinstance(song, list):
+        artist = _unwrap(artist)
+    album, playlist = _unwrap(album), _unwrap(playlist)
+
+    if isinstance(song, list):
+        res = play_songs(song, artist=artist, device=device)
+    elif artist:
         if song:
             res = play_song_of_artist(song, artist, device=device)
         else:
@@ -20,6 +36,15 @@ def play(artist=None, song=None, album=None, playlist=None, device: dict=None):
     return res
 
 
+def _unwrap(value):
+    """
+    :returns: The first element of ```value``` if it is a list (None if it is empty), ```value``` otherwise
+    """
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
 def play_artist(artist: str, device: str=None):
     """
     Play ```artist```
@@ -28,9 +53,6 @@ def play_artist(artist: str, device: str=None):
     :type device:   Name of the device to play on
     """
     spotify.play(artist, type_='artist', device=device)
-    if isinstance(artist, list):
-        artist = artist[0]
-
     return f'Playing {artist}'
 
 
@@ -62,7 +84,7 @@ def play_song_of_artist(song: str, artist: str, device: "str dict"=None):
     :param device:  Name of the device to play on
     """
     spotify.play([song, artist], type_='song_artist', device=device)
-    return f'Playing {format} by {artist}'
+    return f'Playing {song} by {artist}'
 
 
 def play_song(song, device: "str dict"=None):
@@ -75,18 +97,56 @@ def play_song(song, device: "str dict"=None):
     return f'Playing {song}'
 
 
-def add_current_song_to_playlist(playlist: str):
+def play_songs(songs: list, artist: "str list"=None, device: "str dict"=None):
     """
-    Adds currently playing song to ```playlist```
+    Play several songs, one after the other
+    :param songs:   The names of the songs to play
+    :param artist:  The name of the artist of all songs, or a list with the artist of each song
+    :param device:  Name of the device to play on
+    """
+    if isinstance(artist, list) and len(artist) == len(songs):
+        queries = list(zip(songs, artist))
+    elif isinstance(artist, list) and artist:
+        queries = [(song, artist[0]) for song in songs]
+    elif artist:
+        queries = [(song, artist) for song in songs]
+    else:
+        queries = songs
+    found = spotify.play_tracks(queries, device=device)
+    played = [song for song, query in zip(songs, queries) if query in found]
+    missing = [song for song, query in zip(songs, queries) if query not in found]
+    res = f'Playing {_join_names(played)}'
+    if missing:
+        res += f'. Could not find {_join_names(missing)}'
+    return res
+
+
+def _join_names(names: list) -> str:
+    """
+    :returns: ```names``` as a sentence, e.g. 'Help, Yesterday and Let It Be'
+    """
+    if len(names) == 1:
+        return names[0]
+    return f'{", ".join(names[:-1])} and {names[-1]}'
+
+
+@intent('music.add_playlist', params={'playlist': 'playlist'},
+        utterances=('add this song to {playlist}', 'add this song to my {playlist} playlist'))
+def add_current_song_to_playlist(playlist: str=None):
+    """
+    Adds currently playing song to ```playlist```.
+    The song is buffered, so that songs added in quick succession are written to the playlist in one request.
+    Writes that failed for good since the user's previous request are reported with the answer
     :param playlist: The name of the ```playlist``` to which the current song should be added to.
     """
     if playlist is None:
         raise InvalidDataFormatError('playlist parameter not found in request body')
     song_uri = spotify.currently_playing().json()['item']['uri']
     playlist_id = spotify.get_playlist_uri(playlist).split(':')[-1]
-    spotify.add_to_playlist(song_uri, playlist_id)
+    playlist_buffer.add(song_uri, playlist_id)
     current_song_summary = current_song()
-    return f'Added {current_song_summary} to {playlist} playlist'
+    failures = ''.join(f'. But {failure}' for failure in playlist_buffer.failures())
+    return f'Added {current_song_summary} to {playlist} playlist{failures}'
 
 
 def get_active_device() -> dict:
@@ -97,16 +157,34 @@ def get_active_device() -> dict:
     return spotify.current_playback_state().json()['device']
 
 
+@intent('music.current_song', utterances=('what song is this', 'what is playing', "what's playing",
+                                          'which song is this'))
 def current_song():
     """
     Get current song_name and artist, as a nice ```str``` representation
     """
-    json_data = spotify.currently_playing().json()
+    return summarize_song(spotify.currently_playing().json())
+
+
+@intent('music.current_song', utterances=('what song is this', 'what is playing', "what's playing",
+                                          'which song is this'))
+async def current_song_async():
+    """
+    asyncio version of current_song
+    """
+    return summarize_song((await spotify.currently_playing_async()).json())
+
+
+def summarize_song(json_data: dict) -> str:
+    """
+    :param json_data:   Currently playing information from the Spotify API
+    """
     artist = json_data['item']['artists'][0]['name']
     song_name = json_data['item']['name']
     return f'{song_name} by {artist}'
 
 
+@intent('music.pause', utterances=('pause', 'pause the music', 'stop the music'))
 def pause():
     """
     Pause music playback on the currently active device
@@ -115,6 +193,16 @@ def pause():
     return 'Paused music playback'
 
 
+@intent('music.pause', utterances=('pause', 'pause the music', 'stop the music'))
+async def pause_async():
+    """
+    asyncio version of pause
+    """
+    await spotify.pause_async()
+    return 'Paused music playback'
+
+
+@intent('music.unpause', utterances=('unpause', 'resume', 'resume the music', 'continue playing'))
 def unpause():
     """
     Un-pause music playback on the currently active device
@@ -124,32 +212,48 @@ def unpause():
     return f'Unpaused music playback on {device_name}'
 
 
+@intent('music.unpause', utterances=('unpause', 'resume', 'resume the music', 'continue playing'))
+async def unpause_async():
+    """
+    asyncio version of unpause
+    """
+    await spotify.unpause_async()
+    device_name = (await spotify.current_playback_state_async()).json()['device']['name']
+    return f'Unpaused music playback on {device_name}'
+
+
+@intent('music.skip_forward', utterances=('skip', 'skip this song', 'next', 'next song'))
 def skip_forward():
     """
     Skip the currently playing song
     """
-    spotify.skip_forward()
+    playback_queue.skip_forward()
     return 'Skipping current song'
 
 
+@intent('music.skip_backward', utterances=('previous', 'previous song', 'go back', 'play the previous song'))
 def unskip():
     """"
     Unskip the currently playing song
     """
-    spotify.unskip()
+    playback_queue.skip_backward()
     return 'Playing previous track'
 
 
+@intent('music.repeat', params={'mode': 'repeat_mode'}, utterances=('repeat', 'repeat {repeat_mode}'))
 def repeat(mode='track'):
     """
     Turn on/off repeat
     :param mode:    Determines what repeat mode is used. By default, it repeats the current track.
                     Valid values: 'track', 'context' or 'off'
     """
-    spotify.repeat(mode)
+    playback_queue.repeat(mode)
     return f'Repeat changed to {mode} mode'
 
 
+@intent('music.volume_increase', params={'volume_amount': 'percentage'},
+        utterances=('volume up', 'louder', 'turn it up', 'turn the volume up', 'turn the volume up by {percentage}',
+                    'increase the volume by {percentage}'))
 def volume_increase(volume_amount=10):
     """
     Increase Spotify volume by '''volume_amount'''
@@ -157,18 +261,15 @@ def volume_increase(volume_amount=10):
     :param volume_amount:   By how much should volume be increased
     """
     volume_amount = normalize_volume_value(volume_amount)
-    current_volume_percent = spotify.current_volume()
+    current_volume_percent, _ = playback_queue.change_volume(volume_amount)
     if current_volume_percent == 100:
         return 'At max volume'
-    new_volume_percent = current_volume_percent + volume_amount
-    if new_volume_percent > 100:
-        new_volume_percent = 100
-    elif new_volume_percent < 0:
-        new_volume_percent = 0
-    spotify.set_volume(new_volume_percent)
     return f'Increased volume by {volume_amount}'
 
 
+@intent('music.volume_decrease', params={'volume_amount': 'percentage'},
+        utterances=('volume down', 'quieter', 'turn it down', 'turn the volume down',
+                    'turn the volume down by {percentage}', 'decrease the volume by {percentage}'))
 def volume_decrease(volume_amount=10):
     """
     Decrease Spotify volume by '''volume_amount'''
@@ -176,18 +277,14 @@ def volume_decrease(volume_amount=10):
     :param volume_amount:   By how much should volume be decreased
     """
     volume_amount = normalize_volume_value(volume_amount)
-    current_volume_percent = spotify.current_volume()
+    current_volume_percent, _ = playback_queue.change_volume(-volume_amount)
     if current_volume_percent == 0:
         return 'At min volume'
-    new_volume_percent = current_volume_percent - volume_amount
-    if new_volume_percent > 100:
-        new_volume_percent = 100
-    elif new_volume_percent < 0:
-        new_volume_percent = 0
-    spotify.set_volume(new_volume_percent)
     return f'Lowered the volume by {volume_amount}'
 
 
+@intent('music.shuffle', params={'shuffle_state': 'shuffle'},
+        utterances=('shuffle {shuffle}', 'turn shuffle {shuffle}'))
 def shuffle(shuffle_state=False):
     """
     Turn on/off shuffle
@@ -205,88 +302,16 @@ def shuffle(shuffle_state=False):
         else:
             raise InvalidDataValueError(f"shuffle_state value is invalid: {shuffle_state}. "
                                    f"Valid values are: 'on', 'off', true, false")
-    spotify.shuffle(shuffle_state)
+    playback_queue.shuffle(shuffle_state)
     return f'Shuffle state set to {shuffle_state}'
 
 
-def transfer_to_device(device_in: str):
+@intent('music.transfer', params={'device_in': 'device'}, utterances=('play on {device}', 'transfer to {device}',
+                                                                  'transfer the music to {device}'))
+def transfer_to_device(device_in: str=None):
     """
     Transfer current playback to specified device
     :param device_in:   Name of the device to play on
     """
     spotify.transfer_to_device(device_in)
     return f'Music playback transferred to {device_in}'
-
-
-def music_action(query_result: dict):
-    """
-    Perform a music action
-    :param query_result:    dict -  All information necessary to perform the music_action.
-                                    Depending on the action, different key-value pairs are needed.
-                                    The below example shows all possible parameters.
-                                    Note that not ALL of these are needed, depending on the action.
-    e.g.:
-    {
-        "action": "music.play",
-        "parameters": {
-            "artist": "Queen",
-            "album": "A Night at the Opera",
-            "song": "Bohemian Rhapsody",
-            "playlist": "Rock",
-            "device": "JOHN-PC",
-            "repeat_mode": "track",
-            "uri": "spotify:track:4u7EnebtmKWzUH433cf5Qv",
-            "shuffle_state": "on",
-            "volume_amount": "10%"
-        }
-    }
-    """
-    if 'queryResult' in query_result:
-        query_result = query_result['queryResult']
-    action = query_result.get('action').split('.')[1]
-
-    if not action:
-        raise InvalidDataFormatError('No specific music action was provided.')
-
-    parameters = query_result.get('parameters', None)
-
-    # TODO: Some parameters have to be set to default, even if not specified
-    if parameters:
-        artist = parameters.get('artist', None)
-        album = parameters.get('album', None)
-        song = parameters.get('song', None)
-        playlist = parameters.get('playlist', None)
-        device = parameters.get('device', None)
-        repeat_mode = parameters.get('repeat_mode', None)
-        shuffle_state = parameters.get('shuffle', None)
-
-    # These parameters need to be set to None at the very least
-    volume_amount = parameters.get('percentage', 10)
-
-    if action == 'play':
-        res = play(artist=artist, song=song, album=album, playlist=playlist, device=device)
-    elif action == 'add_playlist':
-        res = add_current_song_to_playlist(playlist)
-    elif action == 'current_song':
-        res = current_song()
-    elif action == 'pause':
-        res = pause()
-    elif action == 'repeat':
-        res = repeat(repeat_mode)
-    elif action == 'unpause':
-        res = unpause()
-    elif action == 'shuffle':
-        res = shuffle(shuffle_state)
-    elif action == 'skip_backward':
-        res = unskip()
-    elif action == 'skip_forward':
-        res = skip_forward()
-    elif action == 'transfer':
-        res = transfer_to_device(device)
-    elif action == 'volume_decrease':
-        res = volume_decrease(volume_amount)
-    elif action == 'volume_increase':
-        res = volume_increase(volume_amount)
-    else:
-        raise InvalidDataFormatError(f'Specified action is invalid: {action}')
-    return res
@@ -1,4 +1,3 @@
-import json
 import logging
 from copy import deepcopy
 from datetime import datetime
@@ -6,10 +5,13 @@ from datetime import datetime
 from dateutil import parser as date_parser
 
 from ..exceptions import InvalidDataFormatError
+from ..intents import intent
 
 from ..constants import (DARK_SKY_KEY, DARK_SKY_URL, GOOGLE_MAPS_GEOCODE_KEY,
                          GOOGLE_MAPS_GEOCODE_URL, GOOGLE_MAPS_TIMEZONE_KEY,
-                         GOOGLE_MAPS_TIMEZONE_URL, WEATHER_PARAMETERS)
+                         GOOGLE_MAPS_TIMEZONE_URL, INTENT_CACHE_TTLS,
+                         WEATHER_PARAMETERS)
+from ..sessions.aio import aio_web
 from ..sessions.web import WebSession
 
 log = logging.getLogger(__name__)
@@ -39,12 +41,25 @@ def get_coordinates(location):
     :param location: the location for which coordinates are to be parsed
     :returns: dict that contains lat and lng
     """
+    json_data = web.get_json(GOOGLE_MAPS_GEOCODE_URL, params=generate_geocode_params(location))
+    return parse_coordinates(json_data)
+
+
+def generate_geocode_params(location):
+    # type: (str) -> dict
     location = location.replace(' ', '+')
     params = {
         'address': location,
         'key': GOOGLE_MAPS_GEOCODE_KEY
     }
-    json_data = web.get_json(GOOGLE_MAPS_GEOCODE_URL, params=params)
+    return params
+
+
+def parse_coordinates(json_data):
+    # type: (dict) -> dict
+    """
+    Parse the coordinates out of a Geocoding API response
+    """
     coordinates = json_data['results'][0]['geometry']['location']
     coordinates['lng'] = round(coordinates['lng'], 7)
     coordinates['lat'] = round(coordinates['lat'], 7)
@@ -97,13 +112,18 @@ def get_weather_data(coordinates, include=None):
     :returns: a dict (json) with (the specified) data
     """
     url = generate_darksky_url(coordinates)
+    return web.get_json(url, params=generate_darksky_params(include))
+
+
+def generate_darksky_params(include=None):
+    # type: (Optional(list[str])) -> dict
     params = {'units': 'si'}
     if include is not None:
         weather_parameters = deepcopy(WEATHER_PARAMETERS)
         for param in include:
             weather_parameters.remove(param)
         params['exclude'] = ','.join(weather_parameters)
-    return web.get_json(url, params=params)
+    return params
 
 
 def generate_summary(json_data, index=None):
@@ -117,65 +137,15 @@ def generate_summary(json_data, index=None):
     return result
 
 
-def get_weather_summary_current(coordinates):
-    # type: (dict) -> str
-    """
-    Returns current weather summary
-
-    :param coordinates: dict containing the lat and lng keys (and their respective values)
-    :returns: a str summary  of the current weather located at coordinates
-    """
-    json_data = get_weather_data(coordinates, include=['currently'])
-    result = generate_summary(json_data, 'currently')
-    return result
-
-
-def get_weather_summary_no_datetime(coordinates):
-    # type: (dict) -> str
-    """
-    Returns weather summary for the next few hours
-
-    :param coordinates: dict containing the lat and lng keys (and their respective values)
-    :returns: a str summary  of the upcoming weather (next few hours) located at coordinates
-    """
-    json_data = get_weather_data(coordinates, include=['currently'])
-    result = generate_summary(json_data, 'currently')
-    return result
-
-
-def get_weather_summary_for_hour(datetime_, coordinates):
-    # type: (dict) -> str
-    """
-    Returns weather summary for the specific hour
-
-    :param datetime_: The specific hour to get weather summary for
-    :type datetime_: datetime_
-    :param coordinates: The coordinates to get weather summary for
-    :returns: a str summary  of the upcoming weather at the specified hour located at coordinates
-    """
-    timestamp = datetime_.timestamp()
-
-    json_data = get_weather_data(coordinates, include=['hourly'])
-    for entry in json_data['hourly']['data']:
-        if entry['time'] == timestamp:
-            summary = entry['summary']
-            apparent_temperature = entry['apparentTemperature']
-            res = f'{summary} with a temperature of {str(int(round(apparent_temperature)))} degrees Celsius.'
-            return res
+def verify_not_in_past(datetime_: datetime):
+    if datetime_.timestamp() < datetime.utcnow().timestamp():
+        raise InvalidDataFormatError(f'{datetime_.isoformat()} is in the past')
 
 
-def get_weather_summary_for_day(datetime_: datetime, coordinates: str) -> str:
+def summarize_day(json_data: dict, datetime_: datetime) -> str:
     """
-    Returns weather summary for the entire day
-
-    :param datetime_: The specific day to get weather summary for
-    :type datetime_: datetime
-    :param coordinates: dict containing the lat and lng keys (and their respective values)
-    :returns: a str summary of the weather on the specified day located at coordinates
+    Summarize the daily Dark Sky data for the day of ```datetime_```
     """
-
-    if datetime_.timestamp() < datetime.utcnow().timestamp():
-        raise InvalidDataFormatError(f'{datetime_.isoformat()} is in the past')
     new_datetime = datetime(
         datetime_.year,
         datetime_.month,
@@ -183,7 +153,6 @@ def get_weather_summary_for_day(datetime_: datetime, coordinates: str) -> str:
 
     )
     timestamp = new_datetime.timestamp()
-    json_data = get_weather_data(coordinates, include=['daily'])
 
     for entry in json_data['daily']['data']:
         try:
@@ -194,17 +163,11 @@ def get_weather_summary_for_day(datetime_: datetime, coordinates: str) -> str:
             return 'weather.get_weather_for_day()_1'
 
 
-def get_weather_summary_for_time_period(datetime_, coordinates):
-    # type: (datetime, dict) -> str
+def summarize_time_period(json_data: dict, datetime_: datetime) -> str:
     """
-    Return weather summary for a a time period (around 4 hours)
-
-    :param datetime_: The time to get weather summary for
-    :param coordinates: dict containing the lat and lng keys (and their respective values)
-    :returns: a str summary of the weather for the specified datetime_ located at coordinates
+    Summarize the hourly Dark Sky data for the hour of ```datetime_```
     """
     timestamp = datetime_.timestamp()
-    json_data = get_weather_data(coordinates, include=['hourly'])
     for entry in json_data['hourly']['data']:
         if entry['time'] == timestamp:
             summary = entry['summary']
@@ -213,16 +176,10 @@ def get_weather_summary_for_time_period(datetime_, coordinates):
             return res
 
 
-def weather_action(query_result: dict):
+def parse_weather_request(query_result: dict) -> tuple:
     """
-    Perform a weather action
-    query_result_example = {
-      "action": "weather.weather",
-      "parameters": {
-        "location": "Amsterdam",
-        "date-time": "2018-09-04T12:00:00+02:00"
-      }
-    }
+    Determine the location and date-time a weather request is about
+    :returns: tuple - (location, date_time)
     """
     if 'queryResult' in query_result:
         query_result = query_result['queryResult']
@@ -248,8 +205,23 @@ def weather_action(query_result: dict):
 
     if isinstance(location, dict):
         location = location['city']
-    coordinates = get_coordinates(location)
+    return location, date_time
+
 
+# The Dark Sky data block each kind of summary needs
+SUMMARY_INCLUDE = {
+    'current': ['currently'],
+    'day': ['daily'],
+    'period': ['hourly'],
+}
+
+
+def plan_weather_summary(date_time) -> tuple:
+    """
+    Determine which kind of summary answers a request for ```date_time```
+    :returns: tuple - (kind, datetime_object), kind being one of SUMMARY_INCLUDE,
+                      or ('invalid', message) if date_time can't be answered
+    """
     if date_time:
         # Get weather for specific datetime (day and hour)
         if isinstance(date_time, dict):
@@ -262,7 +234,7 @@ def weather_action(query_result: dict):
             average_hour_int = int((start_hour + end_hour) / 2)
 
             if average_hour_int < 0 or average_hour_int > 24:
-                return "Error, average_hour has been calculated as invalid"
+                return 'invalid', "Error, average_hour has been calculated as invalid"
             if average_hour_int <= 9:
                 average_hour_str = f'0{average_hour_int}'
             else:
@@ -273,36 +245,99 @@ def weather_action(query_result: dict):
             third_part = date_time['startDateTime'][13:]
             average_hour_str = f'{first_part}{second_part}{third_part}'
 
-            datetime_object = date_parser.parse(average_hour_str)
+            return 'period', date_parser.parse(average_hour_str)
 
-            res = get_weather_summary_for_time_period(datetime_object, coordinates)
+        datetime_object: datetime = date_parser.parse(date_time)
 
-        else:
-            datetime_object: datetime = date_parser.parse(date_time)
+        if len(date_time) != 25:
+            raise InvalidDataFormatError(f'The given datetime format is invalid: {date_time}')
 
-            if len(date_time) == 25:
-                now_timestamp = datetime.utcnow().timestamp()
-                datetime_object_timestamp = datetime_object.timestamp()
-                if datetime_object_timestamp - 60.0 <= now_timestamp <= datetime_object_timestamp + 60.0:
-                    # Get current weather
-                    res = get_weather_summary_current(coordinates)
-                else:
-                    res = get_weather_summary_for_day(datetime_object, coordinates)
+        now_timestamp = datetime.utcnow().timestamp()
+        datetime_object_timestamp = datetime_object.timestamp()
+        if datetime_object_timestamp - 60.0 <= now_timestamp <= datetime_object_timestamp + 60.0:
+            # Get current weather
+            return 'current', datetime_object
+        verify_not_in_past(datetime_object)
+        return 'day', datetime_object
 
-            else:
-                raise InvalidDataFormatError(f'The given datetime format is invalid: {datetime_}')
+    # Assume that the weather is for the current time
+    return 'current', datetime.utcnow()
 
-    else:
-        # Assume that the weather is for the current time
-        res = get_weather_summary_current(coordinates)
-        datetime_object = datetime.utcnow()
-
-    coordinates_str = json.dumps(coordinates)
-    log.debug(f'Returning weather information for the following:\n'
-              f'date: {str(datetime_object)}\n'
-              f'coordinates: {coordinates_str}')
+
+def summarize_weather(kind: str, json_data: dict, datetime_object: datetime) -> str:
+    if kind == 'current':
+        return generate_summary(json_data, 'currently')
+    elif kind == 'day':
+        return summarize_day(json_data, datetime_object)
+    return summarize_time_period(json_data, datetime_object)
+
+
+def finish_weather_summary(res, date_time, coordinates, datetime_object) -> str:
+    log.debug('Returning weather information for date: %s, coordinates: %s', datetime_object, coordinates,
+              extra={'date': datetime_object, 'coordinates': coordinates})
     if res:
         return res
     else:
         return f'Specified date-time is invalid: {date_time}'
         # raise InvalidDataFormat(f'Specified date-time is invalid: {date_time}')
+
+
+@intent('weather', prefix=True, pass_query_result=True, cache_ttl=INTENT_CACHE_TTLS['weather'],
+        cache_per_user=False)
+def weather_action(query_result: dict):
+    """
+    Perform a weather action
+    query_result_example = {
+      "action": "weather.weather",
+      "parameters": {
+        "location": "Amsterdam",
+        "date-time": "2018-09-04T12:00:00+02:00"
+      }
+    }
+    """
+    location, date_time = parse_weather_request(query_result)
+    coordinates = get_coordinates(location)
+
+    kind, datetime_object = plan_weather_summary(date_time)
+    if kind == 'invalid':
+        return datetime_object
+
+    json_data = get_weather_data(coordinates, include=SUMMARY_INCLUDE[kind])
+    res = summarize_weather(kind, json_data, datetime_object)
+    return finish_weather_summary(res, date_time, coordinates, datetime_object)
+
+
+async def get_coordinates_async(location):
+    # type: (str) -> dict
+    """
+    asyncio version of get_coordinates
+    """
+    json_data = await aio_web.get_json(GOOGLE_MAPS_GEOCODE_URL, params=generate_geocode_params(location))
+    return parse_coordinates(json_data)
+
+
+async def get_weather_data_async(coordinates, include=None):
+    # type: (dict, Optional(list[str])) -> dict
+    """
+    asyncio version of get_weather_data
+    """
+    url = generate_darksky_url(coordinates)
+    return await aio_web.get_json(url, params=generate_darksky_params(include))
+
+
+@intent('weather', prefix=True, pass_query_result=True, cache_ttl=INTENT_CACHE_TTLS['weather'],
+        cache_per_user=False)
+async def weather_action_async(query_result: dict):
+    """
+    asyncio version of weather_action
+    """
+    location, date_time = parse_weather_request(query_result)
+    coordinates = await get_coordinates_async(location)
+
+    kind, datetime_object = plan_weather_summary(date_time)
+    if kind == 'invalid':
+        return datetime_object
+
+    json_data = await get_weather_data_async(coordinates, include=SUMMARY_INCLUDE[kind])
+    res = summarize_weather(kind, json_data, datetime_object)
+    return finish_weather_summary(res, date_time, coordinates, datetime_object)
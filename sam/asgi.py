@@ -0,0 +1,85 @@
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+
+from .constants import DEADLINE_ACKNOWLEDGEMENT, WEBHOOK_DEADLINE
+from .context import isolated
+from .deadline import deadline
+from .exceptions import DeadlineExceededError, SamError
+from .json_ import dumpb, loads
+from .requesthandlers import handle_sam_request_async
+from .runner import app as wsgi_app
+from .sessions.aio import aio_web
+
+
+async def read_body(receive) -> bytes:
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def send_json(send, data, status_code=200):
+    body = dumpb(data)
+    await send({
+        'type': 'http.response.start',
+        'status': status_code,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def handle_webhook(json_data: dict) -> str:
+    with deadline(WEBHOOK_DEADLINE):
+        return await handle_sam_request_async(json_data)
+
+
+async def dialogflow_webhook_post_endpoint(scope, receive, send):
+    """
+    Handle requests from dialogflow, on the event loop, within WEBHOOK_DEADLINE.
+    Every request is handled in a context of its own, so concurrent requests never see each other's user or deadline
+    """
+    try:
+        json_data = loads(await read_body(receive) or b'{}')
+        res = await asyncio.wait_for(isolated(handle_webhook(json_data)), WEBHOOK_DEADLINE)
+    except (DeadlineExceededError, asyncio.TimeoutError):
+        await send_json(send, {'fulfillmentText': DEADLINE_ACKNOWLEDGEMENT})
+    except SamError as error:
+        await send_json(send, error.to_dict(), error.status_code)
+    else:
+        await send_json(send, {'fulfillmentText': res})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await aio_web.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def create_asgi_app(flask_app=None):
+    """
+    ASGI entry point. The Dialogflow webhook runs on the async handler pipeline,
+    every other route set up by routes.setup_routes is served by the Flask app, on a thread.
+    """
+    wsgi = WsgiToAsgi(flask_app or wsgi_app)
+
+    async def app_(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == '/dialogflow_webhook' and scope['method'] == 'POST':
+            await dialogflow_webhook_post_endpoint(scope, receive, send)
+        else:
+            await wsgi(scope, receive, send)
+    return app_
+
+
+app = create_asgi_app()
@@ -0,0 +1,86 @@
+import importlib
+import logging
+import os
+
+from .constants import SAM_COMPONENTS
+
+log = logging.getLogger(__name__)
+
+
+class Component:
+    """
+    Optional part of SAM (e.g. music), with the modules that implement it and the environment variables
+    it can't do without. The modules of a component are only imported when it is enabled
+    """
+    def __init__(self, name: str, modules: tuple=(), required_env: tuple=()):
+        """
+        :param modules:         Modules to import when the component is loaded (importing them registers intents)
+        :param required_env:    Environment variables that have to be set for the component to work
+        """
+        self.name = name
+        self.modules = modules
+        self.required_env = required_env
+
+    def missing_env(self) -> list:
+        return [name for name in self.required_env if not os.environ.get(name)]
+
+    @property
+    def configured(self) -> bool:
+        return not self.missing_env()
+
+    def load(self):
+        for module in self.modules:
+            importlib.import_module(module, __package__)
+
+
+COMPONENTS = {component.name: component for component in [
+    Component('weather',
+              modules=('.action_handlers.weather',),
+              required_env=('DARK_SKY_KEY', 'GOOGLE_MAPS_TIMEZONE_KEY', 'GOOGLE_MAPS_GEOCODE_KEY')),
+    Component('music',
+              modules=('.action_handlers.music',),
+              required_env=('SPOTIFY_CLIENT_ID', 'SPOTIFY_CLIENT_SECRET', 'SPOTIFY_AUTHORIZATION_URL',
+                            'SPOTIFY_REDIRECT_URI')),
+    Component('calendar',
+              modules=('.action_handlers.calendar_',),
+              required_env=('GOOGLE_CALENDAR_CLIENT_ID', 'GOOGLE_CALENDAR_CLIENT_SECRET',
+                            'GOOGLE_CALENDAR_PROJECT_ID', 'GOOGLE_CALENDAR_REDIRECT_URI', 'GOOGLE_CALENDAR_SCOPE')),
+    # Only used by /query, for the utterances the local matcher doesn't recognize
+    Component('dialogflow',
+              required_env=('DIALOGFLOW_CLIENT_ACCESS_TOKEN',)),
+]}
+
+
+def enabled_components(setting: str=SAM_COMPONENTS) -> list:
+    """
+    :param setting: Comma separated names of the components to enable, 'auto' for every configured component,
+                    or 'none'
+    :returns: Names of the enabled components. Components that are not configured are left out
+    """
+    setting = setting.strip().lower()
+    if setting == 'auto':
+        return [name for name, component in COMPONENTS.items() if component.configured]
+    if setting == 'none':
+        return []
+    enabled = []
+    for name in filter(None, (name.strip() for name in setting.split(','))):
+        component = COMPONENTS.get(name)
+        if component is None:
+            log.warning('Unknown component %s, skipping it', name)
+        elif not component.configured:
+            log.warning('Component %s is missing %s, skipping it', name, ', '.join(component.missing_env()))
+        else:
+            enabled.append(name)
+    return enabled
+
+
+def load_components(setting: str=SAM_COMPONENTS) -> list:
+    """
+    Import the modules of the enabled components
+    :returns: Names of the loaded components
+    """
+    names = enabled_components(setting)
+    for name in names:
+        COMPONENTS[name].load()
+    log.info('Loaded components: %s', ', '.join(names) or 'none', extra={'components': names})
+    return names
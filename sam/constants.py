@@ -1,40 +1,53 @@
 import os
 
+# Components (music, calendar, weather, dialogflow) to enable, comma separated.
+# By default, every component whose environment variables are set
+SAM_COMPONENTS = os.environ.get('SAM_COMPONENTS', 'auto')
+
+# Key of the endpoints acting on behalf of a given user (?user=<user id>).
+# Without it, they only serve the user bound to the session
+SAM_API_KEY = os.environ.get('SAM_API_KEY')
+
 # Constants related to weather functionality
 
-DARK_SKY_URL = 'https://api.darksky.net/forecast/'
-DARK_SKY_KEY = os.environ['DARK_SKY_KEY']
+DARK_SKY_URL = os.environ.get('DARK_SKY_URL', 'https://api.darksky.net/forecast/')
+DARK_SKY_KEY = os.environ.get('DARK_SKY_KEY')
 
 GOOGLE_MAPS_TIMEZONE_URL = 'https://maps.googleapis.com/maps/api/timezone/json'
-GOOGLE_MAPS_TIMEZONE_KEY = os.environ['GOOGLE_MAPS_TIMEZONE_KEY']
-GOOGLE_MAPS_GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
-GOOGLE_MAPS_GEOCODE_KEY = os.environ['GOOGLE_MAPS_GEOCODE_KEY']
+GOOGLE_MAPS_TIMEZONE_KEY = os.environ.get('GOOGLE_MAPS_TIMEZONE_KEY')
+GOOGLE_MAPS_GEOCODE_URL = os.environ.get('GOOGLE_MAPS_GEOCODE_URL',
+                                         'https://maps.googleapis.com/maps/api/geocode/json')
+GOOGLE_MAPS_GEOCODE_KEY = os.environ.get('GOOGLE_MAPS_GEOCODE_KEY')
 DAYLIGHT_SAVINGS = True
 
 WEATHER_PARAMETERS = ['currently', 'minutely', 'hourly', 'daily', 'alerts', 'flags']
 
 # Constants related to the Spotify API
 
-SPOTIFY_CLIENT_ID = os.environ['SPOTIFY_CLIENT_ID']
-SPOTIFY_CLIENT_SECRET = os.environ['SPOTIFY_CLIENT_SECRET']
-SPOTIFY_BASE_AUTHORIZATION_URL = os.environ['SPOTIFY_AUTHORIZATION_URL']
-SPOTIFY_REDIRECT_URI = os.environ['SPOTIFY_REDIRECT_URI']
+SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID')
+SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET')
+SPOTIFY_BASE_AUTHORIZATION_URL = os.environ.get('SPOTIFY_AUTHORIZATION_URL')
+SPOTIFY_REDIRECT_URI = os.environ.get('SPOTIFY_REDIRECT_URI')
 SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
 SPOTIFY_SCOPE = ['user-read-playback-state', 'user-read-currently-playing', 'user-modify-playback-state',
-                 'playlist-modify-public', 'playlist-modify-private']
+                 'playlist-modify-public', 'playlist-modify-private', 'playlist-read-private',
+                 'user-library-read', 'user-follow-read']
+SPOTIFY_PLAYLIST_TRACKS_LIMIT = 100  # Max number of uris per add-tracks request
 
 # Constants related to the Google Calendar API
 
-GOOGLE_CALENDAR_CLIENT_ID = os.environ['GOOGLE_CALENDAR_CLIENT_ID']
-GOOGLE_CALENDAR_CLIENT_SECRET = os.environ['GOOGLE_CALENDAR_CLIENT_SECRET']
-GOOGLE_CALENDAR_PROJECT_ID = os.environ['GOOGLE_CALENDAR_PROJECT_ID']
+GOOGLE_CALENDAR_CLIENT_ID = os.environ.get('GOOGLE_CALENDAR_CLIENT_ID')
+GOOGLE_CALENDAR_CLIENT_SECRET = os.environ.get('GOOGLE_CALENDAR_CLIENT_SECRET')
+GOOGLE_CALENDAR_PROJECT_ID = os.environ.get('GOOGLE_CALENDAR_PROJECT_ID')
 GOOGLE_CALENDAR_AUTHORIZATION_URI = 'https://accounts.google.com/o/oauth2/auth'
-GOOGLE_CALENDAR_REDIRECT_URI = os.environ['GOOGLE_CALENDAR_REDIRECT_URI']
+GOOGLE_CALENDAR_REDIRECT_URI = os.environ.get('GOOGLE_CALENDAR_REDIRECT_URI')
 GOOGLE_CALENDAR_TOKEN_URI = 'https://www.googleapis.com/oauth2/v3/token'
-GOOGLE_CALENDAR_SCOPE = os.environ['GOOGLE_CALENDAR_SCOPE']
+GOOGLE_CALENDAR_SCOPE = os.environ.get('GOOGLE_CALENDAR_SCOPE')
 GOOGLE_CALENDAR_CERTS_URI = 'https://www.googleapis.com/oauth2/v1/certs'
 GOOGLE_CALENDAR_WRAPPER_STR = '_CALENDAR_WRAPPER'
-GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS = os.environ['GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS'].split('_')
+GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS = [
+    id_ for id_ in os.environ.get('GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS', '').split('_') if id_
+]
 
 # Constants related to file serving
 
@@ -43,9 +56,66 @@ SAMPLE_DIALOGFLOW_REQUESTS_DIRECTORY = os.path.abspath(os.path.join(STATIC_FILES
                                                                     'sample_dialogflow_requests'))
 SPOTIFY_PLAYLISTS_FILE = os.path.abspath(os.path.join(STATIC_FILES_DIRECTORY,
                                                       'spotify_playlists.json'))
+
+# Constants related to locally persisted data
+DATA_DIRECTORY = os.path.abspath(os.environ.get('SAM_DATA_DIRECTORY', os.path.join(os.getcwd(), '.sam')))
+SPOTIFY_LIBRARY_FILE = os.path.join(DATA_DIRECTORY, 'spotify_library.db')
+SPOTIFY_LIBRARY_SYNC_INTERVAL = int(os.environ.get('SPOTIFY_LIBRARY_SYNC_INTERVAL', 3600))
+STATE_BACKEND = os.environ.get('SAM_STATE_BACKEND', 'sqlite')  # 'sqlite' (shared by all workers) or 'memory'
+STATE_FILE = os.path.join(DATA_DIRECTORY, 'state.db')
+HTTP_CACHE_FILE = os.path.join(DATA_DIRECTORY, 'http_cache.db')
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+HTTP_CACHE_TTLS = [  # (url regex, seconds) for APIs that don't send useful caching headers
+    (r'maps\.googleapis\.com/maps/api/geocode/', 30 * 24 * 60 * 60),
+    (r'maps\.googleapis\.com/maps/api/timezone/', 24 * 60 * 60),
+    (r'api\.darksky\.net/forecast/', 5 * 60),
+]
+USER_SESSIONS_MAX = int(os.environ.get('USER_SESSIONS_MAX', 256))  # Per-user sessions kept in memory
+TOKEN_REFRESH_MARGIN = int(os.environ.get('TOKEN_REFRESH_MARGIN', 300))  # Seconds before expiry
+BATCH_MAX_SIZE = 100  # Max number of requests in a batch
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 8))  # Requests of batches handled concurrently
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))  # Threads running deferred (slow) intents
+SAM_WARMUP = os.environ.get('SAM_WARMUP', 'off')  # Warmup stage on startup: 'off', 'background' or 'blocking'
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', 2))  # Connections opened per upstream host on warmup
+JOBS_MAX = int(os.environ.get('JOBS_MAX', 64))  # Deferred jobs queued or running at once, per worker
+JOBS_TTL = 86400  # Seconds deferred jobs (and their results) are kept
+INTENT_CACHE_MAX_ENTRIES = 1024  # Responses of cacheable intents kept in memory, per worker
+INTENT_CACHE_TTLS = {  # Seconds the responses of idempotent intents may be cached
+    'weather': 5 * 60,
+    'calendar': 60,
+}
 # Constants related to dialogflow connection
-DIALOGFLOW_CLIENT_ACCESS_TOKEN = os.environ['DIALOGFLOW_CLIENT_ACCESS_TOKEN']
+DIALOGFLOW_CLIENT_ACCESS_TOKEN = os.environ.get('DIALOGFLOW_CLIENT_ACCESS_TOKEN')
+
+# Constants related to upstream connections
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 10))
+WEBHOOK_DEADLINE = float(os.environ.get('WEBHOOK_DEADLINE', 4.5))  # Dialogflow gives up on the webhook after 5s
+STALE_RESPONSE_TTL = int(os.environ.get('STALE_RESPONSE_TTL', 24 * 60 * 60))  # Fallback for slow upstreams
+UPSTREAM_POOL_SIZES = {  # Max number of pooled connections per upstream host
+    'api.spotify.com': 32,
+    'accounts.spotify.com': 4,
+    'www.googleapis.com': 16,
+    'maps.googleapis.com': 8,
+    'api.darksky.net': 8,
+}
+CIRCUIT_BREAKER_WINDOW = 20  # Number of recent calls the error rate of an upstream host is computed over
+CIRCUIT_BREAKER_MIN_CALLS = 5
+CIRCUIT_BREAKER_ERROR_RATE = 0.5  # Error rate at which calls to an upstream host fail fast
+CIRCUIT_BREAKER_SLOW_CALL = float(os.environ.get('CIRCUIT_BREAKER_SLOW_CALL', 2.5))  # Slow calls count as errors
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.environ.get('CIRCUIT_BREAKER_OPEN_SECONDS', 30))
+UPSTREAM_HEDGE_PERCENTILES = {  # Idempotent GETs slower than this latency percentile get a hedged duplicate
+    'api.darksky.net': 95,
+    'maps.googleapis.com': 95,
+}
+UPSTREAM_HEDGE_MIN_SAMPLES = 20  # Latencies to observe before hedging
 
 # Constants related to inner SAM workings
 NOT_IMPLEMENTED = 'Not implemented yet!'
-SPOTIFY_WRAPPER_STR = '_SPOTIFY_WRAPPER'  # For logging
+DEFERRED_ACKNOWLEDGEMENT = "I'm working on it, ask me anything in a moment and I'll tell you the result."
+DEADLINE_ACKNOWLEDGEMENT = 'Sorry, that is taking longer than expected. Please try again in a moment.'
+SPOTIFY_WRAPPER_STR = '_SPOTIFY_WRAPPER'  # OAuth2 state of the Spotify sessions
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' (one object per line) or 'text'
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))  # Share of DEBUG/INFO records that is written
+LOG_QUEUE_SIZE = 10000  # Records waiting to be written. Once full, new records are dropped
@@ -0,0 +1,74 @@
+import types
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+DEFAULT_USER = 'default'
+
+# ID of the user on whose behalf the current request is handled
+current_user = ContextVar('current_user', default=DEFAULT_USER)
+
+
+def user_id_from_request(json_data: dict, is_known=None) -> str:
+    """
+    Determine the user a Dialogflow request was made by.
+    The user ID from the originalDetectIntentRequest payload is preferred, since it is stable across conversations.
+    Otherwise, the Dialogflow session is used.
+    :param is_known:    Predicate telling whether a user ID was set up (e.g. has logged in to a component).
+                        IDs it rejects are skipped, so requests of unknown users act on behalf of DEFAULT_USER
+
+    :returns: str - ID of the user, DEFAULT_USER if the request doesn't identify a known user
+    """
+    payload = (json_data.get('originalDetectIntentRequest') or dict()).get('payload') or dict()
+    user = payload.get('user') or dict()
+    candidates = [user.get('userId') or user.get('id') or payload.get('userId')]
+    if json_data.get('session'):
+        candidates.append(json_data['session'].split('/')[-1])
+    for user_id in candidates:
+        if user_id and (is_known is None or is_known(str(user_id))):
+            return str(user_id)
+    return DEFAULT_USER
+
+
+@contextmanager
+def user_context(user_id: str):
+    """
+    Handle everything inside the with block on behalf of ```user_id```
+    """
+    token = current_user.set(user_id or DEFAULT_USER)
+    try:
+        yield
+    finally:
+        current_user.reset(token)
+
+
+def bind_context(func):
+    """
+    Bind ```func``` to a copy of the current context (current user, ...), so that it can be run on another thread.
+    Bind once per call: a context can't be entered by two threads at once.
+    """
+    context = copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+@types.coroutine
+def isolated(coro):
+    """
+    Run the coroutine ```coro``` in a copy of the current context, so that what it sets (current user, deadline, ...)
+    is only seen by ```coro```. asyncio tasks only get a context of their own from python 3.7 on: with the
+    contextvars backport, all tasks share the context of the event loop's thread.
+    Every step of ```coro``` is run inside the copy, so it must not be wrapped in a task itself.
+    """
+    context = copy_context()
+    value, error = None, None
+    while True:
+        try:
+            if error is None:
+                future = context.run(coro.send, value)
+            else:
+                future = context.run(coro.throw, error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = (yield future), None
+        except BaseException as e:
+            value, error = None, e
@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+from .exceptions import DeadlineExceededError
+
+# Absolute (monotonic) time by which the current request has to be answered
+_deadline = ContextVar('deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Answer everything inside the with block within ```seconds```.
+    Nested deadlines can only shorten the enclosing one.
+    """
+    at = monotonic() + seconds
+    enclosing = _deadline.get()
+    token = _deadline.set(at if enclosing is None else min(at, enclosing))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    :returns: Seconds left before the current deadline, None if there is no deadline
+    """
+    at = _deadline.get()
+    if at is None:
+        return None
+    return at - monotonic()
+
+
+def check_deadline():
+    """
+    :raises DeadlineExceededError: If the current deadline has passed
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceededError('The deadline for this request has passed', 504)
+
+
+def shrink_timeout(timeout):
+    """
+    Shrink a requests timeout (seconds, or (connect, read) tuple), so it doesn't outlast the current deadline
+    :raises DeadlineExceededError: If the current deadline has already passed
+    """
+    check_deadline()
+    left = remaining()
+    if left is None:
+        return timeout
+    if isinstance(timeout, tuple):
+        return tuple(left if part is None else min(part, left) for part in timeout)
+    return left if timeout is None else min(timeout, left)
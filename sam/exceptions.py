@@ -1,4 +1,4 @@
-import json
+from .json_ import loads
 
 
 class SamError(Exception):
@@ -20,7 +20,7 @@ class SamError(Exception):
         rv['errorType'] = str(type(self).__name__)
         if self.payload:
             if self.payload.startswith('{'):
-                rv['payload'] = json.loads(self.payload)
+                rv['payload'] = loads(self.payload)
             else:
                 rv['payload'] = self.payload
         return rv
@@ -65,3 +65,35 @@ class SpotifyPlaylistNotfoundError(SamError):
     """
     def __init__(self, message, status_code=None, payload=None):
         super().__init__(message, status_code, payload)
+
+
+class DeadlineExceededError(SamError):
+    """
+    The request could not be answered before its deadline
+    """
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message, status_code, payload)
+
+
+class TooManyJobsError(SamError):
+    """
+    Too many deferred jobs are queued or running to accept another one
+    """
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message, status_code, payload)
+
+
+class CircuitOpenError(SamError):
+    """
+    An upstream host is failing, so it isn't called for now
+    """
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message, status_code, payload)
+
+
+class SpotifyTrackNotfoundError(SamError):
+    """
+    None of the requested Spotify Tracks were found
+    """
+    def __init__(self, message, status_code=None, payload=None):
+        super().__init__(message, status_code, payload)
@@ -0,0 +1,319 @@
+import asyncio
+import inspect
+import threading
+from collections import OrderedDict
+from time import perf_counter, time
+
+from .constants import DEFERRED_ACKNOWLEDGEMENT, INTENT_CACHE_MAX_ENTRIES
+from .context import bind_context, current_user
+from .exceptions import InvalidDataFormatError
+from .jobs import job_queue
+from .json_ import dumps
+from .metrics import dispatch_seconds, handler_seconds, intent_cache_lookups
+from .sessions.cache import generation, track_dependencies
+from .utils import parse_action
+
+
+class Intent:
+    """
+    Route from a Dialogflow action to the handler(s) performing it
+    """
+    def __init__(self, action: str, prefix: bool=False, params: dict=None, pass_query_result: bool=False,
+                 cache_ttl: float=None, cache_tags: tuple=(), cache_per_user: bool=True, deferred: bool=False,
+                 utterances: tuple=()):
+        self.action = action
+        self.prefix = prefix
+        self.params = params or dict()
+        self.pass_query_result = pass_query_result
+        self.cache_ttl = cache_ttl
+        self.cache_tags = tuple(cache_tags)
+        self.cache_per_user = cache_per_user
+        self.deferred = deferred
+        self.utterances = tuple(utterances)
+        self.handler = None
+        self.async_handler = None
+        # Arguments in params that a handler has no default for
+        self.required = set()
+
+    def options(self) -> dict:
+        """
+        :returns: dict - the options the route was registered with (see IntentRegistry.register)
+        """
+        return {'params': self.params, 'pass_query_result': self.pass_query_result, 'cache_ttl': self.cache_ttl,
+                'cache_tags': self.cache_tags, 'cache_per_user': self.cache_per_user, 'deferred': self.deferred,
+                'utterances': self.utterances}
+
+    def set_handler(self, handler):
+        """
+        Set ```handler``` as the route's handler, or as its asyncio variant if it is a coroutine function
+        """
+        if asyncio.iscoroutinefunction(handler):
+            self.async_handler = handler
+        else:
+            self.handler = handler
+        self.required.update(name for name, parameter in inspect.signature(handler).parameters.items()
+                             if name in self.params and parameter.default is parameter.empty)
+
+    def arguments(self, query_result: dict) -> tuple:
+        """
+        Extract the handler's arguments from ```query_result```, according to the declared parameter schema.
+        Parameters Dialogflow left blank are omitted, so the handler's defaults apply
+        :returns: tuple - (args, kwargs)
+        :raises InvalidDataFormatError: If a parameter the handler has no default for was left blank
+        """
+        if self.pass_query_result:
+            return (query_result,), dict()
+        parameters = query_result.get('parameters') or dict()
+        kwargs = dict()
+        for name, key in self.params.items():
+            value = parameters.get(key)
+            if value not in (None, '', []):
+                kwargs[name] = value
+        missing = sorted(self.params[name] for name in self.required if name not in kwargs)
+        if missing:
+            raise InvalidDataFormatError(f'{", ".join(missing)} parameter(s) missing for action {self.action}')
+        return (), kwargs
+
+    def cache_key(self, query_result: dict, kwargs: dict) -> tuple:
+        """
+        Key of the cached response to ```query_result```: the action, the normalized parameters, the user
+        (unless the response is the same for every user) and the time bucket (of cache_ttl seconds)
+        """
+        if self.pass_query_result:
+            contexts = query_result.get('outputContexts') or []
+            kwargs = {'parameters': query_result.get('parameters'),
+                      'contexts': [context.get('parameters') for context in contexts]}
+        return (query_result.get('action'),
+                current_user.get() if self.cache_per_user else None,
+                dumps(normalize(kwargs), sort_keys=True),
+                int(time() // self.cache_ttl))
+
+
+def normalize(value):
+    """
+    Normalize parameter values, so that e.g. 'Amsterdam ' and 'amsterdam' share a cached response
+    """
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    return value
+
+
+class ResponseCache:
+    """
+    In-process LRU cache of the responses of intents declared with a cache_ttl.
+    Entries are never served after their time bucket ends, or after cached data they were derived from changed
+    (see sessions.cache.generation)
+    """
+    def __init__(self, max_entries: int=INTENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple):
+        """
+        :returns: tuple - (whether ```key``` was cached, the cached response)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        # Generations live in the state backend, don't hold the lock while reading them.
+        # An outdated entry is replaced once the handler ran again
+        if entry is not None and any(generation(tag) != value for tag, value in entry[1]):
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            return True, entry[0]
+
+    def set(self, key: tuple, response, generations: dict=None):
+        """
+        :param generations: {tag: generation} of the cached data ```response``` was derived from
+        """
+        with self._lock:
+            self._entries[key] = (response, tuple((generations or dict()).items()))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self._entries), 'max_entries': self.max_entries}
+
+
+class IntentRegistry:
+    """
+    Maps Dialogflow actions to their handlers. Routes are resolved with (at most) two dict lookups:
+    the exact action first, then the domain of the action (its first component) for prefix routes
+    """
+    def __init__(self, cache: ResponseCache=None):
+        self._exact = dict()
+        self._prefixes = dict()
+        self.cache = cache or ResponseCache()
+
+    def register(self, handler, action: str, prefix: bool=False, params: dict=None, pass_query_result: bool=False,
+                 cache_ttl: float=None, cache_tags: tuple=(), cache_per_user: bool=True, deferred: bool=False,
+                 utterances: tuple=()):
+        """
+        Register ```handler``` for ```action```. Coroutine functions are registered as the asyncio variant
+        of the route, so a route can have both a synchronous and an asyncio handler, declared with the same options
+        :param prefix:              Whether ```action``` is a domain (e.g. 'weather') whose every action
+                                    (e.g. 'weather.time.followup') is handled by ```handler```
+        :param params:              {handler argument: Dialogflow parameter} the handler is called with
+        :param pass_query_result:   Call ```handler``` with the whole queryResult instead
+        :param cache_ttl:           Number of seconds the responses of ```handler``` may be cached.
+                                    None (the default) for handlers that mutate state, or must always be fresh
+        :param cache_tags:          Tags of cached data (see sessions.cache.invalidate) the responses are derived
+                                    from, besides the cached upstream responses the handler reads
+        :param cache_per_user:      Whether the responses depend on the user they are for
+        :param deferred:            Whether ```handler``` is too slow for the webhook, so it may run as a background
+                                    job, whose result is delivered on the user's next turn (see jobs.py)
+        :param utterances:          Templates of common utterances for ```action```, with its Dialogflow parameters
+                                    as slots, e.g. 'turn the volume up by {percentage}' (see matcher.py)
+        :raises ValueError: If ```action``` was already registered with other options
+        """
+        routes = self._prefixes if prefix else self._exact
+        new_route = Intent(action, prefix=prefix, params=params, pass_query_result=pass_query_result,
+                           cache_ttl=cache_ttl, cache_tags=cache_tags, cache_per_user=cache_per_user,
+                           deferred=deferred, utterances=utterances)
+        route = routes.setdefault(action, new_route)
+        options, new_options = route.options(), new_route.options()
+        if options != new_options:
+            conflicts = sorted(name for name, value in new_options.items() if options[name] != value)
+            raise ValueError(f'{action} was already registered with other {", ".join(conflicts)}')
+        route.set_handler(handler)
+        return handler
+
+    def resolve(self, action: str) -> Intent:
+        """
+        :raises InvalidDataFormatError: If no handler is registered for ```action```
+        """
+        route = self._exact.get(action)
+        if route is None and action:
+            domain, _, _ = parse_action(action)
+            route = self._prefixes.get(domain)
+        if route is None:
+            raise InvalidDataFormatError(f'action is not supported: {action}')
+        return route
+
+    def utterances(self) -> list:
+        """
+        :returns: list - (action, template) for every utterance template declared by an exact route
+        """
+        return [(action, template) for action, route in self._exact.items() for template in route.utterances]
+
+    def actions(self) -> list:
+        return sorted(list(self._exact) + [f'{domain}.*' for domain in self._prefixes])
+
+    def dispatch(self, query_result: dict, defer: bool=False):
+        """
+        Perform the action of ```query_result```, or answer with the cached response if the route is cacheable
+        :param defer:   Whether deferred routes should run as a background job. If so, an acknowledgement is
+                        returned right away, and the job's result is delivered on the user's next turn
+        """
+        route = self.resolve(query_result.get('action'))
+        start, outcome = perf_counter(), 'error'
+        try:
+            args, kwargs = route.arguments(query_result)
+            hit, res = self._cached(route, query_result, kwargs)
+            if hit:
+                outcome = 'cached'
+                return res
+            if defer and route.deferred:
+                job_queue.submit(self._call, route, query_result, args, kwargs,
+                                 action=query_result.get('action'), query_text=query_result.get('queryText'))
+                outcome = 'deferred'
+                return DEFERRED_ACKNOWLEDGEMENT
+            res = self._call(route, query_result, args, kwargs)
+            outcome = 'handled'
+            return res
+        finally:
+            dispatch_seconds.observe(perf_counter() - start, route.action, outcome)
+
+    def _cached(self, route: Intent, query_result: dict, kwargs: dict) -> tuple:
+        """
+        :returns: (hit, cached response) - (False, None) for routes that aren't cacheable
+        """
+        if route.cache_ttl is None:
+            return False, None
+        hit, res = self.cache.get(route.cache_key(query_result, kwargs))
+        intent_cache_lookups.inc(route.action, 'hit' if hit else 'miss')
+        return hit, res
+
+    def _call(self, route: Intent, query_result: dict, args: tuple, kwargs: dict):
+        with track_dependencies() as tags:
+            res = self._run(route.handler, args, kwargs)
+        if route.cache_ttl is not None:
+            self._cache_response(route, query_result, kwargs, res, tags)
+        return res
+
+    async def dispatch_async(self, query_result: dict):
+        """
+        asyncio version of dispatch. Routes without an asyncio handler run on the loop's default executor,
+        so they never block the loop
+        """
+        route = self.resolve(query_result.get('action'))
+        start, outcome = perf_counter(), 'error'
+        try:
+            args, kwargs = route.arguments(query_result)
+            hit, res = self._cached(route, query_result, kwargs)
+            if hit:
+                outcome = 'cached'
+                return res
+            with track_dependencies() as tags:
+                if route.async_handler is not None:
+                    with handler_seconds.time(route.async_handler.__name__):
+                        res = await route.async_handler(*args, **kwargs)
+                else:
+                    loop = asyncio.get_event_loop()
+                    res = await loop.run_in_executor(None, bind_context(lambda: self._run(route.handler, args,
+                                                                                          kwargs)))
+            if route.cache_ttl is not None:
+                self._cache_response(route, query_result, kwargs, res, tags)
+            outcome = 'handled'
+            return res
+        finally:
+            dispatch_seconds.observe(perf_counter() - start, route.action, outcome)
+
+    @staticmethod
+    def _run(handler, args: tuple, kwargs: dict):
+        with handler_seconds.time(handler.__name__):
+            return handler(*args, **kwargs)
+
+    def _cache_response(self, route: Intent, query_result: dict, kwargs: dict, res, tags: set):
+        # Generations are read after the handler ran: fetching the data may have bumped them
+        generations = {tag: generation(tag) for tag in set(route.cache_tags) | tags}
+        self.cache.set(route.cache_key(query_result, kwargs), res, generations)
+
+
+registry = IntentRegistry()
+
+
+def intent(action: str, prefix: bool=False, params: dict=None, pass_query_result: bool=False,
+           cache_ttl: float=None, cache_tags: tuple=(), cache_per_user: bool=True, deferred: bool=False,
+           utterances: tuple=()):
+    """
+    Decorator registering the decorated function as the handler of ```action```, see IntentRegistry.register
+    e.g.:
+        @intent('music.transfer', params={'device_in': 'device'})
+        def transfer_to_device(device_in: str):
+            ...
+    """
+    def decorator(func):
+        return registry.register(func, action, prefix=prefix, params=params, pass_query_result=pass_query_result,
+                                 cache_ttl=cache_ttl, cache_tags=cache_tags, cache_per_user=cache_per_user,
+                                 deferred=deferred, utterances=utterances)
+    return decorator
@@ -0,0 +1,168 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import Context
+from time import time
+from uuid import uuid4
+
+from .constants import JOB_WORKERS, JOBS_MAX, JOBS_TTL
+from .context import current_user, user_context
+from .exceptions import TooManyJobsError
+from .state import StateBackend, get_backend
+
+log = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Job:
+    """
+    Handler call that runs in the background, on behalf of a user
+    """
+    def __init__(self, user_id: str, action: str, query_text: str=None):
+        self.id = uuid4().hex
+        self.user_id = user_id
+        self.action = action
+        self.query_text = query_text
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time()
+        self.finished_at = None
+        self.delivered = False
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def summary(self) -> str:
+        """
+        :returns: What to tell the user about the finished job
+        """
+        about = f'About "{self.query_text}"' if self.query_text else f'About your {self.action} request'
+        if self.status == FAILED:
+            return f'{about}: sorry, that failed. {self.error}'
+        return f'{about}: {self.result}'
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'user': self.user_id,
+            'action': self.action,
+            'queryText': self.query_text,
+            'status': self.status,
+            'result': self.result,
+            'error': self.error,
+            'createdAt': self.created_at,
+            'finishedAt': self.finished_at,
+            'delivered': self.delivered,
+        }
+
+
+class JobQueue:
+    """
+    Queue of jobs, run by a pool of worker threads.
+    The jobs are kept in the state backend, so that any worker process can report on them and deliver their results.
+    Jobs are kept for ```ttl``` seconds, or until they are dropped from their user's ```max_jobs``` most recent jobs.
+    """
+    namespace = 'jobs'
+
+    def __init__(self, max_workers: int=JOB_WORKERS, max_jobs: int=JOBS_MAX, ttl: float=JOBS_TTL,
+                 backend: StateBackend=None):
+        """
+        :param max_jobs:    Max number of jobs queued or running at once in this process,
+                            and number of recent jobs kept per user
+        :param backend:     By default, the process-wide state backend
+        """
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sam-jobs')
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> StateBackend:
+        return self._backend or get_backend()
+
+    def submit(self, func, *args, action: str=None, query_text: str=None, **kwargs) -> Job:
+        """
+        Run ```func(*args, **kwargs)``` in the background, on behalf of the current user.
+        The job runs without the deadline of the request that submitted it
+        :raises TooManyJobsError: If ```max_jobs``` jobs are already queued or running
+        """
+        with self._lock:
+            if self._active >= self.max_jobs:
+                raise TooManyJobsError('I have too much on my plate right now, ask me again in a moment', 503)
+            self._active += 1
+        try:
+            job = Job(current_user.get(), action, query_text)
+            self._save(job)
+            with self.backend.lock(self.namespace):
+                job_ids = self.backend.get(self.namespace, f'user:{job.user_id}', [])
+                self.backend.set(self.namespace, f'user:{job.user_id}', (job_ids + [job.id])[-self.max_jobs:],
+                                 ttl=self.ttl)
+            # A fresh context, so only the user carries over from the submitting request
+            self._executor.submit(Context().run, self._run, job, func, args, kwargs)
+        except BaseException:
+            self._done()
+            raise
+        return job
+
+    def _run(self, job: Job, func, args, kwargs):
+        try:
+            job.status = RUNNING
+            self._save(job)
+            with user_context(job.user_id):
+                try:
+                    job.result = func(*args, **kwargs)
+                    job.status = DONE
+                except Exception as e:
+                    job.error = getattr(e, 'message', str(e))
+                    job.status = FAILED
+                    log.exception('Job %s (%s) failed', job.id, job.action,
+                                  extra={'job': job.id, 'action': job.action})
+            job.finished_at = time()
+            self._save(job)
+        finally:
+            self._done()
+
+    def _done(self):
+        with self._lock:
+            self._active -= 1
+
+    def _save(self, job: Job):
+        self.backend.set(self.namespace, f'job:{job.id}', job, ttl=self.ttl)
+
+    def get(self, job_id: str) -> Job:
+        """
+        :returns: The job with id ```job_id```, None if there is no such job (anymore)
+        """
+        return self.backend.get(self.namespace, f'job:{job_id}')
+
+    def jobs_of(self, user_id: str) -> list:
+        """
+        :returns: The recent jobs of ```user_id```, oldest first
+        """
+        jobs = (self.get(job_id) for job_id in self.backend.get(self.namespace, f'user:{user_id}', []))
+        return [job for job in jobs if job is not None]
+
+    def undelivered(self, user_id: str) -> list:
+        """
+        :returns: The finished jobs of ```user_id``` whose result wasn't delivered yet (see mark_delivered)
+        """
+        return [job for job in self.jobs_of(user_id) if job.finished and not job.delivered]
+
+    def mark_delivered(self, jobs: list):
+        """
+        Mark ```jobs``` as delivered, once their results made it into a response
+        """
+        for job in jobs:
+            job.delivered = True
+            self._save(job)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,93 @@
+import json
+import os
+from datetime import date, datetime, time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj):
+    """
+    Serialize what JSON doesn't know: dates and times as ISO 8601, as orjson does natively, anything else as str
+    """
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    return str(obj)
+
+
+class JSONBackend:
+    """
+    JSON encoder/decoder used for webhook bodies, error payloads and upstream responses
+    """
+    name = None
+
+    def loads(self, data):
+        """
+        :param data: str or (UTF-8) bytes
+        """
+        raise NotImplementedError
+
+    def dumpb(self, obj, sort_keys: bool=False) -> bytes:
+        raise NotImplementedError
+
+    def dumps(self, obj, sort_keys: bool=False) -> str:
+        return self.dumpb(obj, sort_keys=sort_keys).decode()
+
+
+class StdlibBackend(JSONBackend):
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumpb(self, obj, sort_keys=False):
+        return self.dumps(obj, sort_keys=sort_keys).encode()
+
+    def dumps(self, obj, sort_keys=False):
+        # Compact, like orjson, and without escaping non-ASCII characters
+        return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False, default=default)
+
+
+class OrjsonBackend(JSONBackend):
+    name = 'orjson'
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumpb(self, obj, sort_keys=False):
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, default=default, option=option)
+
+
+BACKENDS = {
+    'json': StdlibBackend,
+    'orjson': OrjsonBackend,
+}
+
+_backend = BACKENDS[os.environ.get('SAM_JSON_BACKEND', 'orjson' if orjson is not None else 'json')]()
+
+
+def get_json_backend() -> JSONBackend:
+    """
+    :returns: The configured (SAM_JSON_BACKEND) JSON backend. orjson if it's installed, the stdlib json otherwise
+    """
+    return _backend
+
+
+def set_json_backend(backend: JSONBackend):
+    global _backend
+    _backend = backend
+
+
+def loads(data):
+    return _backend.loads(data)
+
+
+def dumps(obj, sort_keys: bool=False) -> str:
+    return _backend.dumps(obj, sort_keys=sort_keys)
+
+
+def dumpb(obj, sort_keys: bool=False) -> bytes:
+    return _backend.dumpb(obj, sort_keys=sort_keys)
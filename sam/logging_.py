@@ -0,0 +1,117 @@
+import atexit
+import logging
+import queue
+import random
+import sys
+import threading
+from time import gmtime
+from logging.handlers import QueueHandler, QueueListener
+
+from .constants import LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATE
+from .context import current_user
+from .json_ import dumps
+
+# Attributes every LogRecord has, anything else was passed with extra= and is a structured field
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'user'}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through only ```rate``` of the records below WARNING. Warnings and errors are always kept
+    """
+    def __init__(self, rate: float=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class ContextFilter(logging.Filter):
+    """
+    Tag records with the user the current request is handled for, before they leave the request's thread
+    """
+    def filter(self, record):
+        if not hasattr(record, 'user'):
+            record.user = current_user.get()
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting the message to the listener thread, off the request path.
+    Drops records instead of blocking when the queue is full
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DeferredQueueHandler.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, user, message, the fields passed with extra= and the exception
+    """
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'user': getattr(record, 'user', None),
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return dumps(entry)
+
+
+FORMATTERS = {
+    'json': lambda: JSONFormatter(datefmt='%Y-%m-%dT%H:%M:%SZ'),
+    'text': lambda: logging.Formatter('%(asctime)s-%(levelname)s %(name)s [%(user)s]: %(message)s',
+                                      datefmt='%Y-%m-%dT%H:%M:%SZ'),
+}
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def setup_logging(level: str=LOG_LEVEL, format_: str=LOG_FORMAT, sample_rate: float=LOG_SAMPLE_RATE,
+                  stream=None) -> QueueListener:
+    """
+    Route the records of SAM's loggers through a bounded queue to a background thread writing them to ```stream```.
+    Records below ```level``` are discarded before any formatting happens.
+    Has to run in every worker (after the fork), since the writer thread doesn't survive a fork
+    :param format_:     'json' or 'text'
+    :param sample_rate: Share of the DEBUG/INFO records that is written
+    :param stream:      By default, stdout
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return _listener
+        formatter = FORMATTERS[format_]()
+        formatter.converter = gmtime
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(formatter)
+
+        handler = DeferredQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        handler.addFilter(SamplingFilter(sample_rate))
+        handler.addFilter(ContextFilter())
+
+        logger = logging.getLogger(__package__)
+        logger.setLevel(level.upper())
+        logger.addHandler(handler)
+        logger.propagate = False
+
+        _listener = QueueListener(handler.queue, output)
+        _listener.start()
+        # Write what is still queued on shutdown
+        atexit.register(_listener.stop)
+        return _listener
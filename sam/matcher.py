@@ -0,0 +1,112 @@
+import re
+
+# Slots whose values are restricted. Any other slot matches one or more words
+SLOT_PATTERNS = {
+    'percentage': re.compile(r'\d{1,3}%?'),
+    'shuffle': re.compile(r'on|off'),
+    'repeat_mode': re.compile(r'track|context|off'),
+}
+SLOT = re.compile(r'^\{(\w+)\}$')
+WORD = re.compile(r"[\w%'{}]+")
+
+
+def tokenize(text: str) -> list:
+    return WORD.findall(text.lower())
+
+
+def split_words(text: str) -> list:
+    """
+    Words of ```text``` as they were written, tokenize(text) are the same words lowercased
+    """
+    return WORD.findall(text)
+
+
+class _Node:
+    __slots__ = ('children', 'slots', 'actions')
+
+    def __init__(self):
+        self.children = dict()
+        self.slots = []
+        self.actions = []
+
+
+class IntentMatcher:
+    """
+    Matches utterances against templates (e.g. 'turn the volume up by {percentage}'), compiled into a token trie.
+    Only unambiguous matches of a whole utterance are returned: anything else is left to Dialogflow.
+    """
+    def __init__(self, utterances=()):
+        """
+        :param utterances: Iterable of (action, template)
+        """
+        self._root = _Node()
+        for action, template in utterances:
+            self.add(action, template)
+
+    def add(self, action: str, template: str):
+        node = self._root
+        literals = 0
+        for token in tokenize(template):
+            slot = SLOT.match(token)
+            if slot:
+                name = slot.group(1)
+                child = next((child for name_, child in node.slots if name_ == name), None)
+                if child is None:
+                    child = _Node()
+                    node.slots.append((name, child))
+                node = child
+            else:
+                literals += 1
+                node = node.children.setdefault(token, _Node())
+        node.actions.append((action, literals))
+
+    def _matches(self, node: _Node, tokens: list, words: list, i: int, slots: tuple):
+        if i == len(tokens):
+            for action, literals in node.actions:
+                yield action, literals, slots
+            return
+        child = node.children.get(tokens[i])
+        if child is not None:
+            yield from self._matches(child, tokens, words, i + 1, slots)
+        for name, child in node.slots:
+            pattern = SLOT_PATTERNS.get(name)
+            for j in range(i + 1, len(tokens) + 1):
+                if pattern is None:
+                    # Free slots keep the casing of the utterance (song titles, names, ...)
+                    value = ' '.join(words[i:j])
+                else:
+                    value = ' '.join(tokens[i:j])
+                    if not pattern.fullmatch(value):
+                        continue
+                yield from self._matches(child, tokens, words, j, slots + ((name, value),))
+
+    def match(self, text: str):
+        """
+        :returns: dict - queryResult for ```text```, or None if no template matches it unambiguously
+        """
+        words = split_words(text or '')
+        tokens = [word.lower() for word in words]
+        if not tokens:
+            return None
+        matches = list(self._matches(self._root, tokens, words, 0, ()))
+        if not matches:
+            return None
+        # The match with the most literal words wins, unless another equally specific match disagrees with it
+        most_literals = max(literals for _, literals, _ in matches)
+        best = {(action, slots) for action, literals, slots in matches if literals == most_literals}
+        if len(best) > 1:
+            return None
+        action, slots = best.pop()
+        return {
+            'queryText': text,
+            'action': action,
+            'parameters': dict(slots),
+            'intentDetectionConfidence': 1.0,
+        }
+
+
+def build_matcher(registry) -> IntentMatcher:
+    """
+    Compile the utterances declared by the intents of ```registry```
+    """
+    return IntentMatcher(registry.utterances())
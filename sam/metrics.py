@@ -0,0 +1,198 @@
+import re
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from urllib.parse import urlsplit
+
+# Upper bounds (seconds) of the latency buckets: from a cached answer to a request that blows the webhook deadline
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Series:
+    """
+    Values of a single combination of label values
+    """
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets: int=0):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metric:
+    """
+    Family of series sharing a name, one per combination of label values.
+    Metrics are kept per worker process, like the other stats endpoints
+    """
+    type_ = None
+
+    def __init__(self, name: str, help_: str, labelnames: tuple=()):
+        self.name = name
+        self.help = help_
+        self.labelnames = labelnames
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def _new_series(self) -> _Series:
+        return _Series()
+
+    def _get(self, labels: tuple) -> _Series:
+        series = self._series.get(labels)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(labels, self._new_series())
+        return series
+
+    def collect(self) -> list:
+        """
+        :returns: Exposition lines in the Prometheus text format
+        """
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type_}']
+        for labels, values in series:
+            lines.extend(self._collect_series(dict(zip(self.labelnames, labels)), values))
+        return lines
+
+    def _collect_series(self, labels: dict, series: _Series) -> list:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_ = 'counter'
+
+    def inc(self, *labels, amount: float=1):
+        """
+        :param labels:  Values of the labels, in the order of ```labelnames```
+        """
+        series = self._get(labels)
+        with self._lock:
+            series.count += amount
+
+    def value(self, *labels) -> float:
+        return self._get(labels).count
+
+    def _collect_series(self, labels, series):
+        return [f'{self.name}{format_labels(labels)} {series.count}']
+
+
+class Histogram(Metric):
+    """
+    Cumulative histogram with fixed buckets. Observing is a bisect over the bucket bounds and three increments
+    """
+    type_ = 'histogram'
+
+    def __init__(self, name: str, help_: str, labelnames: tuple=(), buckets: tuple=LATENCY_BUCKETS):
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        # The last bucket is +Inf
+        return _Series(len(self.buckets) + 1)
+
+    def observe(self, value: float, *labels):
+        """
+        :param labels:  Values of the labels, in the order of ```labelnames```
+        """
+        series = self._get(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """
+        Observe how long the with block takes
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labels)
+
+    def _collect_series(self, labels, series):
+        lines = list()
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), series.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{self.name}_bucket{format_labels(dict(labels, le=le))} {cumulative}')
+        lines.append(f'{self.name}_sum{format_labels(labels)} {series.sum}')
+        lines.append(f'{self.name}_count{format_labels(labels)} {series.count}')
+        return lines
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_: str, labelnames: tuple=()) -> Counter:
+        return self._register(Counter, name, help_, labelnames)
+
+    def histogram(self, name: str, help_: str, labelnames: tuple=(), buckets: tuple=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_, labelnames, buckets=buckets)
+
+    def exposition(self) -> str:
+        """
+        :returns: All metrics, in the Prometheus text exposition format (version 0.0.4)
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.collect()) + '\n'
+
+
+metrics = MetricsRegistry()
+
+dispatch_seconds = metrics.histogram('sam_dispatch_seconds',
+                                     'Time to answer an intent, cache lookups and deferring included',
+                                     ('action', 'outcome'))
+handler_seconds = metrics.histogram('sam_handler_seconds', 'Time spent in intent handlers', ('handler',))
+intent_cache_lookups = metrics.counter('sam_intent_cache_lookups_total', 'Lookups in the intent response cache',
+                                       ('action', 'result'))
+upstream_seconds = metrics.histogram('sam_upstream_seconds', 'Latency of upstream calls',
+                                     ('host', 'endpoint', 'method', 'status'))
+http_cache_lookups = metrics.counter('sam_http_cache_lookups_total', 'Lookups of upstream GETs in the HTTP cache',
+                                     ('host', 'result'))
+
+# Path segments that identify a resource rather than an endpoint (ids, coordinates, API keys, e-mail addresses)
+_ID_SEGMENT = re.compile(r'\d|@|^[A-Za-z0-9_-]{20,}$')
+_VERSION_SEGMENT = re.compile(r'^v\d+$')
+ENDPOINT_MAX_SEGMENTS = 5
+
+
+def normalize_endpoint(path: str) -> str:
+    """
+    Collapse the ids in an upstream path, so that every endpoint is a single label value
+    e.g. '/v1/albums/4aawyAB9vmqN3uQ7FjRGTy/tracks' -> '/v1/albums/:id/tracks'
+    """
+    segments = [':id' if _ID_SEGMENT.search(segment) and not _VERSION_SEGMENT.match(segment) else segment
+                for segment in path.split('/')[1:ENDPOINT_MAX_SEGMENTS + 1]]
+    return '/' + '/'.join(segments)
+
+
+def observe_upstream(method: str, url: str, status, elapsed: float):
+    """
+    :param status:  Status code of the response, 'cache' if it came from the HTTP cache, 'error' if there was none
+    """
+    parts = urlsplit(url)
+    upstream_seconds.observe(elapsed, parts.hostname, normalize_endpoint(parts.path), method, str(status))
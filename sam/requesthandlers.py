@@ -1,14 +1,26 @@
-from .action_handlers.calendar_ import calender_action
-from .action_handlers.music import music_action
-from .action_handlers.weather import weather_action
-from .exceptions import InvalidDataFormatError
-from .utils import log, logged, now_str
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import BATCH_MAX_SIZE, BATCH_MAX_WORKERS
+from .context import bind_context, user_context, user_id_from_request
+from .exceptions import InvalidDataFormatError, SamError
+from .intents import registry
+from .jobs import job_queue
+from .sessions.token_store import token_store
+from .utils import Timer, logged
+
+log = logging.getLogger(__name__)
+
+# Bounded pool the items of batch requests run on, shared by all batch requests
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='sam-batch')
 
 
 @logged
-def handle_sam_request(json_data: dict) -> dict:
+def handle_sam_request(json_data: dict, defer: bool=False) -> dict:
     """
     Handles the incoming request, by taking the appropriate action
+    :param defer:   Whether slow (deferred) intents may run as a background job. If so, the results of the user's
+                    jobs that finished in the meantime are delivered along with the response
     :returns: The appropriate str response for the specified action
 
     Minimal example for json_data. This will play Damn Album by Kendrick Lamar on Spotify
@@ -25,13 +37,58 @@ def handle_sam_request(json_data: dict) -> dict:
     query_result = json_data.get('queryResult')
     action = query_result.get('action')
 
-    if action.startswith('music'):
-        res = music_action(json_data)
-    elif action.startswith('calendar'):
-        res = calender_action(json_data)
-    elif action.startswith('weather'):
-        res = weather_action(json_data)
-    else:
-        raise InvalidDataFormatError(f'action is not supported: {action}')
-    log(f'{now_str()}-DEBUG_ACTION: {action}')
+    user_id = user_id_from_request(json_data, is_known=token_store.has_token)
+    with user_context(user_id):
+        finished_jobs = job_queue.undelivered(user_id) if defer else []
+        res = registry.dispatch(query_result, defer=defer)
+    if finished_jobs and isinstance(res, str):
+        res = ' '.join([job.summary() for job in finished_jobs] + [res])
+        # Only now the results are sure to reach the user
+        job_queue.mark_delivered(finished_jobs)
+    log.debug('Handled %s', action, extra={'action': action, 'user': user_id})
+    return res
+
+
+def handle_batch_item(json_data: dict) -> dict:
+    """
+    Handle a single request of a batch. Errors are returned instead of raised, so they don't fail the whole batch
+    :returns: dict - The response (or error) and how long it took to handle the request
+    """
+    with Timer() as timer:
+        try:
+            res = {'fulfillmentText': handle_sam_request(json_data), 'statusCode': 200}
+        except SamError as error:
+            res = dict(error.to_dict(), statusCode=error.status_code)
+        except Exception as error:
+            res = {'fulfillmentText': str(error), 'errorType': type(error).__name__, 'statusCode': 500}
+    res['responseTime'] = timer.response_time()
+    return res
+
+
+def handle_sam_requests(json_datas: list) -> list:
+    """
+    Handle a batch of requests concurrently, on the batch executor.
+    Items that need the same upstream resource share its fetch (see sessions.singleflight)
+    :returns: The response (or error) for each request, in the same order
+    """
+    if not isinstance(json_datas, list):
+        raise InvalidDataFormatError('A batch must be a list of Dialogflow requests')
+    if len(json_datas) > BATCH_MAX_SIZE:
+        raise InvalidDataFormatError(f'A batch can contain at most {BATCH_MAX_SIZE} requests', 413)
+    futures = [batch_executor.submit(bind_context(handle_batch_item), json_data) for json_data in json_datas]
+    return [future.result() for future in futures]
+
+
+async def handle_sam_request_async(json_data: dict) -> str:
+    """
+    asyncio version of handle_sam_request.
+    Actions with a native asyncio implementation are awaited on the event loop,
+    the others run on the loop's default executor, so they never block the loop.
+    """
+    query_result = json_data.get('queryResult')
+    action = query_result.get('action')
+
+    with user_context(user_id_from_request(json_data, is_known=token_store.has_token)):
+        res = await registry.dispatch_async(query_result)
+    log.debug('Handled %s', action, extra={'action': action})
     return res
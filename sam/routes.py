@@ -1,41 +1,164 @@
+import hmac
 import json
 import os
+import queue
+
+from flask import (Response, make_response, redirect, request, send_file,
+                   session, stream_with_context)
+
+from .constants import (DEADLINE_ACKNOWLEDGEMENT, SAM_API_KEY,
+                        SAMPLE_DIALOGFLOW_REQUESTS_DIRECTORY,
+                        STATIC_FILES_DIRECTORY, WEBHOOK_DEADLINE)
+from .context import DEFAULT_USER, user_context
+from .deadline import deadline
+from .exceptions import DeadlineExceededError, InvalidDataFormatError, SamError
+from .intents import registry
+from .jobs import job_queue
+from .json_ import dumpb, loads
+from .matcher import build_matcher
+from .metrics import metrics
+from .requesthandlers import handle_sam_request, handle_sam_requests
+from .sessions.cache import get_http_cache
+from .sessions.resilience import circuit_breaker_stats, hedge_stats
+from .sessions.transport import transport_stats
+from .utils import Timer
+from .warmup import warmup
 
-from flask import make_response, redirect, request, send_file
-from flask.json import jsonify
 
-from .constants import (SAMPLE_DIALOGFLOW_REQUESTS_DIRECTORY,
-                        STATIC_FILES_DIRECTORY)
-from .requesthandlers import handle_sam_request
-from .utils import Timer
-from .wrappers import calendar_, dialogflow, spotify
+def jsonify(obj, status: int=200) -> Response:
+    """
+    flask.jsonify, with the configured JSON backend (see json_.py)
+    """
+    return Response(dumpb(obj), status=status, mimetype='application/json')
+
+
+def request_json():
+    """
+    Decode the body of the current request with the configured JSON backend, whatever its content type
+    :returns: The decoded body, None if it isn't valid JSON
+    """
+    try:
+        return loads(request.get_data())
+    except ValueError:
+        return None
 
 
-def setup_routes(app):
-    setup_dialogflow_endpoints(app)
-    setup_calendar_endpoints(app)
-    setup_music_endpoints(app)
-    setup_weather_endpoints(app)
+def authenticated_user():
+    """
+    User the current request acts on behalf of, remembered in the (signed) session for the next requests.
+    Choosing another user than the session's one with ?user=<user id> requires the SAM_API_KEY,
+    given as an "Authorization: Bearer <key>" header or as ?key=<key>
+    :returns: The user id
+    """
+    session_user = session.get('sam_user', DEFAULT_USER)
+    user_id = request.args.get('user', session_user)
+    if user_id != session_user:
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            key = authorization[len('Bearer '):]
+        else:
+            key = request.args.get('key', '')
+        if SAM_API_KEY is None or not hmac.compare_digest(key, SAM_API_KEY):
+            raise SamError(f'Acting on behalf of user {user_id} requires a valid SAM_API_KEY', 401)
+        session['sam_user'] = user_id
+    return user_id
+
+
+def setup_routes(app, components=()):
+    """
+    :param components:  Names of the enabled components (see components.py), only they get their endpoints
+    """
+    setup_dialogflow_endpoints(app, use_dialogflow='dialogflow' in components)
+    if 'calendar' in components:
+        setup_calendar_endpoints(app)
+    if 'music' in components:
+        setup_music_endpoints(app)
+    if 'weather' in components:
+        setup_weather_endpoints(app)
     setup_sample_endpoints(app)
     setup_static_endpoints(app)
+    setup_status_endpoints(app)
     return app
 
 
-def setup_dialogflow_endpoints(app):
+def setup_dialogflow_endpoints(app, use_dialogflow=True):
+    """
+    :param use_dialogflow:  Whether /query falls back to Dialogflow for the utterances the local matcher
+                            doesn't know
+    """
+    # Common commands are matched locally, without a round trip to Dialogflow
+    matcher = build_matcher(registry)
+
     @app.route("/dialogflow_webhook", methods=['POST'])
     def dialogflow_webhook_post_endpoint():
         """
-        Handle requests from dialogflow
+        Handle requests from dialogflow.
+        Every upstream call has to fit in the time Dialogflow gives the webhook (WEBHOOK_DEADLINE),
+        if that's not possible, the user gets a quick acknowledgement instead of a timeout.
+        Slow intents are deferred to the job queue, their result is delivered on the user's next turn
         """
-        json_data = request.get_json(silent=True, force=True)
-        res = handle_sam_request(json_data)
+        json_data = request_json()
+        try:
+            with deadline(WEBHOOK_DEADLINE):
+                res = handle_sam_request(json_data, defer=True)
+        except DeadlineExceededError:
+            res = DEADLINE_ACKNOWLEDGEMENT
         return jsonify({
             'fulfillmentText': res
         })
 
+    @app.route('/dialogflow_webhook_batch', methods=['POST'])
+    def dialogflow_webhook_batch_post_endpoint():
+        """
+        Handle a batch of Dialogflow requests concurrently.
+        The body is a list of Dialogflow request bodies, or {"requests": [...]}.
+        Every item gets its own response (or error), status code and responseTime
+        """
+        json_data = request_json()
+        if isinstance(json_data, dict):
+            json_data = json_data.get('requests')
+        with Timer() as timer:
+            items = handle_sam_requests(json_data)
+        return jsonify({
+            'items': items,
+            'responseTime': timer.response_time()
+        })
+
+    @app.route('/jobs', methods=['GET'])
+    def jobs_get_endpoint():
+        """
+        State of the deferred jobs of the authenticated user (see authenticated_user)
+        """
+        jobs = job_queue.jobs_of(authenticated_user())
+        return jsonify([job.to_dict() for job in jobs])
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_get_endpoint(job_id):
+        """
+        State (and result, once finished) of a deferred job of the authenticated user
+        """
+        job = job_queue.get(job_id)
+        if job is None or job.user_id != authenticated_user():
+            return jsonify({'fulfillmentText': f'Job {job_id} not found'}, status=404)
+        return jsonify(job.to_dict())
+
     @app.route('/query', methods=['POST'])
     def query_post_endpoint():
-        res = dialogflow.make_query(request.get_json().get('query'))
+        """
+        Handle a text query. Utterances the local matcher recognizes are handled right away,
+        anything else is interpreted by Dialogflow (which calls the webhook)
+        """
+        body = request_json()
+        if not isinstance(body, dict) or not isinstance(body.get('query'), str):
+            raise InvalidDataFormatError('Expected a JSON object with a "query" string', 400)
+        query = body['query']
+        query_result = matcher.match(query)
+        if query_result is not None:
+            return handle_sam_request({'queryResult': query_result}, defer=True)
+        if not use_dialogflow:
+            raise SamError(f'Could not understand "{query}", and the dialogflow component is disabled', 404)
+        from .wrappers import dialogflow
+        res = dialogflow.make_query(query)
         return res['result']['fulfillment']['speech']
 
     return app
@@ -45,11 +168,16 @@ def setup_calendar_endpoints(app):
     """
     Setup all the endpoints related to calendar functionality
     """
+    from .wrappers import calendar_
+
     @app.route('/calendar_login', methods=['GET'])
     def calendar_login_get_endpoint():
         """
-        Generic authorization request for the Google Calendar API
+        Generic authorization request for the Google Calendar API.
+        Pass ?user=<user id> (and the SAM_API_KEY) to authorize SAM on behalf of a specific user,
+        the callback gets it from the session
         """
+        session['sam_user'] = authenticated_user()
         authorization_url = calendar_.oauth2.authorization_url()
         return redirect(authorization_url)
 
@@ -58,7 +186,8 @@ def setup_calendar_endpoints(app):
         """
         Generic authorization callback for the Google Calendar API
         """
-        calendar_.oauth2.fetch_token(request.url)
+        with user_context(session.get('sam_user', DEFAULT_USER)):
+            calendar_.oauth2.fetch_token(request.url)
         return 'Google Calendar Token has been fetched and saved'
 
     @app.route('/calendar_events', methods=['GET'])
@@ -76,11 +205,17 @@ def setup_music_endpoints(app):
     """
     Setup all the endpoints related to music functionality
     """
+    from .wrappers import spotify
+    from .wrappers.playback_stream import format_event, playback_pollers
+
     @app.route("/spotify_login", methods=['GET'])
     def login_get_endpoint():
         """
-        Generic authorization request for the Spotify API
+        Generic authorization request for the Spotify API.
+        Pass ?user=<user id> (and the SAM_API_KEY) to authorize SAM on behalf of a specific user,
+        the callback gets it from the session
         """
+        session['sam_user'] = authenticated_user()
         authorization_url = spotify.oauth2.authorization_url()
         return redirect(authorization_url)
 
@@ -89,7 +224,8 @@ def setup_music_endpoints(app):
         """
         Generic authorization callback for the Spotify API
         """
-        spotify.oauth2.fetch_token(request.url)
+        with user_context(session.get('sam_user', DEFAULT_USER)):
+            spotify.oauth2.fetch_token(request.url)
         return 'Spotify Token has been fetched and saved'
 
     @app.route("/current_song", methods=['GET'])
@@ -100,6 +236,30 @@ def setup_music_endpoints(app):
         res = spotify.currently_playing().json()
         return jsonify(res)
 
+    @app.route('/current_song_stream', methods=['GET'])
+    def current_song_stream_get_endpoint():
+        """
+        Stream Spotify playback changes as Server-Sent Events, for the authenticated user (see authenticated_user).
+        All open streams of a user share a single background poller.
+        """
+        playback_poller = playback_pollers.get(authenticated_user())
+        # Subscribed right away, so that the poller is in use (and never evicted) as long as the stream is open
+        subscriber = playback_poller.subscribe()
+
+        def stream():
+            while True:
+                try:
+                    state = subscriber.get(timeout=15)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                else:
+                    yield format_event(state)
+
+        response = Response(stream_with_context(stream()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        response.call_on_close(lambda: playback_poller.unsubscribe(subscriber))
+        return response
+
     @app.route('/spotify_token_info', methods=['GET'])
     def spotify_token_info_get_endpoint():
         res = spotify.token_info()
@@ -187,3 +347,56 @@ def setup_static_endpoints(app):
         return 'Happy birthday 😊'
 
     return app
+
+
+def setup_status_endpoints(app):
+    """
+    Setup all the endpoints related to the status of SAM itself
+    """
+    @app.route('/health', methods=['GET'])
+    def health_get_endpoint():
+        """
+        Readiness of this worker: 503 until the warmup stage (SAM_WARMUP) is done, with the outcome of its steps
+        """
+        return jsonify(warmup.status(), status=200 if warmup.ready else 503)
+
+    @app.route('/transport_stats', methods=['GET'])
+    def transport_stats_get_endpoint():
+        """
+        Per upstream host, the number of requests made and how many of them needed a new connection
+        """
+        return jsonify(transport_stats())
+
+    @app.route('/http_cache_stats', methods=['GET'])
+    def http_cache_stats_get_endpoint():
+        """
+        Hits, misses and size of the shared HTTP cache
+        """
+        return jsonify(get_http_cache().stats())
+
+    @app.route('/intent_cache_stats', methods=['GET'])
+    def intent_cache_stats_get_endpoint():
+        """
+        Hits, misses and size of the cache of intent responses (of this worker)
+        """
+        return jsonify(registry.cache.stats())
+
+    @app.route('/upstream_health', methods=['GET'])
+    def upstream_health_get_endpoint():
+        """
+        State of the circuit breaker of every upstream host, and how many GETs were hedged
+        """
+        return jsonify({
+            'circuit_breakers': circuit_breaker_stats(),
+            'hedging': hedge_stats(),
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_get_endpoint():
+        """
+        Latency histograms of dispatch, intent handlers and upstream calls, and cache lookups (of this worker),
+        in the Prometheus text format
+        """
+        return Response(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return app
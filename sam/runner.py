@@ -1,24 +1,46 @@
 import os
-from random import choices
-from string import ascii_uppercase, digits
+import secrets
 
 from flask import Flask
-from flask.json import jsonify
 
+from .components import load_components
 from .exceptions import SamError
-from .routes import setup_routes
+from .logging_ import setup_logging
+from .routes import jsonify, setup_routes
+from .state import get_backend
+from .warmup import start_warmup
+
+
+def secret_key():
+    """
+    Key signing the session cookies. Every worker must use the same one, or a session started on a worker
+    (e.g. by /spotify_login) can't be read by another one (e.g. in /spotify_callback)
+    :returns: The SECRET_KEY environment variable, or else a key generated once and kept in the state backend
+    """
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    backend = get_backend()
+    with backend.lock('secret_key'):
+        key = backend.get('app', 'secret_key')
+        if key is None:
+            key = secrets.token_hex(32)
+            backend.set('app', 'secret_key', key)
+    return key
 
 
 def create_app():
     app_ = Flask(__name__)
-    app_.secret_key = os.environ.get('SECRET_KEY', ''.join(choices(ascii_uppercase + digits, k=12)))
-    setup_routes(app_)
+    app_.secret_key = secret_key()
+    setup_logging()
+    # Only the enabled components are imported, and get their routes
+    components = load_components()
+    setup_routes(app_, components)
+    # Runs in every worker: pooled connections can't be shared across a fork
+    start_warmup(components)
 
     @app_.errorhandler(SamError)
     def handle_invalid_data_format(error):
-        response = jsonify(error.to_dict())
-        response.status_code = error.status_code
-        return response
+        return jsonify(error.to_dict(), status=error.status_code)
     return app_
 
 
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from time import monotonic
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from ..constants import (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_POOL_SIZES,
+                         UPSTREAM_READ_TIMEOUT)
+from ..context import bind_context
+from ..deadline import check_deadline, remaining
+from ..exceptions import (CircuitOpenError, DeadlineExceededError,
+                          NoTokenError, SamError)
+from ..json_ import loads
+from ..metrics import observe_upstream
+from .cache import stale_store
+from .resilience import circuit_breaker
+
+log = logging.getLogger(__name__)
+
+
+def normalize_params(params: dict) -> dict:
+    """
+    aiohttp only accepts str/int/float query parameters. Mirror what requests does for the other types
+    """
+    normalized = dict()
+    for key, value in (params or dict()).items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = str(value).lower()
+        normalized[key] = value
+    return normalized
+
+
+class AsyncResponse(SimpleNamespace):
+    """
+    Fully read upstream response (status_code, url, method, text, json_data)
+    """
+    def json(self):
+        return self.json_data
+
+
+class AsyncWebSession:
+    """
+    asyncio counterpart of WebSession, on top of a single pooled aiohttp.ClientSession
+    """
+    def __init__(self, stale=None):
+        """
+        :param stale:   StaleStore to fall back to when the deadline passes. By default, the shared one
+        """
+        self.stale = stale or stale_store
+        self._session = None
+
+    async def session(self):
+        import aiohttp
+
+        # The ClientSession has to be created inside the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=sum(UPSTREAM_POOL_SIZES.values()), keepalive_timeout=30)
+            timeout = aiohttp.ClientTimeout(sock_connect=UPSTREAM_CONNECT_TIMEOUT,
+                                            sock_read=UPSTREAM_READ_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def request(self, method: str, url: str, params: dict=None, headers: dict=None,
+                      **kwargs) -> AsyncResponse:
+        import aiohttp
+
+        check_deadline()
+        left = remaining()
+        if left is not None and 'timeout' not in kwargs:
+            # Don't outlast the deadline of the current request
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=left, sock_connect=UPSTREAM_CONNECT_TIMEOUT,
+                                                      sock_read=UPSTREAM_READ_TIMEOUT)
+        # Circuit breakers are shared with the synchronous sessions
+        breaker = circuit_breaker(urlsplit(url).hostname)
+        breaker.allow()
+        session = await self.session()
+        start = monotonic()
+        try:
+            async with session.request(method, url, params=normalize_params(params), headers=headers,
+                                       **kwargs) as res:
+                text = await res.text()
+                elapsed = monotonic() - start
+                breaker.record(success=res.status < 500, elapsed=elapsed)
+                observe_upstream(method, url, res.status, elapsed)
+                log.debug('%s %s', method, res.url,
+                          extra={'method': method, 'url': str(res.url), 'status': res.status})
+                json_data = loads(text) if text else None
+                return AsyncResponse(status_code=res.status, url=str(res.url), method=method,
+                                     text=text, json_data=json_data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            breaker.record(success=False)
+            observe_upstream(method, url, 'error', monotonic() - start)
+            if isinstance(e, asyncio.TimeoutError) and left is not None:
+                raise DeadlineExceededError(f'No response from {url} before the deadline', 504) from e
+            raise
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+
+    async def get_json(self, url, params=None, **kwargs) -> dict:
+        """
+        GET json located at url.
+        If it can't be fetched before the deadline, or its host is failing,
+        the last known good json is returned instead
+        """
+        try:
+            res = await self.get(url, params=params, **kwargs)
+        except (DeadlineExceededError, CircuitOpenError) as e:
+            json_data = self.stale.load(url, params)
+            if json_data is None:
+                raise
+            log.info('%s, using stale GET %s', type(e).__name__, url, extra={'url': url})
+            return json_data
+        if 200 <= res.status_code < 300:
+            self.stale.save(url, params, res.json())
+        return res.json()
+
+    async def get(self, url, params=None, **kwargs) -> AsyncResponse:
+        """
+        GET resource located at url
+        """
+        return await self.request('GET', url, params=params, **kwargs)
+
+    async def post(self, url, params=None, **kwargs) -> AsyncResponse:
+        """
+        POST to resource located at url
+        """
+        return await self.request('POST', url, params=params, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class AsyncOAuth2Session:
+    """
+    asyncio counterpart of OAuth2Session. Tokens are owned by the (per-user) synchronous OAuth2Session:
+    this session only borrows its current, proactively refreshed, token
+    """
+    def __init__(self, sync_session, web_session: AsyncWebSession=None):
+        """
+        :param sync_session:    OAuth2Session (or UserSessionProxy) to borrow the token from
+        :param web_session:     AsyncWebSession to make the requests with. By default, the shared one
+        """
+        self.sync_session = sync_session
+        self.web_session = web_session or aio_web
+
+    def _fresh_token(self) -> dict:
+        self.sync_session._ensure_fresh_token()
+        return self.sync_session.token
+
+    async def _authorization_header(self) -> dict:
+        # Reloading/refreshing the token may hit the token store or the token endpoint, so keep it off the loop
+        loop = asyncio.get_event_loop()
+        token = await loop.run_in_executor(None, bind_context(self._fresh_token))
+        if not token:
+            raise NoTokenError(f'SAM does not have a token to connect to {self.sync_session.component} with', 401)
+        return {'Authorization': f'Bearer {token["access_token"]}'}
+
+    async def request(self, method: str, url: str, **kwargs) -> AsyncResponse:
+        headers = await self._authorization_header()
+        res = await self.web_session.request(method, url, headers=headers, **kwargs)
+        if res.status_code == 401:
+            raise NoTokenError(f'SAM does not have a token to connect to {self.sync_session.component} with',
+                               res.status_code)
+        elif res.status_code < 200 or res.status_code >= 300:
+            raise SamError(f'Error during a {method} to {res.url}',
+                           status_code=res.status_code,
+                           payload=res.text)
+        return res
+
+    async def get(self, url: str, params: dict=None, **kwargs) -> AsyncResponse:
+        return await self.request('GET', url, params=params, **kwargs)
+
+    async def post(self, url: str, params: dict=None, **kwargs) -> AsyncResponse:
+        return await self.request('POST', url, params=params, **kwargs)
+
+    async def put(self, url: str, params: dict=None, **kwargs) -> AsyncResponse:
+        return await self.request('PUT', url, params=params, **kwargs)
+
+
+# Shared by all asyncio handlers, closed on ASGI lifespan shutdown
+aio_web = AsyncWebSession()
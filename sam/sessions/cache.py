@@ -0,0 +1,235 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import sha1
+from time import time
+
+from cachecontrol.cache import BaseCache
+from cachecontrol.controller import CacheController
+
+from ..constants import HTTP_CACHE_FILE, HTTP_CACHE_MAX_BYTES, STALE_RESPONSE_TTL
+from ..json_ import dumpb
+from ..state import StateBackend, get_backend
+from .singleflight import request_key
+
+GENERATIONS_NAMESPACE = 'generations'
+GENERATION_TTL = 86400  # Must outlast the cache_ttl of every intent
+
+_dependencies = ContextVar('cache_dependencies', default=None)
+
+
+def invalidate(tag: str, backend: StateBackend=None):
+    """
+    Signal that the cached data tagged with ```tag``` (e.g. a cached upstream response, see url_tag) changed,
+    so everything derived from it is outdated. Generations are kept in the state backend, shared by all workers
+    """
+    backend = backend or get_backend()
+    with backend.lock(GENERATIONS_NAMESPACE):
+        backend.set(GENERATIONS_NAMESPACE, tag, backend.get(GENERATIONS_NAMESPACE, tag, 0) + 1,
+                    ttl=GENERATION_TTL)
+
+
+def generation(tag: str, backend: StateBackend=None) -> int:
+    """
+    :returns: A number that changes every time the cached data tagged with ```tag``` changes
+    """
+    return (backend or get_backend()).get(GENERATIONS_NAMESPACE, tag, 0)
+
+
+def url_tag(url: str) -> str:
+    """
+    :returns: The tag of the cached response to a GET of ```url``` (hashed, upstream urls may contain API keys)
+    """
+    return 'url:' + sha1(CacheController.cache_url(url).encode()).hexdigest()
+
+
+def invalidate_url(url: str):
+    invalidate(url_tag(url))
+
+
+@contextmanager
+def track_dependencies():
+    """
+    Collect the tags of the cached data read while in the block (see depend_on), including in the threads
+    the block's context is bound to
+    :returns: The set of tags, filled as the block runs
+    """
+    tags = set()
+    token = _dependencies.set(tags)
+    try:
+        yield tags
+    finally:
+        _dependencies.reset(token)
+
+
+def depend_on(tag: str):
+    """
+    Record that what is being computed (see track_dependencies) is derived from the cached data
+    tagged with ```tag```
+    """
+    tags = _dependencies.get()
+    if tags is not None:
+        tags.add(tag)
+
+
+class DiskLRUCache(BaseCache):
+    """
+    Size-bounded CacheControl cache in a SQLite database, shared by all workers and kept across restarts.
+    Once the cached responses exceed ```max_bytes```, the least recently used ones are evicted.
+    """
+    # Don't rewrite last_access on every hit, a minute of precision is plenty for LRU eviction
+    ACCESS_RESOLUTION = 60
+
+    def __init__(self, path: str, max_bytes: int=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                               '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires_at REAL, last_access REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)')
+
+    def _connection(self) -> sqlite3.Connection:
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def get(self, key):
+        now = time()
+        connection = self._connection()
+        row = connection.execute('SELECT value, expires_at, last_access FROM responses WHERE key = ?',
+                                 (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            self.misses += 1
+            return None
+        self.hits += 1
+        if now - row[2] > self.ACCESS_RESOLUTION:
+            with connection:
+                connection.execute('UPDATE responses SET last_access = ? WHERE key = ?', (now, key))
+        return row[0]
+
+    def set(self, key, value, expires=None):
+        now = time()
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               (key, value, len(value), now + expires if expires else None, now))
+            self._evict(connection)
+        invalidate_url(key)
+
+    def delete(self, key):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+        invalidate_url(key)
+
+    def _evict(self, connection: sqlite3.Connection):
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in connection.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def preload(self) -> int:
+        """
+        Read every fresh response once, so that the first requests find the database in the OS page cache
+        :returns: Number of fresh responses
+        """
+        entries = 0
+        for _ in self._connection().execute('SELECT value FROM responses WHERE expires_at IS NULL OR expires_at > ?',
+                                            (time(),)):
+            entries += 1
+        return entries
+
+    def stats(self) -> dict:
+        """
+        :returns: Hits, misses and evictions of this process, and the size of the shared cache
+        """
+        entries, size = self._connection().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) '
+                                                   'FROM responses').fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class StaleStore:
+    """
+    Last known good JSON response per request, kept well past its freshness,
+    to answer with when an upstream can't respond before the deadline
+    """
+    def __init__(self, backend: StateBackend=None, namespace: str='stale', ttl: float=STALE_RESPONSE_TTL,
+                 max_saved: int=1024):
+        """
+        :param max_saved:   Number of requests for which this process remembers what it saved last (see save)
+        """
+        self._backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_saved = max_saved
+        self._saved = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> StateBackend:
+        return self._backend or get_backend()
+
+    def key(self, url: str, params: dict=None) -> str:
+        # Keys are hashed, upstream urls may contain API keys
+        return sha1(repr(request_key('GET', url, params)).encode()).hexdigest()
+
+    def load(self, url: str, params: dict=None):
+        return self.backend.get(self.namespace, self.key(url, params))
+
+    def save(self, url: str, params: dict, json_data):
+        """
+        Keep ```json_data``` as the last known good response. Skipped when this process already saved the same
+        response (within half its ttl): most uncached GETs get the same answer as the previous one
+        """
+        key = self.key(url, params)
+        digest = sha1(dumpb(json_data, sort_keys=True)).digest()
+        now = time()
+        with self._lock:
+            saved = self._saved.get(key)
+            if saved is not None and saved[0] == digest and now - saved[1] < self.ttl / 2:
+                return
+        self.backend.set(self.namespace, key, json_data, ttl=self.ttl)
+        with self._lock:
+            self._saved[key] = (digest, now)
+            self._saved.move_to_end(key)
+            while len(self._saved) > self.max_saved:
+                self._saved.popitem(last=False)
+
+
+stale_store = StaleStore()
+
+_http_cache = None
+_http_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> DiskLRUCache:
+    """
+    :returns: The HTTP cache shared by all WebSessions
+    """
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            _http_cache = DiskLRUCache(HTTP_CACHE_FILE, max_bytes=HTTP_CACHE_MAX_BYTES)
+        return _http_cache
@@ -1,7 +1,84 @@
+import heapq
+import logging
+import threading
+from itertools import count
+from time import monotonic, time
+
 from requests import Response
+from requests.auth import HTTPBasicAuth
 from requests_oauthlib import OAuth2Session as OAuth2Session_
 
-from ..utils import log, log_url, now_str, verify_status_code
+from ..context import DEFAULT_USER
+from ..utils import log_url, verify_status_code
+from .singleflight import request_key, singleflight
+from .token_store import token_key
+from .transport import mount_transport
+from .web import read
+
+log = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    """
+    Refreshes the tokens of all OAuth2Sessions shortly before they expire, from a single background thread
+    (a heap of due times), rather than a timer thread per session
+    """
+    def __init__(self):
+        self._heap = []
+        self._entries = dict()
+        self._counter = count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def schedule(self, session, delay: float):
+        """
+        Call ```session```.refresh_token in ```delay``` seconds, instead of when it was scheduled before
+        """
+        with self._condition:
+            self._cancel(session)
+            entry = [monotonic() + delay, next(self._counter), session]
+            self._entries[session] = entry
+            heapq.heappush(self._heap, entry)
+            # Threads don't survive a fork
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='oauth2-refresh', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self, session):
+        with self._condition:
+            self._cancel(session)
+
+    def _cancel(self, session):
+        entry = self._entries.pop(session, None)
+        if entry is not None:
+            # Cancelled entries are skipped once they reach the top of the heap
+            entry[-1] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._heap and self._heap[0][-1] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, _, session = self._heap[0]
+                if due > monotonic():
+                    self._condition.wait(due - monotonic())
+                    continue
+                heapq.heappop(self._heap)
+                del self._entries[session]
+            try:
+                session.refresh_token()
+            except Exception:
+                log.exception('Refreshing the token of %s failed', session)
+
+
+refresh_scheduler = RefreshScheduler()
 
 
 class OAuth2Session:
@@ -13,8 +90,16 @@ class OAuth2Session:
                  authorization_uri=None,
                  scope=None,
                  state='sam_state',
-                 component=None
+                 component=None,
+                 token_store=None,
+                 refresh_margin=300,
+                 user_id=DEFAULT_USER
                  ):
+        """
+        :param token_store:     Persistent store the token is loaded from and saved to (shared by all workers)
+        :param refresh_margin:  Number of seconds before expires_at at which the token is refreshed
+        :param user_id:         ID of the user this session acts on behalf of
+        """
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
@@ -23,37 +108,137 @@ class OAuth2Session:
         self.scope = scope
         self.state = state
         self.component = component
+        self.token_store = token_store
+        self.refresh_margin = refresh_margin
+        self.user_id = user_id
 
         self._session = OAuth2Session_(self.client_id,
                                        redirect_uri=self.redirect_uri,
                                        scope=self.scope,
                                        state=self.state)
+        # Connection pools are shared by the sessions of all users
+        mount_transport(self._session)
         self.token = None
         self.authorization_response = None
+        self._token_version = None
+        self._refresh_lock = threading.Lock()
+        self.load_token()
+
+    @property
+    def token_key(self):
+        return token_key(self.state, self.user_id)
+
+    def close(self):
+        """
+        Stop refreshing the token in the background (the token itself stays in the token store)
+        """
+        refresh_scheduler.cancel(self)
+
+    def _set_token(self, token: dict):
+        self.token = token
+        self._session.token = token
+        self._schedule_refresh()
+
+    def load_token(self, locked: bool=False):
+        """
+        (Re)load the token from the token store, if it was changed since it was last loaded
+        :param locked:  Whether the caller already holds the token store's lock
+        """
+        if self.token_store is None:
+            return
+        version = self.token_store.version()
+        if version is None or version == self._token_version:
+            return
+        self._token_version = version
+        token = self.token_store.load(self.token_key, locked=locked)
+        if token and token != self.token:
+            self._set_token(token)
+
+    def _save_token(self, token: dict, locked: bool=False):
+        self._set_token(token)
+        if self.token_store is not None:
+            self.token_store.save(self.token_key, token, locked=locked)
+            self._token_version = self.token_store.version()
+
+    def _expires_in(self):
+        if not self.token or 'expires_at' not in self.token:
+            return None
+        return self.token['expires_at'] - time()
+
+    def _schedule_refresh(self):
+        expires_in = self._expires_in()
+        if expires_in is None or not self.token.get('refresh_token'):
+            refresh_scheduler.cancel(self)
+            return
+        # A second late, so that the token is surely within the refresh margin by then
+        refresh_scheduler.schedule(self, max(expires_in - self.refresh_margin + 1, 0))
+
+    def refresh_token(self):
+        """
+        Refresh the token, unless another thread or worker already did so
+        """
+        with self._refresh_lock:
+            if self.token_store is None:
+                return self._refresh()
+            with self.token_store.lock():
+                # Another worker may have refreshed the token in the meantime
+                self.load_token(locked=True)
+                return self._refresh(locked=True)
+
+    def _refresh(self, locked: bool=False):
+        expires_in = self._expires_in()
+        if expires_in is None or expires_in > self.refresh_margin or not self.token.get('refresh_token'):
+            return
+        log.info('Refreshing %s Token', self.component, extra={'token_key': self.token_key})
+        try:
+            token = self._session.refresh_token(self.token_uri,
+                                                refresh_token=self.token['refresh_token'],
+                                                auth=HTTPBasicAuth(self.client_id, self.client_secret))
+        except Exception as e:
+            # The next request will refresh inline, or surface the 401 as a NoTokenError
+            log.warning('Refreshing %s Token failed: %s', self.component, e, extra={'token_key': self.token_key})
+            return
+        # Some providers (Google) do not send a new refresh_token
+        token.setdefault('refresh_token', self.token['refresh_token'])
+        self._save_token(token, locked=locked)
+
+    def _ensure_fresh_token(self):
+        self.load_token()
+        expires_in = self._expires_in()
+        if expires_in is not None and expires_in <= self.refresh_margin:
+            self.refresh_token()
 
     @verify_status_code
     @log_url
     def get(self, url: str, data: dict=None, params: dict=None, **kwargs) -> Response:
-        return self._session.get(url, data=data, params=params, **kwargs)
+        self._ensure_fresh_token()
+        if data is not None or kwargs.get('stream') or not self.token:
+            return self._session.get(url, data=data, params=params, **kwargs)
+        # Concurrent identical GETs made with the same token share a single upstream call
+        key = request_key('GET', url, params, auth_identity=self.token.get('access_token'))
+        return singleflight.do(key, lambda: read(self._session.get(url, params=params, **kwargs)))
 
     @verify_status_code
     @log_url
     def post(self, url: str, data: dict=None, params: dict=None, **kwargs)-> Response:
+        self._ensure_fresh_token()
         return self._session.post(url, data=data, params=params, **kwargs)
 
     @verify_status_code
     @log_url
     def put(self, url: str, data: dict=None, params: dict=None, **kwargs) -> Response:
+        self._ensure_fresh_token()
         return self._session.put(url, data=data, params=params, **kwargs)
 
     def authorization_url(self):
         authorization_url_, state = self._session.authorization_url(self.authorization_uri)
-        log(f'{now_str()}-DEBUG{self.state}: Generating {self.component} Authorization URL: {authorization_url_}')
+        log.info('Generating %s Authorization URL: %s', self.component, authorization_url_)
         return authorization_url_
 
     def fetch_token(self, authorization_response_):
-        log(f'{now_str()}-DEBUG{self.state}: Fetching new {self.component} Token')
+        log.info('Fetching new %s Token', self.component, extra={'token_key': self.token_key})
         self.authorization_response = authorization_response_
-        self.token = self._session.fetch_token(self.token_uri,
-                                               authorization_response=self.authorization_response,
-                                               client_secret=self.client_secret)
+        token = self._session.fetch_token(self.token_uri,
+                                          authorization_response=self.authorization_response,
+                                          client_secret=self.client_secret)
+        self._save_token(token)
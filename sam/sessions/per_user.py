@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+from ..context import current_user
+
+
+class PerUserStore:
+    """
+    Bounded LRU of per-user objects (sessions, library mirrors, ...), created lazily by ```factory```.
+    Evicted objects are closed, if they have a close method.
+    """
+    def __init__(self, factory, max_size: int=256, in_use=None):
+        """
+        :param factory:     Callable creating the object for a given user ID
+        :param max_size:    Max number of users kept in memory, not counting the ones in use
+        :param in_use:      Callable telling whether an object is in use, if so it is never evicted
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.in_use = in_use
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str=None):
+        """
+        :param user_id: By default, the current user
+        """
+        if user_id is None:
+            user_id = current_user.get()
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is not None:
+                self._items.move_to_end(user_id)
+                return item
+            item = self._items[user_id] = self.factory(user_id)
+            evicted = list()
+            for candidate_id in list(self._items):
+                if len(self._items) <= self.max_size or candidate_id == user_id:
+                    break
+                candidate = self._items[candidate_id]
+                if self.in_use is not None and self.in_use(candidate):
+                    continue
+                evicted.append(self._items.pop(candidate_id))
+        for evicted_item in evicted:
+            if hasattr(evicted_item, 'close'):
+                evicted_item.close()
+        return item
+
+    def __len__(self):
+        return len(self._items)
+
+
+class UserSessionProxy:
+    """
+    Stand-in for a single session object, forwarding everything to the session of the current user
+    """
+    def __init__(self, store: PerUserStore):
+        self.store = store
+
+    def __getattr__(self, name):
+        return getattr(self.store.get(), name)
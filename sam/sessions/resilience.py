@@ -0,0 +1,200 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic
+
+from ..constants import (CIRCUIT_BREAKER_ERROR_RATE, CIRCUIT_BREAKER_MIN_CALLS,
+                         CIRCUIT_BREAKER_OPEN_SECONDS,
+                         CIRCUIT_BREAKER_SLOW_CALL, CIRCUIT_BREAKER_WINDOW,
+                         UPSTREAM_HEDGE_MIN_SAMPLES,
+                         UPSTREAM_HEDGE_PERCENTILES)
+from ..context import bind_context
+from ..exceptions import CircuitOpenError
+
+log = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Tracks the error rate and latency of the calls to a single upstream host (in this process).
+    Once too many of the recent calls failed or were too slow, the circuit opens: calls fail fast with
+    a CircuitOpenError for ```open_seconds```, after which a single trial call decides whether it closes again.
+    """
+    def __init__(self, host: str,
+                 error_rate: float=CIRCUIT_BREAKER_ERROR_RATE,
+                 window: int=CIRCUIT_BREAKER_WINDOW,
+                 min_calls: int=CIRCUIT_BREAKER_MIN_CALLS,
+                 slow_call: float=CIRCUIT_BREAKER_SLOW_CALL,
+                 open_seconds: float=CIRCUIT_BREAKER_OPEN_SECONDS):
+        """
+        :param error_rate:      Fraction of failed (or slow) calls among the last ```window``` calls
+                                at which the circuit opens
+        :param min_calls:       Min number of recorded calls before the circuit can open
+        :param slow_call:       Number of seconds after which a successful call still counts as a failure
+        :param open_seconds:    Number of seconds the circuit stays open before a trial call is let through
+        """
+        self.host = host
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.rejected = 0
+        self._outcomes = deque(maxlen=window)
+        self._latencies = deque(maxlen=100)
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :raises CircuitOpenError: If calls to this host should fail fast
+        """
+        with self._lock:
+            if self.state == OPEN and monotonic() - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self._trial_in_flight):
+                self._trial_in_flight = self.state == HALF_OPEN
+                return
+            self.rejected += 1
+        raise CircuitOpenError(f'{self.host} is failing, not calling it for now', 503)
+
+    def record(self, success: bool, elapsed: float=None):
+        """
+        Record the outcome of a call to this host
+        :param success: Whether the host answered without a connection error, timeout or 5xx status
+        :param elapsed: Number of seconds the call took, if it got an answer
+        """
+        failed = not success or (elapsed is not None and elapsed > self.slow_call)
+        with self._lock:
+            if elapsed is not None:
+                self._latencies.append(elapsed)
+            if self.state == HALF_OPEN:
+                self._trial_in_flight = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                return
+            self._outcomes.append(failed)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.error_rate):
+                self._open()
+
+    def release(self):
+        """
+        Let another trial call through a half open circuit, without recording an outcome
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = monotonic()
+        log.warning('Circuit for %s opened', self.host, extra={'host': self.host})
+
+    def latency_percentile(self, percentile: float):
+        """
+        :returns: The ```percentile```th percentile of the recent latencies, None if there are too few of them
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(int(len(latencies) * percentile / 100), len(latencies) - 1)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                'state': self.state,
+                'recent_calls': calls,
+                'recent_error_rate': sum(self._outcomes) / calls if calls else 0,
+                'rejected': self.rejected,
+            }
+
+
+_breakers = dict()
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(host: str) -> CircuitBreaker:
+    """
+    :returns: The circuit breaker of ```host```, shared by all sessions of this process
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+
+def circuit_breaker_stats() -> dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.host: breaker.stats() for breaker in breakers}
+
+
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='sam-hedge')
+_hedge_stats = {'hedged': 0, 'hedge_won': 0}
+_hedge_stats_lock = threading.Lock()
+
+
+def _count_hedge(counter: str):
+    with _hedge_stats_lock:
+        _hedge_stats[counter] += 1
+
+
+def hedge_delay(host: str):
+    """
+    :returns: Number of seconds after which a GET to ```host``` gets a hedged duplicate,
+              None if GETs to ```host``` aren't hedged (yet)
+    """
+    percentile = UPSTREAM_HEDGE_PERCENTILES.get(host)
+    if percentile is None:
+        return None
+    return circuit_breaker(host).latency_percentile(percentile)
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def hedged(send, request, delay: float):
+    """
+    Send ```request```, and if it is still in flight after ```delay``` seconds, send a duplicate of it.
+    Only for idempotent requests.
+    :param send:    Callable (request) -> response
+    :returns:       Whichever response arrives first
+    """
+    primary = _hedge_executor.submit(bind_context(send), request)
+    if wait([primary], timeout=delay).done:
+        return primary.result()
+    _count_hedge('hedged')
+    hedge = _hedge_executor.submit(bind_context(send), request.copy())
+    pending = {primary, hedge}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            if future is hedge:
+                _count_hedge('hedge_won')
+            for other in {primary, hedge} - {future}:
+                other.add_done_callback(_close_response)
+            return future.result()
+    raise error
+
+
+def hedge_stats() -> dict:
+    with _hedge_stats_lock:
+        return dict(_hedge_stats)
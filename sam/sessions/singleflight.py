@@ -0,0 +1,66 @@
+import threading
+from hashlib import sha1
+
+from ..deadline import remaining
+from ..exceptions import DeadlineExceededError
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent identical calls: while a call for a given key is in flight,
+    further callers with the same key wait for it and share its result (or exception)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = dict()
+        self.deduplicated = 0
+
+    def do(self, key, func):
+        """
+        Call ```func```, unless a call for ```key``` is already in flight, in which case its result is returned.
+        Waiting for the call in flight never outlasts the deadline of the current request
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.shared += 1
+                self.deduplicated += 1
+
+        if leader:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        elif not call.done.wait(remaining()):
+            raise DeadlineExceededError('The deadline passed while waiting for an identical request', 504)
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+def request_key(method: str, url: str, params: dict=None, auth_identity: str=None) -> tuple:
+    """
+    Key identifying an idempotent request. Credentials are hashed, so they don't linger in memory as keys
+    """
+    if auth_identity is not None:
+        auth_identity = sha1(auth_identity.encode()).hexdigest()
+    return method.upper(), url, repr(sorted((params or dict()).items())), auth_identity
+
+
+singleflight = SingleFlight()
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+
+from ..constants import GOOGLE_CALENDAR_WRAPPER_STR, SPOTIFY_WRAPPER_STR
+from ..context import DEFAULT_USER
+from ..state import StateBackend, get_backend
+
+# OAuth2 states of the components, tokens are saved under token_key(state, user_id)
+TOKEN_STATES = (SPOTIFY_WRAPPER_STR, GOOGLE_CALENDAR_WRAPPER_STR)
+
+
+def token_key(state: str, user_id: str) -> str:
+    """
+    :returns: Key the token of ```user_id```, for the component with OAuth2 state ```state```, is saved under
+    """
+    if user_id == DEFAULT_USER:
+        return state
+    return f'{state}:{user_id}'
+
+
+class StateTokenStore:
+    """
+    Persistent store for OAuth2 tokens, on top of the state backend shared by all worker processes,
+    so a token refreshed by one worker is immediately visible to the others, and survives restarts
+    """
+    namespace = 'tokens'
+
+    def __init__(self, backend: StateBackend=None):
+        """
+        :param backend: By default, the process-wide state backend
+        """
+        self._backend = backend
+
+    @property
+    def backend(self) -> StateBackend:
+        return self._backend or get_backend()
+
+    @contextmanager
+    def lock(self, exclusive: bool=True):
+        if not exclusive:
+            # Reads from the backend are atomic
+            yield
+            return
+        with self.backend.lock(self.namespace):
+            yield
+
+    def version(self):
+        return self.backend.version(self.namespace)
+
+    def load(self, key: str, locked: bool=False):
+        return self.backend.get(self.namespace, key)
+
+    def save(self, key: str, token: dict, locked: bool=False):
+        if not locked:
+            with self.lock():
+                return self.save(key, token, locked=True)
+        self.backend.set(self.namespace, key, dict(token))
+
+    def has_token(self, user_id: str) -> bool:
+        """
+        :returns: Whether a token was saved for ```user_id```, by any component
+        """
+        return any(self.load(token_key(state, user_id)) for state in TOKEN_STATES)
+
+
+token_store = StateTokenStore()
@@ -0,0 +1,339 @@
+import heapq
+import logging
+import socket
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from time import monotonic
+from urllib.parse import urlsplit
+
+from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from ..constants import (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_POOL_SIZES,
+                         UPSTREAM_READ_TIMEOUT)
+from ..deadline import remaining, shrink_timeout
+from ..exceptions import CircuitOpenError, DeadlineExceededError
+from ..json_ import loads
+from ..metrics import observe_upstream
+from .resilience import circuit_breaker, hedge_delay, hedged
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+_stats = defaultdict(lambda: {'requests': 0, 'new_connections': 0})
+_stats_lock = threading.Lock()
+
+
+def _count(host: str, counter: str):
+    with _stats_lock:
+        _stats[host][counter] += 1
+
+
+def transport_stats() -> dict:
+    """
+    :returns: Per upstream host, the number of requests made, the number of new connections opened,
+              and the number of requests that reused an already open connection
+    """
+    with _stats_lock:
+        return {host: dict(stats, reused_connections=stats['requests'] - stats['new_connections'])
+                for host, stats in _stats.items()}
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count(self.host, 'new_connections')
+        return super()._new_conn()
+
+    def _make_request(self, *args, **kwargs):
+        _count(self.host, 'requests')
+        return super()._make_request(*args, **kwargs)
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count(self.host, 'new_connections')
+        return super()._new_conn()
+
+    def _make_request(self, *args, **kwargs):
+        _count(self.host, 'requests')
+        return super()._make_request(*args, **kwargs)
+
+
+class JSONResponse(Response):
+    """
+    Response whose body is decoded with the configured JSON backend (see json_.py)
+    """
+    def json(self, **kwargs):
+        if kwargs:
+            return super().json(**kwargs)
+        try:
+            return loads(self.content)
+        except ValueError:
+            # e.g. a body that isn't UTF-8
+            return super().json()
+
+
+class BodyWatchdog:
+    """
+    Cuts off, from a single background thread (a heap of due times), the responses whose body is still being read
+    when the deadline passes. The read timeout only bounds every single read: a slow but steady upstream
+    could outlast the deadline
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def watch(self, res: Response, delay: float) -> list:
+        """
+        Cut off ```res``` in ```delay``` seconds, unless the returned entry is cancelled before
+        """
+        with self._condition:
+            entry = [monotonic() + delay, next(self._counter), res]
+            heapq.heappush(self._heap, entry)
+            # Threads don't survive a fork
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='body-watchdog', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+            return entry
+
+    def cancel(self, entry: list) -> bool:
+        """
+        :returns:   Whether the response was not cut off yet
+        """
+        with self._condition:
+            pending = entry[-1] is not None
+            # Cancelled entries are skipped once they reach the top of the heap
+            entry[-1] = None
+            return pending
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._heap and self._heap[0][-1] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                due, _, res = entry = self._heap[0]
+                if due > monotonic():
+                    self._condition.wait(due - monotonic())
+                    continue
+                heapq.heappop(self._heap)
+                entry[-1] = None
+            try:
+                self._cut_off(res)
+            except Exception:
+                log.exception('Cutting off the response of %s failed', res.url)
+
+    @staticmethod
+    def _cut_off(res: Response):
+        # Shutting the socket down wakes up the read blocked on it, closing it would not
+        sock = getattr(getattr(res.raw, '_connection', None), 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+body_watchdog = BodyWatchdog()
+
+
+def read_before_deadline(res: Response, chunk_size: int=16 * 1024):
+    """
+    Read the body of the (streamed) response ```res```, giving up once the deadline of the current request passes
+    :raises DeadlineExceededError: If the deadline passed before the whole body was read
+    """
+    left = remaining()
+    entry = body_watchdog.watch(res, max(left, 0))
+    try:
+        content = b''.join(res.iter_content(chunk_size))
+    except (ConnectionError, ChunkedEncodingError, Timeout) as e:
+        res.close()
+        if not body_watchdog.cancel(entry):
+            raise DeadlineExceededError(f'{res.url} did not finish answering before the deadline', 504) from e
+        raise
+    # A response without Content-Length just looks complete once cut off
+    if not body_watchdog.cancel(entry):
+        res.close()
+        raise DeadlineExceededError(f'{res.url} did not finish answering before the deadline', 504)
+    res._content = content
+
+
+class DeadlineRetry(Retry):
+    """
+    Retry policy that gives up once the deadline of the current request has passed
+    """
+    def is_exhausted(self):
+        left = remaining()
+        return super().is_exhausted() or (left is not None and left <= 0)
+
+
+def default_retry() -> Retry:
+    """
+    Retry failed connection attempts, and idempotent reads that hit a gateway error
+    """
+    kwargs = dict(total=2, connect=2, read=0, status=1, backoff_factor=0.1,
+                  status_forcelist=(502, 503, 504), raise_on_status=False)
+    try:
+        return DeadlineRetry(allowed_methods=frozenset(['GET', 'HEAD']), **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return DeadlineRetry(method_whitelist=frozenset(['GET', 'HEAD']), **kwargs)
+
+
+class TransportMixin:
+    """
+    Adapter behaviour shared by all upstream connections:
+        - default (connect, read) timeouts, shrunk to the deadline of the current request (see deadline.py),
+          which also bounds reading the whole body
+        - retry policy
+        - TCP keep-alive on pooled connections
+        - per-host counters of requests and new connections (see transport_stats)
+        - hedged duplicates of GETs that are slower than usual, for the hosts in UPSTREAM_HEDGE_PERCENTILES
+        - JSON bodies decoded with the configured JSON backend
+    """
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout or (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT)
+        kwargs.setdefault('max_retries', default_retry())
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('socket_options', SOCKET_OPTIONS)
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool,
+        }
+
+    def build_response(self, *args, **kwargs):
+        response = super().build_response(*args, **kwargs)
+        response.__class__ = JSONResponse
+        return response
+
+    def send(self, request, timeout=None, **kwargs):
+        timeout = shrink_timeout(timeout or self.timeout)
+        stream = kwargs.get('stream', False)
+        # Under a deadline, the body is read here, chunk by chunk, instead of in one go by requests
+        read_body = not stream and remaining() is not None
+        if read_body:
+            kwargs['stream'] = True
+
+        def send_(request_):
+            return self._send(request_, timeout=timeout, **kwargs)
+
+        host = urlsplit(request.url).hostname
+        delay = hedge_delay(host) if request.method == 'GET' and not stream else None
+        res = send_(request) if delay is None else hedged(send_, request, delay)
+        if read_body:
+            read_before_deadline(res)
+        return res
+
+    def _send(self, request, **kwargs):
+        start = monotonic()
+        try:
+            res = super().send(request, **kwargs)
+        except CircuitOpenError:
+            # Failed fast, nothing was sent upstream
+            raise
+        except (ConnectionError, Timeout) as e:
+            observe_upstream(request.method, request.url, 'error', monotonic() - start)
+            left = remaining()
+            if left is not None and left <= 0:
+                raise DeadlineExceededError(f'No response from {request.url} before the deadline', 504) from e
+            raise
+        except Exception:
+            observe_upstream(request.method, request.url, 'error', monotonic() - start)
+            raise
+        status = 'cache' if getattr(res, 'from_cache', False) else res.status_code
+        observe_upstream(request.method, request.url, status, monotonic() - start)
+        return res
+
+
+class CircuitBreakerMixin:
+    """
+    Per-host circuit breakers around the requests that actually go out to the host, failing fast while it is failing
+    (see resilience.py). Mixed in below any caching adapter, so that cached responses are served while it is open
+    """
+    def send(self, request, **kwargs):
+        breaker = circuit_breaker(urlsplit(request.url).hostname)
+        breaker.allow()
+        start = monotonic()
+        try:
+            res = super().send(request, **kwargs)
+        except Exception:
+            breaker.record(success=False)
+            raise
+        breaker.record(success=res.status_code < 500, elapsed=monotonic() - start)
+        return res
+
+
+class TransportAdapter(TransportMixin, CircuitBreakerMixin, HTTPAdapter):
+    pass
+
+
+def pool_size(host: str) -> int:
+    return UPSTREAM_POOL_SIZES.get(host, DEFAULT_POOL_SIZE)
+
+
+_shared_adapters = dict()
+_shared_adapters_lock = threading.Lock()
+
+
+def shared_adapter(host: str=None) -> TransportAdapter:
+    """
+    :returns: The adapter (and thereby the connection pool) shared by all sessions for ```host```
+    """
+    with _shared_adapters_lock:
+        adapter = _shared_adapters.get(host)
+        if adapter is None:
+            adapter = _shared_adapters[host] = TransportAdapter(pool_maxsize=pool_size(host))
+        return adapter
+
+
+def mount_transport(session, adapter_factory=None):
+    """
+    Mount transport adapters on ```session```: one per configured upstream host (sized by UPSTREAM_POOL_SIZES),
+    plus a default one for all other hosts
+    :param adapter_factory: Callable (host, pool_size) -> adapter. By default, the shared adapters are mounted
+    """
+    adapter_factory = adapter_factory or (lambda host, size: shared_adapter(host))
+    default_adapter = adapter_factory(None, DEFAULT_POOL_SIZE)
+    session.mount('https://', default_adapter)
+    session.mount('http://', default_adapter)
+    for host in UPSTREAM_POOL_SIZES:
+        session.mount(f'https://{host}/', adapter_factory(host, pool_size(host)))
+    return session
+
+
+def open_connections(session, urls, connections: int=2) -> dict:
+    """
+    Open (TLS included) and pool ```connections``` connections to the host of every url,
+    with concurrent HEAD requests through ```session```
+    :returns: Per host, the number of connections that could be opened
+    """
+    origins = {f'{parts.scheme}://{parts.netloc}/' for parts in map(urlsplit, urls)}
+
+    def head(origin):
+        try:
+            session.head(origin, allow_redirects=False)
+        except Exception:
+            return origin, 0
+        return origin, 1
+
+    opened = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=max(len(origins) * connections, 1)) as executor:
+        for origin, count in executor.map(head, [origin for origin in origins for _ in range(connections)]):
+            opened[urlsplit(origin).hostname] += count
+    return dict(opened)
@@ -1,26 +1,119 @@
-from cachecontrol import CacheControl
+import logging
+import re
+from email.utils import formatdate
+from urllib.parse import urlsplit
+
+from cachecontrol.adapter import CacheControlAdapter
 from requests import Session
+from requests.adapters import HTTPAdapter
 
+from ..constants import HTTP_CACHE_TTLS
+from ..exceptions import CircuitOpenError, DeadlineExceededError
+from ..metrics import http_cache_lookups
 from ..utils import log_url
+from .cache import depend_on, get_http_cache, stale_store, url_tag
+from .singleflight import request_key, singleflight
+from .transport import CircuitBreakerMixin, TransportMixin, mount_transport, open_connections
+
+log = logging.getLogger(__name__)
+
+
+class CachingTransportAdapter(TransportMixin, CacheControlAdapter, CircuitBreakerMixin, HTTPAdapter):
+    """
+    Caching adapter that can override the caching headers of APIs that under-specify them.
+    The circuit breakers sit below the cache: fresh cached responses are served even while a host's circuit is open
+    """
+    def __init__(self, *args, ttl_overrides=(), **kwargs):
+        """
+        :param ttl_overrides: Iterable of (url regex, ttl in seconds). GET responses from a matching url
+                              are cached for ttl seconds, whatever their headers say
+        """
+        self.ttl_overrides = [(re.compile(pattern), ttl) for pattern, ttl in ttl_overrides]
+        super().__init__(*args, **kwargs)
+
+    def ttl_for(self, url: str):
+        for pattern, ttl in self.ttl_overrides:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def build_response(self, request, response, from_cache=False, cacheable_methods=None):
+        if request.method == 'GET':
+            http_cache_lookups.inc(urlsplit(request.url).hostname, 'hit' if from_cache else 'miss')
+        if not from_cache and request.method == 'GET' and 200 <= response.status < 300:
+            ttl = self.ttl_for(request.url)
+            if ttl is not None:
+                for header in ('cache-control', 'expires', 'pragma', 'vary'):
+                    response.headers.pop(header, None)
+                response.headers['cache-control'] = f'max-age={ttl}'
+                if 'date' not in response.headers:
+                    response.headers['date'] = formatdate(usegmt=True)
+        return super().build_response(request, response, from_cache=from_cache, cacheable_methods=cacheable_methods)
+
+
+def read(res):
+    """
+    Read the body of ```res``` before it is shared between threads
+    """
+    res.content
+    return res
 
 
 class WebSession:
-    def __init__(self):
-        self._session = CacheControl(Session())
+    def __init__(self, cache=None, ttl_overrides=HTTP_CACHE_TTLS, stale=None):
+        """
+        :param cache:           CacheControl cache for responses. By default, the shared, disk-backed HTTP cache
+        :param ttl_overrides:   Iterable of (url regex, ttl in seconds), see CachingTransportAdapter
+        :param stale:           StaleStore to fall back to when the deadline passes. By default, the shared one
+        """
+        self.stale = stale or stale_store
+        cache = cache or get_http_cache()
+        self._session = mount_transport(Session(),
+                                        lambda host, size: CachingTransportAdapter(cache=cache,
+                                                                                   pool_maxsize=size,
+                                                                                   ttl_overrides=ttl_overrides))
+
+    def open_connections(self, urls, connections: int=2) -> dict:
+        """
+        Fill this session's connection pools for the hosts of ```urls```, see transport.open_connections
+        """
+        return open_connections(self._session, urls, connections)
 
     def get_json(self, url, params=None, data=None, **kwargs):
         # type: (str, Optional[dict[str]]) -> dict
         """
-        GET json located at url
+        GET json located at url.
+        If it can't be fetched before the deadline, or its host is failing,
+        the last known good json is returned instead
         """
-        return self.get(url, params=params, data=data, **kwargs).json()
+        if data is not None:
+            return self.get(url, params=params, data=data, **kwargs).json()
+        try:
+            res = self.get(url, params=params, **kwargs)
+        except (DeadlineExceededError, CircuitOpenError) as e:
+            json_data = self.stale.load(url, params)
+            if json_data is None:
+                raise
+            log.info('%s, using stale GET %s', type(e).__name__, url, extra={'url': url})
+            return json_data
+        json_data = res.json()
+        if res.ok and not getattr(res, 'from_cache', False):
+            self.stale.save(url, params, json_data)
+        return json_data
 
     @log_url
     def get(self, url, params=None, data=None, **kwargs):
         """
-        GET resource located at url
+        GET resource located at url.
+        Concurrent identical GETs share a single upstream call
         """
-        return self._session.get(url, params=params, data=data, **kwargs)
+        if data is not None or kwargs.get('stream'):
+            return self._session.get(url, params=params, data=data, **kwargs)
+        res = singleflight.do(request_key('GET', url, params),
+                              lambda: read(self._session.get(url, params=params, **kwargs)))
+        # Responses to intents are cached until the cached responses they were derived from change
+        depend_on(url_tag(res.request.url))
+        return res
 
     @log_url
     def post(self, url, params=None, data=None, json=None, **kwargs):
@@ -0,0 +1,174 @@
+import fcntl
+import os
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import time
+
+from .constants import STATE_BACKEND, STATE_FILE
+
+
+class StateBackend:
+    """
+    Key-value store for state that has to be shared by all worker processes (tokens, caches, ...).
+    Keys live in namespaces. Values can be any picklable object and may expire after ```ttl``` seconds.
+    """
+    def get(self, namespace: str, key: str, default=None):
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value, ttl: float=None):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def version(self, namespace: str) -> int:
+        """
+        :returns: A number that changes every time something in ```namespace``` is set or deleted
+        """
+        raise NotImplementedError
+
+    def lock(self, name: str):
+        """
+        Context manager holding an exclusive lock across all workers sharing this backend
+        """
+        raise NotImplementedError
+
+
+class InProcessBackend(StateBackend):
+    """
+    State that is only shared by the threads of a single process. Meant for tests and --workers=1
+    """
+    def __init__(self):
+        self._data = dict()
+        self._versions = dict()
+        self._lock = threading.RLock()
+        self._locks = dict()
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            value, expires_at = self._data.get((namespace, key), (default, None))
+            if expires_at is not None and expires_at <= time():
+                del self._data[(namespace, key)]
+                return default
+            return value
+
+    def set(self, namespace, key, value, ttl=None):
+        with self._lock:
+            self._data[(namespace, key)] = (value, time() + ttl if ttl else None)
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def delete(self, namespace, key):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def version(self, namespace):
+        with self._lock:
+            return self._versions.get(namespace, 0)
+
+    @contextmanager
+    def lock(self, name):
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.RLock())
+        with lock:
+            yield
+
+
+class SQLiteBackend(StateBackend):
+    """
+    State shared by all processes on the host, persisted in a SQLite database (WAL mode)
+    """
+    # Expired rows are deleted by set, at most once per PURGE_INTERVAL seconds (in each process)
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._purged_at = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS state '
+                               '(namespace TEXT, key TEXT, value BLOB, expires_at REAL, '
+                               'PRIMARY KEY (namespace, key))')
+            connection.execute('CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at)')
+            connection.execute('CREATE TABLE IF NOT EXISTS versions (namespace TEXT PRIMARY KEY, version INTEGER)')
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads (or forked processes), so each thread gets its own
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    def _bump(self, connection, namespace):
+        connection.execute('INSERT OR IGNORE INTO versions (namespace, version) VALUES (?, 0)', (namespace,))
+        connection.execute('UPDATE versions SET version = version + 1 WHERE namespace = ?', (namespace,))
+
+    def get(self, namespace, key, default=None):
+        row = self._connection().execute('SELECT value, expires_at FROM state WHERE namespace = ? AND key = ?',
+                                         (namespace, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time()):
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        now = time()
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                               (namespace, key, pickle.dumps(value), now + ttl if ttl else None))
+            self._bump(connection, namespace)
+            if now - self._purged_at >= self.PURGE_INTERVAL:
+                self._purged_at = now
+                connection.execute('DELETE FROM state WHERE expires_at <= ?', (now,))
+
+    def delete(self, namespace, key):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (namespace, key))
+            self._bump(connection, namespace)
+
+    def version(self, namespace):
+        row = self._connection().execute('SELECT version FROM versions WHERE namespace = ?',
+                                         (namespace,)).fetchone()
+        return row[0] if row else 0
+
+    @contextmanager
+    def lock(self, name):
+        with open(f'{self.path}.{name}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+BACKENDS = {
+    'sqlite': lambda: SQLiteBackend(STATE_FILE),
+    'memory': InProcessBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StateBackend:
+    """
+    :returns: The configured (SAM_STATE_BACKEND) state backend, shared by the whole process
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = BACKENDS[STATE_BACKEND]()
+        return _backend
+
+
+def set_backend(backend: StateBackend):
+    """
+    Replace the process-wide state backend (e.g. with an InProcessBackend in tests)
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -1,23 +1,28 @@
-from datetime import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 
 from requests import Response
 
 from .exceptions import NoTokenError, SamError
 
-log = print
+# Shared pool for fanning out independent upstream calls (e.g. concurrent searches)
+shared_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='sam-shared')
 
 
 def logged(func):
+    log = logging.getLogger(func.__module__)
+
     def decorated(*args, **kwargs):
         res = func(*args, **kwargs)
-        print(f'{now_str()}-DEBUG_RES: {res}')
+        # The response is only formatted (by the log writer thread) if DEBUG records are written
+        log.debug('%s returned %s', func.__name__, res, extra={'function': func.__name__})
         return res
     return decorated
 
 
 def parse_action(action: str):
-    action_components = action.split('.')
+    action_components = action.split('.', 2)
     if len(action_components) == 1:
         return action_components[0], None, None
 
@@ -34,10 +39,6 @@ def normalize_volume_value(volume):
     return volume
 
 
-def now_str():
-    return datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
-
-
 def verify_status_code(func):
     def decorated(*args, **kwargs) -> Response:
         res = func(*args, **kwargs)
@@ -53,11 +54,14 @@ def verify_status_code(func):
 
 
 def log_url(func):
+    log = logging.getLogger(func.__module__)
+
     def decorated(*args, **kwargs) -> Response:
         res = func(*args, **kwargs)
-        url = res.url
-        method = res.request.method
-        log(f'{now_str()}-DEBUG_SAM: {method} {url}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug('%s %s', res.request.method, res.url,
+                      extra={'method': res.request.method, 'url': res.url, 'status': res.status_code,
+                             'from_cache': getattr(res, 'from_cache', False)})
         return res
     return decorated
 
@@ -0,0 +1,162 @@
+import logging
+import threading
+from collections import OrderedDict
+from time import monotonic, time
+
+from .constants import (DARK_SKY_URL, GOOGLE_CALENDAR_TOKEN_URI, GOOGLE_MAPS_GEOCODE_URL,
+                        GOOGLE_MAPS_TIMEZONE_URL, SAM_WARMUP, SPOTIFY_TOKEN_URL, WARMUP_CONNECTIONS)
+from .context import DEFAULT_USER
+
+log = logging.getLogger(__name__)
+
+WARMUP_MODES = ('off', 'background', 'blocking')
+
+
+class Warmup:
+    """
+    Startup stage paying for TLS handshakes, token refreshes and cold caches before the first request does.
+    Connection pools and SQLite connections don't survive a fork, so it has to run in every worker,
+    after the fork (i.e. in create_app, without gunicorn's --preload).
+    Steps run once, in order. A failed step doesn't stop the others: the first request just pays for it.
+    """
+    def __init__(self):
+        self.steps = list()
+        self.results = OrderedDict()
+        self.state = 'off'
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, func):
+        """
+        :param func:    Callable doing the step. What it returns is reported as the step's detail
+        """
+        self.steps.append((name, func))
+
+    def run(self):
+        self.state = 'running'
+        start = monotonic()
+        for name, func in self.steps:
+            step_start = monotonic()
+            try:
+                result = {'status': 'ok', 'detail': func()}
+            except Exception as e:
+                log.warning('Warmup step %s failed: %s', name, e, extra={'step': name})
+                result = {'status': 'failed', 'detail': str(e)}
+            result['seconds'] = round(monotonic() - step_start, 3)
+            self.results[name] = result
+        self.state = 'ready'
+        log.info('Warmup done in %.2fs', monotonic() - start, extra={'steps': dict(self.results)})
+
+    def start(self, mode: str=SAM_WARMUP):
+        """
+        :param mode:    'off', 'background' (SAM serves requests while warming up) or 'blocking'
+        """
+        if mode not in WARMUP_MODES:
+            raise ValueError(f'Unknown warmup mode {mode}, expected one of {", ".join(WARMUP_MODES)}')
+        with self._lock:
+            if mode == 'off' or self.state != 'off':
+                return
+            self.state = 'pending'
+        if mode == 'blocking':
+            self.run()
+        else:
+            self._thread = threading.Thread(target=self.run, name='sam-warmup', daemon=True)
+            self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ('off', 'ready')
+
+    def status(self) -> dict:
+        return {
+            'ready': self.ready,
+            'warmup': self.state,
+            'steps': dict(self.results),
+        }
+
+
+def warm_state():
+    from .sessions.token_store import token_store
+
+    # Opens the state database and reads the tokens of all users once
+    return {'token_store_version': token_store.version()}
+
+
+def warm_http_cache():
+    from .sessions.cache import get_http_cache
+
+    return {'fresh_responses': get_http_cache().preload()}
+
+
+def warm_token(sessions):
+    """
+    Load the default user's token and refresh it now if it is about to expire
+    """
+    session = sessions.get(DEFAULT_USER)
+    session.refresh_token()
+    expires_at = (session.token or dict()).get('expires_at')
+    return {'token': session.token is not None, 'expires_in': int(expires_at - time()) if expires_at else None}
+
+
+def shared_connections(urls):
+    from requests import Session
+
+    from .sessions.transport import mount_transport, open_connections
+
+    # A fresh session with the shared adapters fills the pools every OAuth2Session uses
+    return open_connections(mount_transport(Session()), urls, WARMUP_CONNECTIONS)
+
+
+def warm_weather():
+    from .action_handlers.weather import web
+
+    return web.open_connections([DARK_SKY_URL, GOOGLE_MAPS_GEOCODE_URL, GOOGLE_MAPS_TIMEZONE_URL],
+                                WARMUP_CONNECTIONS)
+
+
+def warm_music():
+    from .wrappers import spotify
+
+    detail = warm_token(spotify.oauth2_sessions)
+    detail['connections'] = shared_connections([SPOTIFY_TOKEN_URL, 'https://api.spotify.com/v1/'])
+    detail['playlists'] = len(spotify.spotify_playlists())
+    # Keeps the default user's library mirror in sync from now on, instead of from the first lookup on
+    spotify.libraries.get(DEFAULT_USER).start_sync()
+    return detail
+
+
+def warm_calendar():
+    from .wrappers import calendar_
+
+    detail = warm_token(calendar_.oauth2_sessions)
+    detail['connections'] = shared_connections([GOOGLE_CALENDAR_TOKEN_URI])
+    return detail
+
+
+def warm_dialogflow():
+    from .wrappers import dialogflow
+
+    dialogflow.client()
+
+
+COMPONENT_STEPS = {
+    'weather': warm_weather,
+    'music': warm_music,
+    'calendar': warm_calendar,
+    'dialogflow': warm_dialogflow,
+}
+
+warmup = Warmup()
+
+
+def start_warmup(components, mode: str=SAM_WARMUP) -> Warmup:
+    """
+    Warm up the state database, the HTTP cache and the enabled ```components```
+    """
+    if not warmup.steps:
+        warmup.add('state', warm_state)
+        warmup.add('http_cache', warm_http_cache)
+        for name in components:
+            warmup.add(name, COMPONENT_STEPS[name])
+    warmup.start(mode)
+    return warmup
@@ -1,19 +1,48 @@
+import asyncio
+
 from ..constants import (GOOGLE_CALENDAR_AUTHORIZATION_URI,
                          GOOGLE_CALENDAR_CLIENT_ID,
                          GOOGLE_CALENDAR_CLIENT_SECRET,
                          GOOGLE_CALENDAR_REDIRECT_URI, GOOGLE_CALENDAR_SCOPE,
                          GOOGLE_CALENDAR_TOKEN_URI,
-                         GOOGLE_CALENDAR_WRAPPER_STR, GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS)
+                         GOOGLE_CALENDAR_WRAPPER_STR, GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS,
+                         TOKEN_REFRESH_MARGIN, USER_SESSIONS_MAX)
+from ..sessions.aio import AsyncOAuth2Session
 from ..sessions.oauth2 import OAuth2Session
+from ..sessions.per_user import PerUserStore, UserSessionProxy
+from ..sessions.token_store import token_store
+
+
+def create_oauth2_session(user_id: str) -> OAuth2Session:
+    return OAuth2Session(client_id=GOOGLE_CALENDAR_CLIENT_ID,
+                         client_secret=GOOGLE_CALENDAR_CLIENT_SECRET,
+                         redirect_uri=GOOGLE_CALENDAR_REDIRECT_URI,
+                         token_uri=GOOGLE_CALENDAR_TOKEN_URI,
+                         authorization_uri=GOOGLE_CALENDAR_AUTHORIZATION_URI,
+                         scope=GOOGLE_CALENDAR_SCOPE,
+                         state=GOOGLE_CALENDAR_WRAPPER_STR,
+                         component='Google Calendar',
+                         token_store=token_store,
+                         refresh_margin=TOKEN_REFRESH_MARGIN,
+                         user_id=user_id)
+
 
-oauth2 = OAuth2Session(client_id=GOOGLE_CALENDAR_CLIENT_ID,
-                       client_secret=GOOGLE_CALENDAR_CLIENT_SECRET,
-                       redirect_uri=GOOGLE_CALENDAR_REDIRECT_URI,
-                       token_uri=GOOGLE_CALENDAR_TOKEN_URI,
-                       authorization_uri=GOOGLE_CALENDAR_AUTHORIZATION_URI,
-                       scope=GOOGLE_CALENDAR_SCOPE,
-                       state=GOOGLE_CALENDAR_WRAPPER_STR,
-                       component='Google Calendar')
+# Sessions are per user, oauth2 acts on behalf of the current user
+oauth2_sessions = PerUserStore(create_oauth2_session, max_size=USER_SESSIONS_MAX)
+oauth2 = UserSessionProxy(oauth2_sessions)
+# asyncio handlers borrow the token of the current user's session
+aio_oauth2 = AsyncOAuth2Session(oauth2)
+
+
+def events_params(time_min: str=None, time_max: str=None, order_by: str='startTime', **kwargs) -> dict:
+    params = {
+        'timeMin': time_min,
+        'timeMax': time_max,
+        'singleEvents': True,
+        'orderBy': order_by
+    }
+    params.update(kwargs.get('params', dict()))
+    return params
 
 
 def get_events(calendar_id='primary', time_min: str=None, time_max: str=None,
@@ -26,14 +55,7 @@ def get_events(calendar_id='primary', time_min: str=None, time_max: str=None,
     :param order_by:        Order by 'startTime' or 'updated'
     """
 
-    params = {
-        'timeMin': time_min,
-        'timeMax': time_max,
-        'singleEvents': True,
-        'orderBy': order_by
-    }
-    
-    params.update(kwargs.get('params', dict()))
+    params = events_params(time_min=time_min, time_max=time_max, order_by=order_by, **kwargs)
     calendar_ids = [calendar_id]
     calendar_ids.extend(GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS)
     res = list()
@@ -41,3 +63,19 @@ def get_events(calendar_id='primary', time_min: str=None, time_max: str=None,
         res.extend(oauth2.get(f'https://www.googleapis.com/calendar/v3/calendars/{cal_id}/events',
                               params=params).json()['items'])
     return res
+
+
+async def get_events_async(calendar_id='primary', time_min: str=None, time_max: str=None,
+                           order_by: str='startTime', **kwargs) -> list:
+    """
+    asyncio version of get_events. The calendars are requested concurrently
+    """
+    params = events_params(time_min=time_min, time_max=time_max, order_by=order_by, **kwargs)
+    calendar_ids = [calendar_id]
+    calendar_ids.extend(GOOGLE_CALENDAR_CUSTOM_CALENDAR_IDS)
+    urls = [f'https://www.googleapis.com/calendar/v3/calendars/{cal_id}/events' for cal_id in calendar_ids]
+    responses = await asyncio.gather(*(aio_oauth2.get(url, params=params) for url in urls))
+    res = list()
+    for response in responses:
+        res.extend(response.json()['items'])
+    return res
@@ -1,14 +1,19 @@
-import json
-
-import apiai
+from functools import lru_cache
 
 from ..constants import DIALOGFLOW_CLIENT_ACCESS_TOKEN
+from ..json_ import loads
+
+
+@lru_cache(maxsize=None)
+def client():
+    # apiai is only imported once a query has to be sent to Dialogflow
+    import apiai
 
-ai = apiai.ApiAI(DIALOGFLOW_CLIENT_ACCESS_TOKEN)
+    return apiai.ApiAI(DIALOGFLOW_CLIENT_ACCESS_TOKEN)
 
 
 def make_query(query: str) -> dict:
-    request = ai.text_request()
+    request = client().text_request()
     request.query = query
     response = request.getresponse()
-    return json.loads(response.read())
+    return loads(response.read())
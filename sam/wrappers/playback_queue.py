@@ -0,0 +1,140 @@
+import threading
+
+from . import spotify
+from ..context import current_user
+
+COALESCED_KINDS = ('volume', 'shuffle', 'repeat')
+
+
+class _Command:
+    def __init__(self, kind, value=None):
+        self.kind = kind
+        self.value = value
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def resolve(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+
+class PlaybackCommandQueue:
+    """
+    Per-user command queue in front of the Spotify playback mutators.
+    A command is executed right away. Commands submitted while a user's previous batch is still in flight
+    are executed together, as the next batch:
+        - volume changes are merged into one absolute set_volume call
+        - shuffle and repeat changes collapse to the last requested state
+        - skips are kept, but executed one after the other, so they never race
+    A user's queue only exists while commands of the user are executing.
+    """
+    def __init__(self, wrapper=spotify):
+        """
+        :param wrapper: Module/object exposing the Spotify mutators
+                        (current_volume, set_volume, shuffle, repeat, skip_forward, unskip)
+        """
+        self.wrapper = wrapper
+        self._lock = threading.Lock()
+        # Pending commands by user, for the users whose commands are executing
+        self._queues = dict()
+
+    def submit(self, kind: str, value=None, user_id: str=None):
+        """
+        Submit a command and block until the batch containing it has been executed.
+        The first command of a burst is executed at once, without waiting for the rest of the burst
+        :param kind:    'volume', 'shuffle', 'repeat', 'skip_forward' or 'skip_backward'
+        :param value:   Volume delta, shuffle state or repeat mode. Unused for skips
+        :param user_id: By default, the current user
+        :returns:       The result of the (merged) upstream call for this command
+        """
+        command = _Command(kind, value)
+        user_id = user_id or current_user.get()
+        with self._lock:
+            # The submitter that finds no queue becomes the leader, and executes the batches of the user
+            leader = user_id not in self._queues
+            self._queues.setdefault(user_id, []).append(command)
+
+        if leader:
+            # Execute batches until no more commands arrived while the last one was in flight
+            while True:
+                with self._lock:
+                    batch = self._queues[user_id]
+                    if not batch:
+                        # Idle queues are dropped, so they don't pile up for every user that ever sent a command
+                        del self._queues[user_id]
+                        break
+                    self._queues[user_id] = []
+                self._execute(batch)
+
+        command.done.wait()
+        if command.error is not None:
+            raise command.error
+        return command.result
+
+    def change_volume(self, delta: int, user_id: str=None):
+        """
+        :returns: tuple - (volume_percent before the batch, volume_percent after the batch)
+        """
+        return self.submit('volume', delta, user_id=user_id)
+
+    def shuffle(self, shuffle_state: bool, user_id: str=None):
+        return self.submit('shuffle', shuffle_state, user_id=user_id)
+
+    def repeat(self, mode: str, user_id: str=None):
+        return self.submit('repeat', mode, user_id=user_id)
+
+    def skip_forward(self, user_id: str=None):
+        return self.submit('skip_forward', user_id=user_id)
+
+    def skip_backward(self, user_id: str=None):
+        return self.submit('skip_backward', user_id=user_id)
+
+    def _execute(self, batch: list):
+        """
+        Execute a batch of commands. Coalesced kinds are executed once, at the position of their first occurrence
+        """
+        groups = dict()
+        for command in batch:
+            if command.kind in COALESCED_KINDS:
+                groups.setdefault(command.kind, []).append(command)
+
+        for command in batch:
+            if command.kind in COALESCED_KINDS:
+                group = groups.pop(command.kind, None)
+                if group is not None:
+                    self._run(group, getattr(self, f'_merged_{command.kind}'))
+            elif command.kind == 'skip_forward':
+                self._run([command], lambda _: self.wrapper.skip_forward())
+            elif command.kind == 'skip_backward':
+                self._run([command], lambda _: self.wrapper.unskip())
+            else:
+                command.resolve(error=ValueError(f'Unknown playback command: {command.kind}'))
+
+    @staticmethod
+    def _run(group: list, func):
+        try:
+            result = func(group)
+        except Exception as e:
+            for command in group:
+                command.resolve(error=e)
+        else:
+            for command in group:
+                command.resolve(result)
+
+    def _merged_volume(self, group: list):
+        before = self.wrapper.current_volume()
+        after = max(0, min(100, before + sum(command.value for command in group)))
+        if after != before:
+            self.wrapper.set_volume(after)
+        return before, after
+
+    def _merged_shuffle(self, group: list):
+        return self.wrapper.shuffle(group[-1].value)
+
+    def _merged_repeat(self, group: list):
+        return self.wrapper.repeat(group[-1].value)
+
+
+playback_queue = PlaybackCommandQueue()
@@ -0,0 +1,159 @@
+import logging
+import queue
+import threading
+
+from . import spotify
+from ..constants import USER_SESSIONS_MAX
+from ..context import DEFAULT_USER, user_context
+from ..exceptions import SamError
+from ..json_ import dumps
+from ..sessions.per_user import PerUserStore
+
+log = logging.getLogger(__name__)
+
+
+class PlaybackPoller:
+    """
+    Single background poller of the Spotify playback state, fanning out changes to all subscribers.
+    The number of upstream calls is independent of the number of subscribers:
+        - while something is playing, the next poll is scheduled for when the current track ends
+          (at most ```max_interval``` seconds ahead)
+        - while nothing is playing, the poller backs off to ```idle_interval```
+        - without subscribers, the poller thread stops
+    """
+    def __init__(self, wrapper=spotify, min_interval: float=1.0, max_interval: float=5.0,
+                 idle_interval: float=15.0, subscriber_buffer: int=10, user_id: str=DEFAULT_USER):
+        self.wrapper = wrapper
+        self.user_id = user_id
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.idle_interval = idle_interval
+        self.subscriber_buffer = subscriber_buffer
+        self.last_state = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    def subscribe(self) -> queue.Queue:
+        """
+        :returns: A queue on which every playback change is put, starting with the last known state
+        """
+        subscriber = queue.Queue(maxsize=self.subscriber_buffer)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self.last_state is not None:
+                subscriber.put_nowait(self.last_state)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_forever,
+                                                name='sam-playback-poller',
+                                                daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+        self._wakeup.set()
+
+    def has_subscribers(self) -> bool:
+        with self._lock:
+            return bool(self._subscribers)
+
+    def _publish(self, state: dict):
+        with self._lock:
+            self.last_state = state
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(state)
+            except queue.Full:
+                # Slow subscriber, drop its oldest state rather than blocking everyone else
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(state)
+
+    def _poll(self):
+        """
+        :returns: dict - the current playback state, or None if nothing is playing
+        """
+        res = self.wrapper.currently_playing()
+        if res.status_code == 204 or not res.content:
+            return None
+        json_data = res.json()
+        item = json_data.get('item') or dict()
+        return {
+            'is_playing': json_data.get('is_playing', False),
+            'progress_ms': json_data.get('progress_ms') or 0,
+            'duration_ms': item.get('duration_ms') or 0,
+            'uri': item.get('uri'),
+            'song': item.get('name'),
+            'artist': item['artists'][0]['name'] if item.get('artists') else None,
+        }
+
+    def _has_changed(self, state: dict, elapsed: float) -> bool:
+        last_state = self.last_state
+        if last_state is None or state is None or 'error' in last_state:
+            return state != last_state
+        if (state['uri'], state['is_playing']) != (last_state['uri'], last_state['is_playing']):
+            return True
+        # Same track, only a seek counts as a change
+        expected_progress = last_state['progress_ms'] + (elapsed * 1000 if last_state['is_playing'] else 0)
+        return abs(state['progress_ms'] - expected_progress) > 2000
+
+    def _next_interval(self, state: dict) -> float:
+        if not state or not state['is_playing']:
+            return self.idle_interval
+        remaining = (state['duration_ms'] - state['progress_ms']) / 1000
+        return max(self.min_interval, min(self.max_interval, remaining + 0.5))
+
+    def _poll_forever(self):
+        with user_context(self.user_id):
+            self._poll_loop()
+
+    def _poll_loop(self):
+        interval = 0
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+            error = None
+            try:
+                state = self._poll()
+            except SamError as e:
+                log.warning('Playback poll failed: %s', e.message)
+                error = e.message
+            except Exception:
+                # Keep polling, subscribers are told about the failure like about any other
+                log.exception('Playback poll failed')
+                error = 'Playback poll failed'
+
+            if error is not None:
+                state = {'error': error}
+                if state != self.last_state:
+                    self._publish(state)
+                interval = self.idle_interval
+            else:
+                if self._has_changed(state, interval):
+                    self._publish(state)
+                else:
+                    with self._lock:
+                        self.last_state = state
+                interval = self._next_interval(state)
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+
+
+def format_event(state: dict) -> str:
+    """
+    Format ```state``` as a Server-Sent Event
+    """
+    return f'event: playback\ndata: {dumps(state)}\n\n'
+
+
+# Pollers with subscribers are never evicted, their streams would be left without updates
+playback_pollers = PerUserStore(lambda user_id: PlaybackPoller(user_id=user_id), max_size=USER_SESSIONS_MAX,
+                                in_use=PlaybackPoller.has_subscribers)
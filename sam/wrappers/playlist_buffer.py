@@ -0,0 +1,151 @@
+import atexit
+import logging
+import threading
+
+from . import spotify
+from ..constants import SPOTIFY_PLAYLIST_TRACKS_LIMIT
+from ..context import current_user, user_context
+
+log = logging.getLogger(__name__)
+
+
+class PlaylistWriteBuffer:
+    """
+    Buffer of tracks that should be added to playlists "later".
+    The tracks of a playlist are written with spotify.add_tracks_to_playlist as soon as
+    ```max_size``` tracks are buffered for it, or ```max_delay``` seconds after the first track was buffered,
+    whichever comes first.
+    Tracks are buffered per user, and written on behalf of the user that added them.
+    Tracks that could not be written are put back in the buffer, and retried ```max_delay``` seconds later.
+    After ```max_attempts``` failed writes they are dropped, and the failure is kept for the user (see failures).
+    """
+    def __init__(self, wrapper=spotify, max_size: int=SPOTIFY_PLAYLIST_TRACKS_LIMIT, max_delay: float=5.0,
+                 max_attempts: int=3):
+        """
+        :param wrapper:         Module/object exposing add_tracks_to_playlist
+        :param max_size:        Number of buffered tracks (per playlist) that triggers a flush
+        :param max_delay:       Max number of seconds a track stays in the buffer
+        :param max_attempts:    Number of failed writes (in a row, per playlist) after which tracks are dropped
+        """
+        self.wrapper = wrapper
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._buffers = dict()
+        self._timers = dict()
+        self._attempts = dict()
+        self._failures = dict()
+
+    def add(self, song_uris: "str list", playlist_id: str, user_id: str=None):
+        """
+        Buffer ```song_uris``` for the playlist with id ```playlist_id```
+        :param user_id: By default, the current user
+        """
+        if isinstance(song_uris, str):
+            song_uris = [song_uris]
+        user_id = user_id or current_user.get()
+        key = (user_id, playlist_id)
+        with self._lock:
+            buffer = self._buffers.setdefault(key, [])
+            buffer.extend(song_uris)
+            flush_now = len(buffer) >= self.max_size
+            if not flush_now:
+                self._start_timer(key)
+        if flush_now:
+            self.flush(playlist_id, user_id=user_id)
+
+    def failures(self, user_id: str=None) -> list:
+        """
+        Failures to report to ```user_id``` (by default, the current user), once
+        :returns: list of str - a description of every write that was given up on since the last call
+        """
+        with self._lock:
+            return self._failures.pop(user_id or current_user.get(), [])
+
+    def flush(self, playlist_id: str=None, user_id: str=None) -> list:
+        """
+        Write the buffered tracks of ```playlist_id``` (or of all playlists, if None)
+        :param user_id: Only write the tracks buffered by this user. By default, the tracks of all users
+
+        :returns: list of requests.Response
+        :raises:  The first error raised while writing, after the tracks of every other playlist were written
+        """
+        with self._lock:
+            pending = dict()
+            for key in list(self._buffers):
+                if playlist_id not in (None, key[1]) or user_id not in (None, key[0]):
+                    continue
+                timer = self._timers.pop(key, None)
+                if timer is not None:
+                    timer.cancel()
+                song_uris = self._buffers.pop(key)
+                if song_uris:
+                    pending[key] = song_uris
+
+        res = list()
+        error = None
+        for key, song_uris in pending.items():
+            log.debug('Flushing %d tracks to playlist %s', len(song_uris), key[1])
+            # Chunk here, so that a failed request only puts back the tracks that weren't written
+            for i in range(0, len(song_uris), SPOTIFY_PLAYLIST_TRACKS_LIMIT):
+                try:
+                    with user_context(key[0]):
+                        res.extend(self.wrapper.add_tracks_to_playlist(song_uris[i:i + SPOTIFY_PLAYLIST_TRACKS_LIMIT],
+                                                                       key[1]))
+                except Exception as e:
+                    self._failed(key, song_uris[i:], e)
+                    error = error or e
+                    break
+            else:
+                with self._lock:
+                    self._attempts.pop(key, None)
+        if error is not None:
+            raise error
+        return res
+
+    def _failed(self, key: tuple, song_uris: list, error: Exception):
+        """
+        Put ```song_uris``` back in front of the buffer of ```key```, before any track buffered in the meantime,
+        to be retried with the next flush. Unless they already failed ```max_attempts``` times
+        """
+        with self._lock:
+            attempts = self._attempts[key] = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                del self._attempts[key]
+                self._failures.setdefault(key[0], []).append(
+                    f'{len(song_uris)} song(s) could not be added to playlist {key[1]}: {error}')
+            else:
+                buffer = self._buffers.setdefault(key, [])
+                buffer[:0] = song_uris
+                self._start_timer(key)
+        if attempts >= self.max_attempts:
+            log.error('Failed to add %d tracks to playlist %s %d times, dropping them',
+                      len(song_uris), key[1], attempts, exc_info=error)
+        else:
+            log.warning('Failed to add %d tracks to playlist %s, keeping them buffered',
+                        len(song_uris), key[1], exc_info=error)
+
+    def _start_timer(self, key: tuple):
+        """
+        Flush the buffer of ```key``` in ```max_delay``` seconds, unless that's already planned.
+        The lock must be held
+        """
+        if key not in self._timers:
+            timer = threading.Timer(self.max_delay, self._flush_quietly, args=(key[1], key[0]))
+            timer.daemon = True
+            self._timers[key] = timer
+            timer.start()
+
+    def _flush_quietly(self, playlist_id: str=None, user_id: str=None):
+        """
+        flush, for timers and exit handlers. Failures are already logged by flush
+        """
+        try:
+            self.flush(playlist_id, user_id=user_id)
+        except Exception:
+            pass
+
+
+playlist_buffer = PlaylistWriteBuffer()
+atexit.register(playlist_buffer._flush_quietly)
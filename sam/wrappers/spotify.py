@@ -1,25 +1,67 @@
 import json
+import logging
+from functools import lru_cache
+from hashlib import sha1
 
 from ..constants import (SPOTIFY_BASE_AUTHORIZATION_URL, SPOTIFY_CLIENT_ID,
-                         SPOTIFY_CLIENT_SECRET, SPOTIFY_PLAYLISTS_FILE,
-                         SPOTIFY_REDIRECT_URI, SPOTIFY_SCOPE,
-                         SPOTIFY_TOKEN_URL, SPOTIFY_WRAPPER_STR)
-from ..exceptions import InvalidDataTypeError, SpotifyPlaylistNotfoundError
+                         SPOTIFY_CLIENT_SECRET, SPOTIFY_LIBRARY_FILE,
+                         SPOTIFY_LIBRARY_SYNC_INTERVAL,
+                         SPOTIFY_PLAYLIST_TRACKS_LIMIT,
+                         SPOTIFY_PLAYLISTS_FILE, SPOTIFY_REDIRECT_URI, SPOTIFY_SCOPE,
+                         SPOTIFY_TOKEN_URL, SPOTIFY_WRAPPER_STR,
+                         TOKEN_REFRESH_MARGIN, USER_SESSIONS_MAX)
+from ..context import DEFAULT_USER, bind_context
+from ..exceptions import (InvalidDataTypeError, SpotifyPlaylistNotfoundError,
+                          SpotifyTrackNotfoundError)
+from ..sessions.aio import AsyncOAuth2Session
 from ..sessions.oauth2 import OAuth2Session
-from ..utils import log, now_str
+from ..sessions.per_user import PerUserStore, UserSessionProxy
+from ..sessions.token_store import token_store
+from ..utils import shared_executor
+from .spotify_library import LibraryMirror
 
-with open(SPOTIFY_PLAYLISTS_FILE) as file_:
-    spotify_playlists: dict = json.load(file_)
+log = logging.getLogger(__name__)
 
-valid_types = ['artist', 'album', 'track', 'playlist']
-oauth2 = OAuth2Session(client_id=SPOTIFY_CLIENT_ID,
-                       client_secret=SPOTIFY_CLIENT_SECRET,
-                       redirect_uri=SPOTIFY_REDIRECT_URI,
-                       token_uri=SPOTIFY_TOKEN_URL,
-                       authorization_uri=SPOTIFY_BASE_AUTHORIZATION_URL,
-                       scope=SPOTIFY_SCOPE,
-                       state=SPOTIFY_WRAPPER_STR,
-                       component='Spotify')
+valid_types = ['artist', 'album', 'track', 'playlist', 'song_artist']
+
+
+@lru_cache(maxsize=None)
+def spotify_playlists() -> dict:
+    """
+    :returns: Playlist URIs by name, from SPOTIFY_PLAYLISTS_FILE (read on first use)
+    """
+    with open(SPOTIFY_PLAYLISTS_FILE) as file_:
+        return json.load(file_)
+
+
+def create_oauth2_session(user_id: str) -> OAuth2Session:
+    return OAuth2Session(client_id=SPOTIFY_CLIENT_ID,
+                         client_secret=SPOTIFY_CLIENT_SECRET,
+                         redirect_uri=SPOTIFY_REDIRECT_URI,
+                         token_uri=SPOTIFY_TOKEN_URL,
+                         authorization_uri=SPOTIFY_BASE_AUTHORIZATION_URL,
+                         scope=SPOTIFY_SCOPE,
+                         state=SPOTIFY_WRAPPER_STR,
+                         component='Spotify',
+                         token_store=token_store,
+                         refresh_margin=TOKEN_REFRESH_MARGIN,
+                         user_id=user_id)
+
+
+def create_library(user_id: str) -> LibraryMirror:
+    path = SPOTIFY_LIBRARY_FILE
+    if user_id != DEFAULT_USER:
+        path = path.replace('.db', f'_{sha1(user_id.encode()).hexdigest()[:16]}.db')
+    return LibraryMirror(path, oauth2_sessions.get(user_id), sync_interval=SPOTIFY_LIBRARY_SYNC_INTERVAL)
+
+
+# Sessions and library mirrors are per user, the module-level names act on behalf of the current user
+oauth2_sessions = PerUserStore(create_oauth2_session, max_size=USER_SESSIONS_MAX)
+oauth2 = UserSessionProxy(oauth2_sessions)
+# asyncio handlers borrow the token of the current user's session
+aio_oauth2 = AsyncOAuth2Session(oauth2)
+libraries = PerUserStore(create_library, max_size=USER_SESSIONS_MAX)
+library = UserSessionProxy(libraries)
 
 
 def current_playback_state():
@@ -40,6 +82,22 @@ def currently_playing():
     return res
 
 
+async def current_playback_state_async():
+    """
+    asyncio version of current_playback_state
+    """
+    return await aio_oauth2.get('https://api.spotify.com/v1/me/player')
+
+
+async def currently_playing_async():
+    """
+    asyncio version of currently_playing
+
+    :returns: sessions.aio.AsyncResponse
+    """
+    return await aio_oauth2.get('https://api.spotify.com/v1/me/player/currently-playing')
+
+
 def current_volume():
     """
     Get the user's current volume_percent
@@ -102,7 +160,7 @@ def token_info():
     """
     Return current token info for the OAuth2Session
     """
-    res = oauth2.oauth2_session.token
+    res = oauth2.token
     return res
 
 
@@ -115,13 +173,26 @@ def get_uri(input_, type_='track'):
     return res
 
 
+def get_track_uri(song: str, artist: str=None):
+    """
+    Search for ```song``` (optionally by ```artist```)
+
+    :returns:   str - uri of the best matching track
+                None - no track was found
+    """
+    uri = library.lookup([song, artist], 'song_artist') if artist else library.lookup(song, 'track')
+    if uri is not None:
+        return uri
+    query = f'track:{song} artist:{artist}' if artist else song
+    items = get_uri(query, 'track').json()['tracks']['items']
+    return items[0]['uri'] if items else None
+
+
 def get_playlist_uri(playlist):
     playlist = playlist.strip().lower()
-    if playlist in spotify_playlists:
-        uri = spotify_playlists[playlist]
-    else:
-        log(f'{now_str()}-DEBUG{SPOTIFY_WRAPPER_STR}: {playlist} playlist not in spotify_playlists.json. '
-            f'Connecting to Spotify API')
+    uri = spotify_playlists().get(playlist) or library.lookup(playlist, 'playlist')
+    if uri is None:
+        log.debug('%s playlist not in spotify_playlists.json. Connecting to Spotify API', playlist)
         json_data = get_uri(playlist, 'playlist').json()
         try:
             uri = json_data['playlists']['items'][0]['uri']
@@ -190,13 +261,15 @@ def play(value: str, type_: str='artist', device: "str, dict"=None):
     """
     Attempt to play the specified value, based on type_
     :param value: The value to search for and ultimately play (song name, artist name, album name, playlist name)
-    :param type_: (song, artist, album, playlist)
+                  For type_ 'song_artist', a [song name, artist name] list
+    :param type_: (track, artist, album, playlist, song_artist)
     :param device: (from Spotify API)
 
     :returns: requests.Response
     """
     if type_ not in valid_types:
-        raise ValueError('invalid type_ value passed. Valid types: "song", "album", "track", "playlist"')
+        raise ValueError('invalid type_ value passed. '
+                         'Valid types: "artist", "album", "track", "playlist", "song_artist"')
 
     params = dict()
 
@@ -209,7 +282,16 @@ def play(value: str, type_: str='artist', device: "str, dict"=None):
     # Play on the currently active device
     if type_ == 'playlist':
         uri = get_playlist_uri(value)
+    elif type_ == 'song_artist':
+        uri = get_track_uri(*value)
+        if uri is None:
+            raise SpotifyTrackNotfoundError(f'{value[0]} by {value[1]} not found')
+        type_ = 'track'
     else:
+        # Library content resolves locally, the search API is only used on a miss
+        uri = library.lookup(value, type_)
+
+    if uri is None:
         json_data = get_uri(value, type_).json()
         if type_ == 'artist':
             uri = json_data['artists']['items'][0]['uri']
@@ -237,6 +319,34 @@ def play(value: str, type_: str='artist', device: "str, dict"=None):
     return res
 
 
+def play_tracks(songs: list, device: "str, dict"=None):
+    """
+    Play several songs, in the given order, with a single play request.
+    The searches for all songs are made concurrently on the shared pool,
+    so this takes about as long as a single search.
+    :param songs:   list of song names, or of (song name, artist name) tuples
+    :param device:  (from Spotify API)
+
+    :returns: list - the songs of ```songs``` that were found (and are played), in order
+    """
+    queries = [song if isinstance(song, (list, tuple)) else (song,) for song in songs]
+    futures = [shared_executor.submit(bind_context(get_track_uri), *query) for query in queries]
+    found = [(song, uri) for song, uri in zip(songs, (future.result() for future in futures)) if uri]
+    if not found:
+        raise SpotifyTrackNotfoundError('None of the requested songs were found')
+
+    params = dict()
+    if device:
+        params['device_id'] = get_device_object(device)['id']
+    data = {
+        'uris': [uri for _, uri in found]
+    }
+    oauth2.put('https://api.spotify.com/v1/me/player/play',
+               json=data,
+               params=params)
+    return [song for song, _ in found]
+
+
 def pause():
     res = oauth2.put('https://api.spotify.com/v1/me/player/pause')
     return res
@@ -250,6 +360,20 @@ def unpause():
     return res
 
 
+async def pause_async():
+    """
+    asyncio version of pause
+    """
+    return await aio_oauth2.put('https://api.spotify.com/v1/me/player/pause')
+
+
+async def unpause_async():
+    """
+    asyncio version of unpause
+    """
+    return await aio_oauth2.put('https://api.spotify.com/v1/me/player/play')
+
+
 def set_volume(volume_percent: int=50, device_id: str=None):
     """
     Set the user's volume_percent
@@ -267,8 +391,28 @@ def set_volume(volume_percent: int=50, device_id: str=None):
 
 
 def add_to_playlist(song_uri, playlist_id):
-    params = {
-        'uris': song_uri
-    }
-    res = oauth2.post(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', params=params)
+    """
+    Add a single track to the playlist with id ```playlist_id```
+
+    :returns: requests.Response
+    """
+    return add_tracks_to_playlist([song_uri], playlist_id)[0]
+
+
+def add_tracks_to_playlist(song_uris: list, playlist_id: str) -> list:
+    """
+    Add many tracks to the playlist with id ```playlist_id```.
+    The uris are sent in the JSON body, in chunks of at most SPOTIFY_PLAYLIST_TRACKS_LIMIT uris per request,
+    so the order of ```song_uris``` is preserved in the playlist
+    :param song_uris:   list of Spotify track uris
+    :param playlist_id: ID of the playlist to add the tracks to
+
+    :returns: list of requests.Response, one per request made
+    """
+    res = list()
+    for i in range(0, len(song_uris), SPOTIFY_PLAYLIST_TRACKS_LIMIT):
+        data = {
+            'uris': song_uris[i:i + SPOTIFY_PLAYLIST_TRACKS_LIMIT]
+        }
+        res.append(oauth2.post(f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks', json=data))
     return res
@@ -0,0 +1,179 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import time
+
+from ..exceptions import SamError
+
+log = logging.getLogger(__name__)
+
+LIBRARY_ENDPOINTS = {
+    'track': 'https://api.spotify.com/v1/me/tracks?limit=50',
+    'album': 'https://api.spotify.com/v1/me/albums?limit=50',
+    'artist': 'https://api.spotify.com/v1/me/following?type=artist&limit=50',
+    'playlist': 'https://api.spotify.com/v1/me/playlists?limit=50',
+}
+
+
+def normalize(value: str) -> str:
+    return ' '.join(re.findall(r'\w+', value.lower()))
+
+
+def parse_item(type_: str, item: dict) -> tuple:
+    """
+    Turn an item of one of the LIBRARY_ENDPOINTS into a (uri, type, name, artist) row
+    """
+    if type_ == 'track':
+        item = item['track']
+    elif type_ == 'album':
+        item = item['album']
+
+    if type_ == 'playlist':
+        artist = item['owner'].get('display_name') or ''
+    elif type_ == 'artist':
+        artist = item['name']
+    else:
+        artist = item['artists'][0]['name'] if item['artists'] else ''
+    return item['uri'], type_, item['name'], artist
+
+
+class LibraryMirror:
+    """
+    Local SQLite mirror of the user's saved tracks, saved albums, followed artists and playlists.
+    Names are indexed with FTS5 (when the sqlite3 build supports it), so that library content
+    can be resolved without a round trip to the Spotify search API.
+    """
+    def __init__(self, path: str, session, sync_interval: float=3600):
+        """
+        :param path:            Location of the SQLite database file
+        :param session:         OAuth2Session used to read the user's library
+        :param sync_interval:   Seconds between two background syncs
+        """
+        self.path = path
+        self.session = session
+        self.sync_interval = sync_interval
+        self.last_synced = None
+        self._sync_thread = None
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self.fts = self._create_tables()
+
+    @contextmanager
+    def _connect(self):
+        """
+        Connection for a single transaction, committed (or rolled back) and closed at the end of the with block
+        """
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _create_tables(self) -> bool:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as connection:
+            try:
+                connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS library '
+                                   'USING fts5(name, artist, type UNINDEXED, uri UNINDEXED)')
+                return True
+            except sqlite3.OperationalError:
+                # sqlite3 was built without FTS5, fall back to a plain table
+                connection.execute('CREATE TABLE IF NOT EXISTS library (name TEXT, artist TEXT, type TEXT, uri TEXT)')
+                return False
+
+    def _fetch(self, type_: str) -> list:
+        rows = list()
+        url = LIBRARY_ENDPOINTS[type_]
+        while url:
+            json_data = self.session.get(url).json()
+            if type_ == 'artist':
+                json_data = json_data['artists']
+            rows.extend(parse_item(type_, item) for item in json_data['items'] if item)
+            url = json_data.get('next')
+        return rows
+
+    def sync(self):
+        """
+        Replace the mirror with the current content of the user's library
+        """
+        rows = list()
+        for type_ in LIBRARY_ENDPOINTS:
+            rows.extend(self._fetch(type_))
+
+        with self._connect() as connection:
+            connection.execute('DELETE FROM library')
+            connection.executemany('INSERT INTO library (uri, type, name, artist) VALUES (?, ?, ?, ?)',
+                                   [(uri, type_, normalize(name), normalize(artist))
+                                    for uri, type_, name, artist in rows])
+        self.last_synced = time()
+        log.info('Synced %d items to the local library mirror', len(rows), extra={'path': self.path})
+
+    def close(self):
+        """
+        Stop the background sync
+        """
+        self._closed.set()
+
+    def _sync_forever(self):
+        while not self._closed.is_set():
+            try:
+                self.sync()
+            except SamError as e:
+                # Usually NoTokenError, the next attempt will be made after sync_interval
+                log.warning('Library sync failed: %s', e.message, extra={'path': self.path})
+            except Exception:
+                # Keep the thread alive, a failed sync mustn't stop the later ones
+                log.exception('Library sync failed', extra={'path': self.path})
+            self._closed.wait(self.sync_interval)
+
+    def start_sync(self):
+        """
+        Start the background sync thread, if it is not running yet
+        """
+        with self._lock:
+            if self._sync_thread is None:
+                self._sync_thread = threading.Thread(target=self._sync_forever,
+                                                     name='sam-spotify-library-sync',
+                                                     daemon=True)
+                self._sync_thread.start()
+
+    def lookup(self, value: "str list", type_: str='track'):
+        """
+        Resolve ```value``` against the local mirror
+        :param value:   Name to look up. For type_ 'song_artist', a [song name, artist name] list
+        :param type_:   (track, artist, album, playlist, song_artist)
+
+        :returns:   str - uri of the item of the library with the same (normalized) name, and artist if given
+                    None - no such item, a partial match could be something else than asked for:
+                    the Spotify search API knows better
+        """
+        self.start_sync()
+        if type_ == 'song_artist':
+            name, artist = normalize(value[0]), normalize(value[1])
+            type_ = 'track'
+        else:
+            if isinstance(value, list):
+                value = value[0]
+            name, artist = normalize(value), ''
+        if not name:
+            return None
+
+        with self._connect() as connection:
+            if self.fts:
+                terms = [f'name : "{token}"' for token in name.split()]
+                terms.extend(f'artist : "{token}"' for token in artist.split())
+                rows = connection.execute('SELECT uri, name, artist FROM library WHERE library MATCH ? '
+                                          'AND type = ? ORDER BY rank LIMIT 10',
+                                          (' AND '.join(terms), type_)).fetchall()
+            else:
+                rows = connection.execute('SELECT uri, name, artist FROM library WHERE name LIKE ? '
+                                          'AND artist LIKE ? AND type = ? LIMIT 10',
+                                          (f'%{name}%', f'%{artist}%', type_)).fetchall()
+        for uri, name_, artist_ in rows:
+            if name_ == name and artist in ('', artist_):
+                return uri
+        return None
@@ -2,6 +2,19 @@ from datetime import datetime, timedelta, date
 
 import pytest
 
+from sam.state import InProcessBackend, set_backend
+
+
+@pytest.fixture(autouse=True)
+def state_backend():
+    """
+    Keep the state of every test (tokens, jobs, cache generations, ...) in memory, on its own,
+    rather than in the SQLite file of the working directory
+    """
+    backend = InProcessBackend()
+    set_backend(backend)
+    return backend
+
 
 @pytest.fixture()
 def now_str():
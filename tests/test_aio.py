@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from sam.context import current_user, user_context
+from sam.exceptions import NoTokenError, SamError
+from sam.sessions.aio import AsyncOAuth2Session, AsyncResponse
+
+
+class FakeSyncSession:
+    component = 'Fake'
+
+    def __init__(self, token=None):
+        self.token = token
+        self.refreshed_for = []
+
+    def _ensure_fresh_token(self):
+        self.refreshed_for.append(current_user.get())
+
+
+class FakeWebSession:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requests = []
+
+    async def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url, headers))
+        return AsyncResponse(status_code=self.status_code, url=url, method=method, text='', json_data={})
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_requests_carry_the_fresh_token_of_the_current_user():
+    sync_session = FakeSyncSession({'access_token': 'abc'})
+    web_session = FakeWebSession()
+    session = AsyncOAuth2Session(sync_session, web_session)
+    with user_context('a'):
+        run(session.put('https://api.test/play'))
+    assert sync_session.refreshed_for == ['a']
+    assert web_session.requests == [('PUT', 'https://api.test/play', {'Authorization': 'Bearer abc'})]
+
+
+def test_no_token():
+    web_session = FakeWebSession()
+    with pytest.raises(NoTokenError):
+        run(AsyncOAuth2Session(FakeSyncSession(), web_session).get('https://api.test/me'))
+    assert web_session.requests == []
+
+
+@pytest.mark.parametrize('status_code, error', [(401, NoTokenError), (500, SamError)])
+def test_error_status_codes(status_code, error):
+    session = AsyncOAuth2Session(FakeSyncSession({'access_token': 'abc'}), FakeWebSession(status_code))
+    with pytest.raises(error):
+        run(session.get('https://api.test/me'))
@@ -0,0 +1,88 @@
+from time import sleep
+
+import pytest
+
+from sam.sessions.cache import DiskLRUCache, StaleStore, generation, url_tag
+from sam.state import InProcessBackend
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache_ = DiskLRUCache(str(tmp_path / 'http_cache.db'), max_bytes=100)
+    # Track every access, so that the LRU order is exact
+    cache_.ACCESS_RESOLUTION = 0
+    return cache_
+
+
+def test_get_set_delete(cache):
+    assert cache.get('https://api.test/a') is None
+    cache.set('https://api.test/a', b'response')
+    assert cache.get('https://api.test/a') == b'response'
+    cache.delete('https://api.test/a')
+    assert cache.get('https://api.test/a') is None
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 2)
+
+
+def test_expiry(cache):
+    cache.set('https://api.test/a', b'response', expires=0.05)
+    sleep(0.1)
+    assert cache.get('https://api.test/a') is None
+
+
+def test_least_recently_used_responses_are_evicted(cache):
+    for name in 'abc':
+        cache.set(f'https://api.test/{name}', b'x' * 40)
+        sleep(0.01)
+    # 120 bytes > 100: a, the least recently used, is evicted
+    assert cache.get('https://api.test/a') is None
+    cache.get('https://api.test/b')
+    sleep(0.01)
+    cache.set('https://api.test/d', b'x' * 40)
+    assert cache.get('https://api.test/b') == b'x' * 40
+    assert cache.get('https://api.test/c') is None
+    stats = cache.stats()
+    assert (stats['evictions'], stats['entries'], stats['bytes']) == (2, 2, 80)
+
+
+def test_writes_outdate_what_was_derived_from_the_url(cache):
+    before = generation(url_tag('https://api.test/a'))
+    cache.set('https://api.test/a', b'response')
+    assert generation(url_tag('https://api.test/a')) == before + 1
+    assert generation(url_tag('https://api.test/b')) == 0
+
+
+def test_workers_share_the_cache(cache):
+    cache.set('https://api.test/a', b'response')
+    assert DiskLRUCache(cache.path, max_bytes=100).get('https://api.test/a') == b'response'
+
+
+
+class CountingBackend(InProcessBackend):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def set(self, *args, **kwargs):
+        self.writes += 1
+        super().set(*args, **kwargs)
+
+
+def test_unchanged_stale_responses_are_not_written_again():
+    backend = CountingBackend()
+    store = StaleStore(backend)
+    for _ in range(3):
+        store.save('https://api.test/a', {'q': 1}, {'temp': 20})
+    assert backend.writes == 1
+    store.save('https://api.test/a', {'q': 1}, {'temp': 21})
+    store.save('https://api.test/a', {'q': 2}, {'temp': 21})
+    assert backend.writes == 3
+    assert store.load('https://api.test/a', {'q': 1}) == {'temp': 21}
+
+
+def test_unchanged_stale_responses_are_written_again_before_they_expire():
+    backend = CountingBackend()
+    store = StaleStore(backend, ttl=0.1)
+    store.save('https://api.test/a', None, {'temp': 20})
+    sleep(0.06)
+    store.save('https://api.test/a', None, {'temp': 20})
+    assert backend.writes == 2
@@ -0,0 +1,26 @@
+import pytest
+
+from sam.components import COMPONENTS, enabled_components
+
+WEATHER_ENV = ('DARK_SKY_KEY', 'GOOGLE_MAPS_TIMEZONE_KEY', 'GOOGLE_MAPS_GEOCODE_KEY')
+
+
+@pytest.fixture
+def only_weather_configured(monkeypatch):
+    for component in COMPONENTS.values():
+        for name in component.required_env:
+            monkeypatch.delenv(name, raising=False)
+    for name in WEATHER_ENV:
+        monkeypatch.setenv(name, 'key')
+
+
+def test_auto_enables_configured_components(only_weather_configured):
+    assert enabled_components('auto') == ['weather']
+
+
+def test_explicit_components_skip_unconfigured_and_unknown(only_weather_configured):
+    assert enabled_components('Weather, music, unknown') == ['weather']
+
+
+def test_none_enables_nothing(only_weather_configured):
+    assert enabled_components('none') == []
@@ -0,0 +1,64 @@
+import asyncio
+
+from sam.context import DEFAULT_USER, current_user, isolated, user_context, user_id_from_request
+
+REQUEST = {
+    'session': 'projects/sam/agent/sessions/session-1',
+    'originalDetectIntentRequest': {'payload': {'user': {'userId': 'user-1'}}},
+}
+
+
+def test_payload_user_is_preferred():
+    assert user_id_from_request(REQUEST) == 'user-1'
+
+
+def test_unknown_users_fall_back_to_the_session():
+    assert user_id_from_request(REQUEST, is_known=lambda user_id: user_id == 'session-1') == 'session-1'
+
+
+def test_unknown_users_fall_back_to_the_default_user():
+    assert user_id_from_request(REQUEST, is_known=lambda user_id: False) == DEFAULT_USER
+    assert user_id_from_request({'queryResult': {}}) == DEFAULT_USER
+
+
+def test_isolated_coroutines_dont_share_the_context():
+    async def handle(user_id):
+        with user_context(user_id):
+            await asyncio.sleep(0.01)
+            return current_user.get()
+
+    async def set_user(user_id):
+        current_user.set(user_id)
+
+    async def handle_both():
+        results = await asyncio.gather(isolated(handle('a')), isolated(handle('b')))
+        # Awaited directly, without a task, a coroutine would set the user of the caller
+        await isolated(set_user('leaked'))
+        return results, current_user.get()
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(handle_both()) == (['a', 'b'], DEFAULT_USER)
+    finally:
+        loop.close()
+
+
+def test_isolated_coroutines_receive_exceptions():
+    async def cancelled():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            return 'cleaned up'
+
+    async def run():
+        task = asyncio.ensure_future(isolated(cancelled()))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        return await asyncio.gather(task, return_exceptions=True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(run()) == ['cleaned up']
+    finally:
+        loop.close()
+
@@ -0,0 +1,146 @@
+import asyncio
+from time import sleep
+
+import pytest
+
+from sam.constants import DEFERRED_ACKNOWLEDGEMENT
+from sam.context import user_context
+from sam.exceptions import InvalidDataFormatError
+from sam.intents import IntentRegistry
+from sam.jobs import job_queue
+from sam.sessions.cache import depend_on, invalidate, invalidate_url, url_tag
+
+
+@pytest.fixture
+def registry():
+    registry_ = IntentRegistry()
+
+    def volume_increase(volume_amount=10):
+        return f'volume +{volume_amount}'
+
+    def weather(query_result):
+        return query_result['action']
+
+    async def weather_async(query_result):
+        return f'async {query_result["action"]}'
+
+    registry_.register(volume_increase, 'music.volume_increase', params={'volume_amount': 'percentage'})
+    registry_.register(weather, 'weather', prefix=True, pass_query_result=True)
+    registry_.register(weather_async, 'weather', prefix=True, pass_query_result=True)
+    return registry_
+
+
+def test_dispatch_exact(registry):
+    query_result = {'action': 'music.volume_increase', 'parameters': {'percentage': '20%'}}
+    assert registry.dispatch(query_result) == 'volume +20%'
+
+
+def test_dispatch_blank_parameter_uses_default(registry):
+    query_result = {'action': 'music.volume_increase', 'parameters': {'percentage': ''}}
+    assert registry.dispatch(query_result) == 'volume +10'
+
+
+def test_dispatch_missing_required_parameter(registry):
+    def get_events_summary(date_):
+        return date_
+
+    registry.register(get_events_summary, 'calendar.events', params={'date_': 'date'})
+    assert registry.dispatch({'action': 'calendar.events', 'parameters': {'date': '2018-09-01'}}) == '2018-09-01'
+    with pytest.raises(InvalidDataFormatError):
+        registry.dispatch({'action': 'calendar.events', 'parameters': {'date': ''}})
+
+
+def test_dispatch_prefix(registry):
+    assert registry.dispatch({'action': 'weather'}) == 'weather'
+    assert registry.dispatch({'action': 'weather.time.followup'}) == 'weather.time.followup'
+
+
+def test_dispatch_async(registry):
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(registry.dispatch_async({'action': 'weather'})) == 'async weather'
+        query_result = {'action': 'music.volume_increase', 'parameters': {'percentage': 5}}
+        assert loop.run_until_complete(registry.dispatch_async(query_result)) == 'volume +5'
+    finally:
+        loop.close()
+
+
+def test_cacheable_response_is_cached(registry):
+    calls = []
+
+    def forecast(location=None):
+        calls.append(location)
+        return f'Sunny in {location}'
+
+    registry.register(forecast, 'weather.forecast', params={'location': 'location'},
+                      cache_ttl=60, cache_tags=('test.forecast',), cache_per_user=False)
+    assert registry.dispatch({'action': 'weather.forecast', 'parameters': {'location': 'Amsterdam'}}) == \
+        'Sunny in Amsterdam'
+    # Parameters are normalized
+    assert registry.dispatch({'action': 'weather.forecast', 'parameters': {'location': 'amsterdam '}}) == \
+        'Sunny in Amsterdam'
+    assert calls == ['Amsterdam']
+
+    invalidate('test.forecast')
+    registry.dispatch({'action': 'weather.forecast', 'parameters': {'location': 'Amsterdam'}})
+    assert calls == ['Amsterdam', 'Amsterdam']
+
+
+def test_cached_response_outdated_by_the_data_it_was_derived_from(registry):
+    calls = []
+
+    def forecast(location=None):
+        calls.append(location)
+        depend_on(url_tag(f'https://forecast.test/{location}'))
+        return f'Sunny in {location}'
+
+    registry.register(forecast, 'weather.forecast', params={'location': 'location'},
+                      cache_ttl=60, cache_per_user=False)
+    for location in ('Amsterdam', 'Utrecht'):
+        registry.dispatch({'action': 'weather.forecast', 'parameters': {'location': location}})
+    # Only the responses derived from the changed url are outdated
+    invalidate_url('https://forecast.test/Utrecht')
+    for location in ('Amsterdam', 'Utrecht'):
+        registry.dispatch({'action': 'weather.forecast', 'parameters': {'location': location}})
+    assert calls == ['Amsterdam', 'Utrecht', 'Utrecht']
+
+
+def test_mutation_is_never_cached(registry):
+    registry.dispatch({'action': 'music.volume_increase', 'parameters': {'percentage': 5}})
+    registry.dispatch({'action': 'music.volume_increase', 'parameters': {'percentage': 5}})
+    assert registry.cache.stats()['entries'] == 0
+
+
+def test_deferred_intent_runs_as_job(registry):
+    registry.register(lambda: 'Three events today', 'calendar.summary', deferred=True)
+    query_result = {'action': 'calendar.summary', 'queryText': 'What is on today?'}
+    user_id = 'deferred-user'
+    with user_context(user_id):
+        assert registry.dispatch(query_result, defer=True) == DEFERRED_ACKNOWLEDGEMENT
+        # Without defer, deferred intents run inline
+        assert registry.dispatch(query_result) == 'Three events today'
+
+    for _ in range(100):
+        if all(job.finished for job in job_queue.jobs_of(user_id)):
+            break
+        sleep(0.01)
+    jobs = job_queue.undelivered(user_id)
+    assert [job.result for job in jobs] == ['Three events today']
+    assert 'What is on today?' in jobs[0].summary()
+    job_queue.mark_delivered(jobs)
+    assert job_queue.undelivered(user_id) == []
+
+
+def test_conflicting_registration(registry):
+    async def volume_increase_async(volume_amount=10):
+        return f'Volume increased by {volume_amount}'
+
+    # The asyncio variant of a route is declared with the same options
+    registry.register(volume_increase_async, 'music.volume_increase', params={'volume_amount': 'percentage'})
+    with pytest.raises(ValueError, match='params'):
+        registry.register(volume_increase_async, 'music.volume_increase', params={'amount': 'percentage'})
+
+
+def test_unsupported_action(registry):
+    with pytest.raises(InvalidDataFormatError):
+        registry.dispatch({'action': 'music.dance'})
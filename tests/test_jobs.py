@@ -0,0 +1,51 @@
+from threading import Event
+from time import sleep
+
+import pytest
+
+from sam.context import user_context
+from sam.exceptions import TooManyJobsError
+from sam.jobs import DONE, JobQueue
+from sam.state import InProcessBackend
+
+
+def wait_for(queue, job_id):
+    for _ in range(100):
+        job = queue.get(job_id)
+        if job.finished:
+            return job
+        sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+
+def test_jobs_are_shared_through_the_backend():
+    backend = InProcessBackend()
+    worker_a, worker_b = JobQueue(backend=backend), JobQueue(backend=backend)
+    with user_context('user-a'):
+        job = worker_a.submit(lambda: 'done', action='calendar.summary')
+    assert wait_for(worker_b, job.id).status == DONE
+    assert [job_.result for job_ in worker_b.undelivered('user-a')] == ['done']
+    assert worker_b.jobs_of('user-b') == []
+
+
+def test_results_are_undelivered_until_marked():
+    queue = JobQueue(backend=InProcessBackend())
+    with user_context('user-a'):
+        job = queue.submit(lambda: 'done')
+    wait_for(queue, job.id)
+    assert len(queue.undelivered('user-a')) == 1
+    assert len(queue.undelivered('user-a')) == 1
+    queue.mark_delivered(queue.undelivered('user-a'))
+    assert queue.undelivered('user-a') == []
+
+
+def test_submit_rejects_jobs_above_max_jobs():
+    release = Event()
+    queue = JobQueue(max_workers=1, max_jobs=2, backend=InProcessBackend())
+    jobs = [queue.submit(release.wait, 5), queue.submit(release.wait, 5)]
+    with pytest.raises(TooManyJobsError):
+        queue.submit(release.wait, 5)
+    release.set()
+    for job in jobs:
+        wait_for(queue, job.id)
+    assert queue.submit(lambda: 'done') is not None
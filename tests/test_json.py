@@ -0,0 +1,16 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from sam.json_ import OrjsonBackend, StdlibBackend
+
+OBJ = {'at': datetime(2020, 1, 1, 12, 30, tzinfo=timezone.utc), 'on': date(2020, 1, 1), 'n': 1}
+
+
+def test_dates_are_iso_8601():
+    assert StdlibBackend().dumps(OBJ) == '{"at":"2020-01-01T12:30:00+00:00","on":"2020-01-01","n":1}'
+
+
+def test_backends_agree():
+    pytest.importorskip('orjson')
+    assert OrjsonBackend().dumpb(OBJ, sort_keys=True) == StdlibBackend().dumpb(OBJ, sort_keys=True)
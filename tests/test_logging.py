@@ -0,0 +1,29 @@
+import logging
+
+from sam.context import user_context
+from sam.json_ import loads
+from sam.logging_ import ContextFilter, JSONFormatter, SamplingFilter
+
+
+def make_record(level=logging.INFO, **extra):
+    record = logging.LogRecord('sam.test', level, __file__, 1, 'GET %s', ('https://example.com',), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_sampling_keeps_warnings():
+    sampling = SamplingFilter(rate=0)
+    assert not sampling.filter(make_record(logging.INFO))
+    assert sampling.filter(make_record(logging.WARNING))
+    assert SamplingFilter(rate=1).filter(make_record(logging.DEBUG))
+
+
+def test_json_formatter_includes_fields_and_user():
+    record = make_record(status=200)
+    with user_context('user-1'):
+        ContextFilter().filter(record)
+    entry = loads(JSONFormatter().format(record))
+    assert entry['message'] == 'GET https://example.com'
+    assert entry['user'] == 'user-1'
+    assert entry['status'] == 200
+    assert entry['level'] == 'INFO'
@@ -0,0 +1,60 @@
+import pytest
+
+from sam.matcher import IntentMatcher
+
+UTTERANCES = [
+    ('music.pause', 'pause'),
+    ('music.pause', 'pause the music'),
+    ('music.volume_increase', 'volume up'),
+    ('music.volume_increase', 'turn the volume up by {percentage}'),
+    ('music.shuffle', 'shuffle {shuffle}'),
+    ('music.play', 'play {song} by {artist}'),
+    ('music.play', 'play the album {album}'),
+]
+
+
+@pytest.fixture
+def matcher():
+    return IntentMatcher(UTTERANCES)
+
+
+def test_match_literal(matcher):
+    query_result = matcher.match('Pause the music!')
+    assert query_result['action'] == 'music.pause'
+    assert query_result['parameters'] == {}
+    assert query_result['queryText'] == 'Pause the music!'
+
+
+def test_match_slot_pattern(matcher):
+    assert matcher.match('turn the volume up by 20%')['parameters'] == {'percentage': '20%'}
+    assert matcher.match('shuffle on')['parameters'] == {'shuffle': 'on'}
+    assert matcher.match('shuffle sideways') is None
+
+
+def test_match_free_slots(matcher):
+    query_result = matcher.match('play bohemian rhapsody by queen')
+    assert query_result['action'] == 'music.play'
+    assert query_result['parameters'] == {'song': 'bohemian rhapsody', 'artist': 'queen'}
+
+
+def test_free_slots_keep_their_casing(matcher):
+    query_result = matcher.match('Play Bohemian Rhapsody by Queen')
+    assert query_result['parameters'] == {'song': 'Bohemian Rhapsody', 'artist': 'Queen'}
+    assert matcher.match('Shuffle ON')['parameters'] == {'shuffle': 'on'}
+
+
+def test_most_specific_match_wins(matcher):
+    # 'play {song} by {artist}' matches as well, but with fewer literal words
+    query_result = matcher.match('play the album night by night')
+    assert query_result['parameters'] == {'album': 'night by night'}
+
+
+def test_no_match_falls_back(matcher):
+    assert matcher.match('what is the weather in amsterdam') is None
+    assert matcher.match('pause the music please') is None
+    assert matcher.match('') is None
+
+
+def test_ambiguous_match_falls_back():
+    matcher = IntentMatcher([('music.play', 'play {song}'), ('music.play', 'play {artist}')])
+    assert matcher.match('play queen') is None
@@ -0,0 +1,39 @@
+import pytest
+
+from sam.metrics import MetricsRegistry, normalize_endpoint
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = registry.histogram('test_seconds', 'Test latencies', ('host',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value, 'example.com')
+    exposition = registry.exposition()
+    assert '# TYPE test_seconds histogram' in exposition
+    assert 'test_seconds_bucket{host="example.com",le="0.1"} 2' in exposition
+    assert 'test_seconds_bucket{host="example.com",le="1.0"} 3' in exposition
+    assert 'test_seconds_bucket{host="example.com",le="+Inf"} 4' in exposition
+    assert 'test_seconds_count{host="example.com"} 4' in exposition
+
+
+def test_counter(registry):
+    counter = registry.counter('test_lookups_total', 'Test lookups', ('result',))
+    counter.inc('hit')
+    counter.inc('hit')
+    counter.inc('miss')
+    assert counter.value('hit') == 2
+    assert 'test_lookups_total{result="miss"} 1' in registry.exposition()
+
+
+@pytest.mark.parametrize('path, endpoint', [
+    ('/v1/albums/4aawyAB9vmqN3uQ7FjRGTy/tracks', '/v1/albums/:id/tracks'),
+    ('/forecast/0123456789abcdef0123456789abcdef/52.37,4.89', '/forecast/:id/:id'),
+    ('/calendar/v3/calendars/someone@example.com/events', '/calendar/v3/calendars/:id/events'),
+    ('/maps/api/geocode/json', '/maps/api/geocode/json'),
+])
+def test_normalize_endpoint(path, endpoint):
+    assert normalize_endpoint(path) == endpoint
@@ -0,0 +1,61 @@
+from threading import Barrier
+
+import pytest
+
+from sam.action_handlers import music
+from sam.wrappers import spotify
+
+
+class FakeOAuth2:
+    def __init__(self):
+        self.puts = []
+
+    def put(self, url, json=None, params=None):
+        self.puts.append((url, json))
+
+
+@pytest.fixture()
+def plays(monkeypatch):
+    calls = []
+    monkeypatch.setattr(spotify, 'play', lambda value, type_='artist', device=None: calls.append((value, type_)))
+    return calls
+
+
+def test_single_song_list_is_unwrapped(plays):
+    assert music.play(song=['Yesterday'], artist='The Beatles') == 'Playing Yesterday by The Beatles'
+    assert plays == [(['Yesterday', 'The Beatles'], 'song_artist')]
+
+
+def test_single_artist_list_is_unwrapped(plays):
+    assert music.play(artist=['Queen']) == 'Playing Queen'
+    assert plays == [('Queen', 'artist')]
+
+
+def test_songs_are_searched_concurrently_and_played_with_one_request(monkeypatch):
+    songs = ['Help', 'Yesterday', 'Let It Be']
+    # Every search waits for all the others, so this only passes if they run concurrently
+    barrier = Barrier(len(songs), timeout=5)
+    searches = []
+
+    def get_track_uri(song, artist=None):
+        searches.append((song, artist))
+        barrier.wait()
+        return f'spotify:track:{song}'
+
+    oauth2 = FakeOAuth2()
+    monkeypatch.setattr(spotify, 'get_track_uri', get_track_uri)
+    monkeypatch.setattr(spotify, 'oauth2', oauth2)
+    music.play(song=songs, artist=['The Beatles'])
+    assert sorted(searches) == sorted((song, 'The Beatles') for song in songs)
+    assert oauth2.puts == [('https://api.spotify.com/v1/me/player/play',
+                            {'uris': [f'spotify:track:{song}' for song in songs]})]
+
+
+def test_only_the_songs_found_are_announced(monkeypatch):
+    oauth2 = FakeOAuth2()
+    monkeypatch.setattr(spotify, 'get_track_uri', lambda song, artist=None: None if song == 'Nope' else song)
+    monkeypatch.setattr(spotify, 'oauth2', oauth2)
+    res = music.play(song=['Help', 'Nope', 'Yesterday'], artist=['The Beatles'])
+    assert res == 'Playing Help and Yesterday. Could not find Nope'
+    assert oauth2.puts[0][1] == {'uris': ['Help', 'Yesterday']}
+    assert music.play(song=['Help', 'Nope']) == 'Playing Help. Could not find Nope'
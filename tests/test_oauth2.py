@@ -0,0 +1,94 @@
+import threading
+from time import sleep, time
+
+import pytest
+
+from sam.sessions.oauth2 import OAuth2Session, RefreshScheduler, refresh_scheduler
+from sam.sessions.token_store import StateTokenStore
+from sam.state import InProcessBackend
+
+
+class FakeSession:
+    def __init__(self):
+        self.refreshed = threading.Event()
+
+    def refresh_token(self):
+        self.refreshed.set()
+
+
+@pytest.fixture
+def token_store():
+    return StateTokenStore(InProcessBackend())
+
+
+def create_session(token_store, refresh_margin=300):
+    return OAuth2Session(client_id='id', client_secret='secret', token_uri='https://token.test',
+                         state='test_state', component='Test', token_store=token_store,
+                         refresh_margin=refresh_margin)
+
+
+def token(access_token, expires_in):
+    return {'access_token': access_token, 'refresh_token': 'refresh', 'expires_at': time() + expires_in}
+
+
+def test_scheduler_uses_a_single_thread():
+    scheduler = RefreshScheduler()
+    threads = threading.active_count()
+    sessions = [FakeSession() for _ in range(20)]
+    for session in sessions:
+        scheduler.schedule(session, 0.01)
+    assert all(session.refreshed.wait(1) for session in sessions)
+    assert threading.active_count() <= threads + 1
+    assert len(scheduler) == 0
+
+
+def test_scheduler_cancel():
+    scheduler = RefreshScheduler()
+    cancelled, rescheduled = FakeSession(), FakeSession()
+    scheduler.schedule(cancelled, 0.05)
+    scheduler.cancel(cancelled)
+    scheduler.schedule(rescheduled, 0.05)
+    scheduler.schedule(rescheduled, 60)
+    sleep(0.2)
+    assert not cancelled.refreshed.is_set()
+    assert not rescheduled.refreshed.is_set()
+    assert len(scheduler) == 1
+
+
+def test_token_is_refreshed_before_it_expires(token_store):
+    token_store.save('test_state', token('old', 300.5))
+    session = create_session(token_store)
+    refreshed = []
+
+    def refresh_token(token_uri, refresh_token=None, auth=None):
+        refreshed.append(refresh_token)
+        return {'access_token': 'new', 'expires_at': time() + 3600}
+
+    session._session.refresh_token = refresh_token
+    for _ in range(300):
+        if refreshed:
+            break
+        sleep(0.01)
+    assert refreshed == ['refresh']
+    assert session.token['access_token'] == 'new'
+    # The refresh token is kept when the provider doesn't send a new one
+    assert token_store.load('test_state')['refresh_token'] == 'refresh'
+    session.close()
+
+
+def test_token_refreshed_by_another_worker_is_reloaded(token_store):
+    token_store.save('test_state', token('old', 3600))
+    session, other_worker = create_session(token_store), create_session(token_store)
+    other_worker._save_token(token('new', 3600))
+    session._ensure_fresh_token()
+    assert session.token['access_token'] == 'new'
+    session.close()
+    other_worker.close()
+
+
+def test_closed_session_is_not_refreshed(token_store):
+    token_store.save('test_state', token('old', 3600))
+    session = create_session(token_store)
+    assert session in refresh_scheduler._entries
+    session.close()
+    assert session not in refresh_scheduler._entries
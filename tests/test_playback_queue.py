@@ -0,0 +1,110 @@
+from threading import Event, Thread
+from time import perf_counter, sleep
+
+from sam.wrappers.playback_queue import PlaybackCommandQueue
+
+
+class FakeSpotify:
+    """
+    Upstream calls block until ```release``` is set, so that a burst can arrive while a batch is in flight
+    """
+    def __init__(self, volume=50):
+        self.volume = volume
+        self.calls = []
+        self.in_flight = Event()
+        self.release = Event()
+        self.release.set()
+
+    def _call(self, call):
+        self.calls.append(call)
+        self.in_flight.set()
+        self.release.wait(5)
+
+    def current_volume(self):
+        self._call('current_volume')
+        return self.volume
+
+    def set_volume(self, volume_percent):
+        self._call(('set_volume', volume_percent))
+        self.volume = volume_percent
+
+    def shuffle(self, shuffle_mode):
+        self._call(('shuffle', shuffle_mode))
+
+    def repeat(self, mode):
+        self._call(('repeat', mode))
+
+    def skip_forward(self):
+        self._call('skip_forward')
+
+    def unskip(self):
+        self._call('unskip')
+
+
+def burst(fake, first, *rest):
+    """
+    Submit ```first```, then the ```rest``` concurrently while the batch of ```first``` is in flight
+    """
+    fake.release.clear()
+    threads = [Thread(target=first)]
+    threads[0].start()
+    fake.in_flight.wait(5)
+    threads.extend(Thread(target=command) for command in rest)
+    for thread in threads[1:]:
+        thread.start()
+    sleep(0.1)
+    fake.release.set()
+    for thread in threads:
+        thread.join()
+
+
+def test_single_command_runs_at_once():
+    fake = FakeSpotify(volume=50)
+    queue = PlaybackCommandQueue(fake)
+    start = perf_counter()
+    assert queue.change_volume(10) == (50, 60)
+    assert perf_counter() - start < 0.05
+
+
+def test_volume_changes_are_merged():
+    fake = FakeSpotify(volume=50)
+    queue = PlaybackCommandQueue(fake)
+    burst(fake, lambda: queue.change_volume(10), *[lambda: queue.change_volume(10)] * 2,
+          lambda: queue.change_volume(-5))
+    assert fake.calls == ['current_volume', ('set_volume', 60), 'current_volume', ('set_volume', 75)]
+
+
+def test_volume_is_clamped():
+    fake = FakeSpotify(volume=85)
+    queue = PlaybackCommandQueue(fake)
+    burst(fake, lambda: queue.change_volume(10), lambda: queue.change_volume(10), lambda: queue.change_volume(10))
+    assert fake.volume == 100
+
+
+def test_toggles_collapse_and_skips_are_sequenced():
+    fake = FakeSpotify()
+    queue = PlaybackCommandQueue(fake)
+    burst(fake, lambda: queue.skip_forward(), lambda: queue.shuffle(True), lambda: queue.shuffle(False),
+          lambda: queue.skip_forward())
+    assert fake.calls.count('skip_forward') == 2
+    assert [call for call in fake.calls if call[0] == 'shuffle'] == [('shuffle', False)]
+
+
+def test_users_are_queued_separately():
+    fake = FakeSpotify(volume=50)
+    queue = PlaybackCommandQueue(fake)
+    threads = [Thread(target=lambda: queue.repeat('track', user_id='a')),
+               Thread(target=lambda: queue.repeat('off', user_id='b'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(fake.calls) == [('repeat', 'off'), ('repeat', 'track')]
+
+
+def test_idle_queues_are_dropped():
+    fake = FakeSpotify()
+    queue = PlaybackCommandQueue(fake)
+    burst(fake, lambda: queue.skip_forward(user_id='a'), lambda: queue.skip_forward(user_id='a'))
+    queue.repeat('off', user_id='b')
+    assert queue._queues == dict()
@@ -0,0 +1,114 @@
+import json
+from time import sleep
+
+import pytest
+from flask import Flask
+
+from sam import routes
+from sam.sessions.per_user import PerUserStore
+from sam.wrappers import playback_stream
+from sam.wrappers.playback_stream import PlaybackPoller
+
+
+class FakeResponse:
+    def __init__(self, json_data):
+        self.json_data = json_data
+        self.status_code = 200 if json_data else 204
+        self.content = json.dumps(json_data).encode() if json_data else b''
+
+    def json(self):
+        return self.json_data
+
+
+class FakeSpotify:
+    def __init__(self, *states):
+        self.states = list(states)
+        self.calls = 0
+
+    def currently_playing(self):
+        self.calls += 1
+        state = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return FakeResponse(state)
+
+
+def playing(uri='spotify:track:1', progress_ms=1000, duration_ms=200000, is_playing=True):
+    return {'is_playing': is_playing, 'progress_ms': progress_ms,
+            'item': {'uri': uri, 'name': 'Help', 'duration_ms': duration_ms, 'artists': [{'name': 'The Beatles'}]}}
+
+
+def state(uri='spotify:track:1', progress_ms=1000, duration_ms=200000, is_playing=True):
+    return {'is_playing': is_playing, 'progress_ms': progress_ms, 'duration_ms': duration_ms,
+            'uri': uri, 'song': 'Help', 'artist': 'The Beatles'}
+
+
+@pytest.fixture()
+def poller():
+    return PlaybackPoller(wrapper=FakeSpotify(playing()), min_interval=0.01, max_interval=0.05,
+                          idle_interval=0.05)
+
+
+def test_progress_as_expected_is_not_a_change(poller):
+    poller.last_state = state(progress_ms=1000)
+    assert not poller._has_changed(state(progress_ms=4000), elapsed=3)
+    assert poller._has_changed(state(progress_ms=60000), elapsed=3)
+
+
+def test_other_track_pause_and_stop_are_changes(poller):
+    poller.last_state = state()
+    assert poller._has_changed(state(uri='spotify:track:2'), elapsed=0)
+    assert poller._has_changed(state(is_playing=False), elapsed=0)
+    assert poller._has_changed(None, elapsed=0)
+    poller.last_state = {'error': 'Playback poll failed'}
+    assert poller._has_changed(state(), elapsed=0)
+
+
+def test_next_poll_is_when_the_track_ends():
+    poller = PlaybackPoller(wrapper=FakeSpotify(playing()))
+    assert poller._next_interval(state(progress_ms=199000)) == pytest.approx(1.5)
+    assert poller._next_interval(state(progress_ms=199980)) == poller.min_interval
+    assert poller._next_interval(state(progress_ms=1000)) == poller.max_interval
+    assert poller._next_interval(None) == poller.idle_interval
+    assert poller._next_interval(state(is_playing=False)) == poller.idle_interval
+
+
+def test_changes_are_fanned_out_to_all_subscribers(poller):
+    poller.wrapper = FakeSpotify(playing(), playing(uri='spotify:track:2'))
+    subscribers = [poller.subscribe() for _ in range(3)]
+    for subscriber in subscribers:
+        assert subscriber.get(timeout=1)['uri'] == 'spotify:track:1'
+        assert subscriber.get(timeout=1)['uri'] == 'spotify:track:2'
+    # One poller for all of them
+    assert poller.wrapper.calls < 10
+    for subscriber in subscribers:
+        poller.unsubscribe(subscriber)
+    sleep(0.2)
+    assert poller._thread is None
+
+
+def test_pollers_with_subscribers_are_not_evicted():
+    store = PerUserStore(lambda user_id: PlaybackPoller(wrapper=FakeSpotify(playing()), idle_interval=0.05),
+                         max_size=1, in_use=PlaybackPoller.has_subscribers)
+    first = store.get('alice')
+    subscriber = first.subscribe()
+    store.get('bob')
+    assert store.get('alice') is first
+    first.unsubscribe(subscriber)
+    store.get('bob')
+    store.get('carol')
+    assert store.get('alice') is not first
+
+
+def test_current_song_stream(monkeypatch):
+    poller = PlaybackPoller(wrapper=FakeSpotify(playing()), idle_interval=0.05)
+    monkeypatch.setattr(playback_stream, 'playback_pollers', PerUserStore(lambda user_id: poller))
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    routes.setup_music_endpoints(app)
+    res = app.test_client().get('/current_song_stream')
+    assert res.mimetype == 'text/event-stream'
+    event = next(iter(res.response))
+    event = event.decode() if isinstance(event, bytes) else event
+    assert event.startswith('event: playback\ndata: ')
+    assert json.loads(event.split('data: ')[1]) == state()
+    res.close()
+    assert not poller.has_subscribers()
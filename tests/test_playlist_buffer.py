@@ -0,0 +1,108 @@
+from time import sleep
+
+import pytest
+
+from sam.context import current_user, user_context
+from sam.wrappers.playlist_buffer import PlaylistWriteBuffer
+
+
+class FakeSpotify:
+    def __init__(self, failing_attempts=()):
+        """
+        :param failing_attempts: Numbers of the add_tracks_to_playlist calls that fail, starting at 0
+        """
+        self.failing_attempts = set(failing_attempts)
+        self.attempts = 0
+        self.calls = []
+
+    def add_tracks_to_playlist(self, song_uris: list, playlist_id: str) -> list:
+        self.attempts += 1
+        if self.attempts - 1 in self.failing_attempts:
+            raise ConnectionError('Spotify is down')
+        self.calls.append((list(song_uris), playlist_id, current_user.get()))
+        return [len(song_uris)]
+
+
+def uris(count, start=0):
+    return [f'spotify:track:{i}' for i in range(start, start + count)]
+
+
+def test_size_flush():
+    fake = FakeSpotify()
+    buffer = PlaylistWriteBuffer(fake, max_size=3, max_delay=60)
+    buffer.add(uris(2), 'p')
+    assert fake.calls == []
+    buffer.add(uris(1, start=2), 'p')
+    assert [call[0] for call in fake.calls] == [uris(3)]
+
+
+def test_time_flush():
+    fake = FakeSpotify()
+    buffer = PlaylistWriteBuffer(fake, max_size=100, max_delay=0.05)
+    buffer.add(uris(1), 'p')
+    buffer.add(uris(1, start=1), 'p')
+    sleep(0.3)
+    assert [call[0] for call in fake.calls] == [uris(2)]
+
+
+def test_chunks_preserve_order():
+    fake = FakeSpotify()
+    buffer = PlaylistWriteBuffer(fake, max_size=100, max_delay=60)
+    buffer.add(uris(250), 'p')
+    assert [len(call[0]) for call in fake.calls] == [100, 100, 50]
+    assert sum((call[0] for call in fake.calls), []) == uris(250)
+
+
+def test_failed_tracks_are_kept():
+    fake = FakeSpotify(failing_attempts={0})
+    buffer = PlaylistWriteBuffer(fake, max_size=100, max_delay=60)
+    buffer.add(uris(2), 'p')
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    buffer.add(uris(1, start=2), 'p')
+    assert buffer.flush() == [3]
+    assert fake.calls[0][0] == uris(3)
+
+
+def test_only_unwritten_chunks_are_kept():
+    fake = FakeSpotify(failing_attempts={1})
+    buffer = PlaylistWriteBuffer(fake, max_size=1000, max_delay=60)
+    buffer.add(uris(150), 'p')
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    buffer.flush()
+    assert [call[0] for call in fake.calls] == [uris(100), uris(50, start=100)]
+
+
+def test_failed_tracks_are_retried_later():
+    fake = FakeSpotify(failing_attempts={0})
+    buffer = PlaylistWriteBuffer(fake, max_size=2, max_delay=0.05)
+    with pytest.raises(ConnectionError):
+        buffer.add(uris(2), 'p')
+    sleep(0.3)
+    assert [call[0] for call in fake.calls] == [uris(2)]
+
+
+def test_failed_tracks_are_dropped_and_reported_after_max_attempts():
+    fake = FakeSpotify(failing_attempts={0, 1})
+    buffer = PlaylistWriteBuffer(fake, max_size=100, max_delay=60, max_attempts=2)
+    with user_context('a'):
+        buffer.add(uris(2), 'p')
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                buffer.flush()
+        assert buffer.flush() == []
+        assert buffer.failures() == ['2 song(s) could not be added to playlist p: Spotify is down']
+        # Reported once
+        assert buffer.failures() == []
+    assert fake.calls == []
+
+
+def test_tracks_are_written_on_behalf_of_their_user():
+    fake = FakeSpotify()
+    buffer = PlaylistWriteBuffer(fake, max_size=100, max_delay=60)
+    with user_context('a'):
+        buffer.add(uris(1), 'p')
+    buffer.add(uris(1, start=1), 'p', user_id='b')
+    buffer.flush()
+    assert sorted((call[0], call[2]) for call in fake.calls) == [(uris(1), 'a'), (uris(1, start=1), 'b')]
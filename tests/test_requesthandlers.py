@@ -0,0 +1,57 @@
+from time import sleep
+
+import pytest
+
+from sam import requesthandlers
+from sam.constants import BATCH_MAX_SIZE
+from sam.exceptions import InvalidDataFormatError
+from sam.intents import IntentRegistry
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    registry_ = IntentRegistry()
+
+    def echo(text, delay=0):
+        sleep(float(delay))
+        return text
+
+    def fail():
+        raise ValueError('broken handler')
+
+    registry_.register(echo, 'test.echo', params={'text': 'text', 'delay': 'delay'})
+    registry_.register(fail, 'test.fail')
+    monkeypatch.setattr(requesthandlers, 'registry', registry_)
+    return registry_
+
+
+def request(action, **parameters):
+    return {'queryResult': {'action': action, 'parameters': parameters}}
+
+
+def test_batch_responses_are_in_request_order():
+    # The first requests take the longest, so they finish last
+    batch = [request('test.echo', text=str(i), delay=0.05 * (3 - i)) for i in range(4)]
+    res = requesthandlers.handle_sam_requests(batch)
+    assert [item['fulfillmentText'] for item in res] == ['0', '1', '2', '3']
+    assert all(item['statusCode'] == 200 and 'responseTime' in item for item in res)
+
+
+def test_batch_item_errors_dont_fail_the_batch():
+    res = requesthandlers.handle_sam_requests([request('test.fail'), request('test.unknown'),
+                                               request('test.echo', text='ok')])
+    assert (res[0]['statusCode'], res[0]['errorType']) == (500, 'ValueError')
+    assert (res[1]['statusCode'], res[1]['errorType']) == (400, 'InvalidDataFormatError')
+    assert (res[2]['statusCode'], res[2]['fulfillmentText']) == (200, 'ok')
+
+
+def test_batch_too_large():
+    with pytest.raises(InvalidDataFormatError) as error:
+        requesthandlers.handle_sam_requests([request('test.echo', text='x')] * (BATCH_MAX_SIZE + 1))
+    assert error.value.status_code == 413
+
+
+@pytest.mark.parametrize('body', [{'queryResult': {'action': 'test.echo'}}, 'test.echo', None])
+def test_batch_must_be_a_list(body):
+    with pytest.raises(InvalidDataFormatError):
+        requesthandlers.handle_sam_requests(body)
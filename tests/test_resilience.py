@@ -0,0 +1,136 @@
+import threading
+from time import sleep
+
+import pytest
+
+from sam.exceptions import CircuitOpenError
+from sam.sessions.resilience import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker,
+                                     hedge_stats, hedged)
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker('api.test', error_rate=0.5, window=10, min_calls=4, slow_call=1, open_seconds=0.05)
+
+
+def test_circuit_opens_once_too_many_calls_fail(breaker):
+    for success in (True, False, True):
+        breaker.allow()
+        breaker.record(success=success, elapsed=0.1)
+    # Too few calls to judge
+    assert breaker.state == CLOSED
+    breaker.allow()
+    breaker.record(success=True, elapsed=1.5)
+    # A slow call counts as a failure: 2 out of 4
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+
+
+def open_circuit(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.record(success=False)
+    assert breaker.state == OPEN
+    sleep(breaker.open_seconds * 2)
+
+
+def test_successful_trial_call_closes_the_circuit(breaker):
+    open_circuit(breaker)
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only a single trial call at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(success=True, elapsed=0.1)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['recent_calls'] == 0
+
+
+def test_failed_trial_call_opens_the_circuit_again(breaker):
+    open_circuit(breaker)
+    breaker.allow()
+    breaker.record(success=False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_released_trial_lets_another_one_through(breaker):
+    open_circuit(breaker)
+    breaker.allow()
+    breaker.release()
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+
+class Request:
+    def __init__(self, name):
+        self.name = name
+        self.copies = 0
+
+    def copy(self):
+        self.copies += 1
+        return Request(f'{self.name} (hedge)')
+
+
+class Response:
+    def __init__(self, name):
+        self.name = name
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+
+def test_fast_request_is_not_hedged():
+    request = Request('primary')
+    before = hedge_stats()
+    assert hedged(lambda request_: Response(request_.name), request, delay=1).name == 'primary'
+    assert request.copies == 0
+    assert hedge_stats() == before
+
+
+def test_first_response_wins():
+    slow_primary = threading.Event()
+    responses = []
+
+    def send(request_):
+        if request_.name == 'primary':
+            slow_primary.wait(5)
+        responses.append(Response(request_.name))
+        return responses[-1]
+
+    before = hedge_stats()
+    assert hedged(send, Request('primary'), delay=0.01).name == 'primary (hedge)'
+    slow_primary.set()
+    after = hedge_stats()
+    assert (after['hedged'] - before['hedged'], after['hedge_won'] - before['hedge_won']) == (1, 1)
+    for _ in range(100):
+        if len(responses) == 2:
+            break
+        sleep(0.01)
+    # The late primary response is closed, its connection goes back to the pool
+    primary = next(response for response in responses if response.name == 'primary')
+    assert primary.closed.wait(1)
+
+
+def test_failed_hedge_falls_back_to_the_primary():
+    slow_primary = threading.Event()
+
+    def send(request_):
+        if request_.name == 'primary':
+            slow_primary.wait(0.1)
+            return Response('primary')
+        raise ConnectionError('hedge failed')
+
+    assert hedged(send, Request('primary'), delay=0.01).name == 'primary'
+
+
+def test_error_is_raised_when_both_fail():
+    def send(request_):
+        sleep(0.02)
+        raise ConnectionError(request_.name)
+
+    with pytest.raises(ConnectionError):
+        hedged(send, Request('primary'), delay=0.01)
@@ -0,0 +1,21 @@
+import pytest
+from flask import Flask
+
+from sam import routes
+from sam.exceptions import InvalidDataFormatError
+
+
+@pytest.fixture()
+def client():
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.testing = True
+    routes.setup_dialogflow_endpoints(app, use_dialogflow=False)
+    return app.test_client()
+
+
+@pytest.mark.parametrize('body', [b'["pause"]', b'"pause"', b'not json', b'{"query": 1}', b'{}'])
+def test_query_must_be_a_json_object_with_a_query(client, body):
+    with pytest.raises(InvalidDataFormatError) as e:
+        client.post('/query', data=body)
+    assert e.value.status_code == 400
@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+
+import pytest
+
+from sam.deadline import deadline
+from sam.exceptions import DeadlineExceededError
+from sam.sessions.singleflight import SingleFlight, request_key
+
+
+def call_concurrently(singleflight, func, callers=5, key='key'):
+    """
+    :returns: The outcomes of ```callers``` concurrent singleflight.do calls, once the first one started ```func```
+    """
+    started, release = threading.Event(), threading.Event()
+
+    def leader_func():
+        started.set()
+        release.wait(5)
+        return func()
+
+    def call(_):
+        try:
+            return singleflight.do(key, leader_func)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        futures = [executor.submit(call, None)]
+        started.wait(5)
+        futures.extend(executor.submit(call, None) for _ in range(callers - 1))
+        # Let the followers join the call in flight
+        while singleflight.deduplicated < callers - 1:
+            sleep(0.01)
+        release.set()
+        return [future.result() for future in futures]
+
+
+def test_result_is_shared():
+    singleflight = SingleFlight()
+    calls = []
+    results = call_concurrently(singleflight, lambda: calls.append(1) or {'value': 1})
+    assert calls == [1]
+    assert results == [{'value': 1}] * 5
+    assert all(result is results[0] for result in results)
+
+
+def test_exception_is_shared():
+    singleflight = SingleFlight()
+    error = ConnectionError('upstream is down')
+
+    def fail():
+        raise error
+
+    assert call_concurrently(singleflight, fail) == [error] * 5
+
+
+def test_later_calls_are_not_deduplicated():
+    singleflight = SingleFlight()
+    assert singleflight.do('key', lambda: 1) == 1
+    assert singleflight.do('key', lambda: 2) == 2
+    assert singleflight.deduplicated == 0
+
+
+def test_waiting_never_outlasts_the_deadline():
+    singleflight = SingleFlight()
+    release = threading.Event()
+    leader = threading.Thread(target=singleflight.do, args=('key', lambda: release.wait(5)))
+    leader.start()
+    while not singleflight._calls:
+        sleep(0.01)
+    with deadline(0.05):
+        with pytest.raises(DeadlineExceededError):
+            singleflight.do('key', lambda: None)
+    release.set()
+    leader.join()
+
+
+def test_request_key():
+    assert request_key('get', 'https://api.test', {'a': 1, 'b': 2}) == \
+        request_key('GET', 'https://api.test', {'b': 2, 'a': 1})
+    assert request_key('GET', 'https://api.test', auth_identity='token a') != \
+        request_key('GET', 'https://api.test', auth_identity='token b')
+    assert 'token a' not in request_key('GET', 'https://api.test', auth_identity='token a')
@@ -0,0 +1,90 @@
+import pytest
+
+from sam.wrappers import spotify
+from sam.wrappers.spotify_library import LIBRARY_ENDPOINTS, LibraryMirror
+
+
+def track(name, artist, uri):
+    return {'track': {'name': name, 'uri': uri, 'artists': [{'name': artist}]}}
+
+
+LIBRARY = {
+    LIBRARY_ENDPOINTS['track']: {'items': [track('Yesterday', 'The Beatles', 'spotify:track:yesterday'),
+                                           track('Help!', 'The Beatles', 'spotify:track:help')],
+                                 'next': 'https://api.spotify.com/v1/me/tracks?offset=2'},
+    'https://api.spotify.com/v1/me/tracks?offset=2': {'items': [track('Yesterday Once More', 'Carpenters',
+                                                                      'spotify:track:yesterday-once-more')]},
+    LIBRARY_ENDPOINTS['album']: {'items': []},
+    LIBRARY_ENDPOINTS['artist']: {'artists': {'items': [{'name': 'Queen', 'uri': 'spotify:artist:queen'}]}},
+    LIBRARY_ENDPOINTS['playlist']: {'items': [{'name': 'Road Trip', 'uri': 'spotify:playlist:road-trip',
+                                               'owner': {'display_name': 'me'}}]},
+}
+
+
+class FakeResponse:
+    def __init__(self, json_data):
+        self.json_data = json_data
+
+    def json(self):
+        return self.json_data
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.urls = []
+
+    def get(self, url, params=None):
+        self.urls.append((url, params))
+        return FakeResponse(self.responses[url])
+
+
+class PlainLibraryMirror(LibraryMirror):
+    """
+    Mirror on a sqlite3 build without FTS5
+    """
+    def _create_tables(self):
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE library (name TEXT, artist TEXT, type TEXT, uri TEXT)')
+        return False
+
+
+@pytest.fixture(params=[LibraryMirror, PlainLibraryMirror], ids=['fts', 'like'])
+def mirror(request, tmp_path):
+    mirror_ = request.param(str(tmp_path / 'library.db'), FakeSession(LIBRARY), sync_interval=3600)
+    mirror_.sync()
+    # lookup would otherwise start the background sync
+    mirror_._sync_thread = object()
+    return mirror_
+
+
+def test_sync_follows_pages(mirror):
+    assert 'https://api.spotify.com/v1/me/tracks?offset=2' in [url for url, _ in mirror.session.urls]
+    assert mirror.lookup('Yesterday Once More') == 'spotify:track:yesterday-once-more'
+    assert mirror.last_synced is not None
+
+
+def test_lookup_normalizes(mirror):
+    assert mirror.lookup('help') == 'spotify:track:help'
+    assert mirror.lookup(['road trip'], 'playlist') == 'spotify:playlist:road-trip'
+    assert mirror.lookup('Queen', 'artist') == 'spotify:artist:queen'
+    assert mirror.lookup(['yesterday', 'the beatles'], 'song_artist') == 'spotify:track:yesterday'
+
+
+def test_lookup_only_accepts_exact_matches(mirror):
+    # 'Yesterday Once More' contains the name, but isn't what was asked for
+    assert mirror.lookup(['Yesterday', 'Carpenters'], 'song_artist') is None
+    assert mirror.lookup('Once More') is None
+    assert mirror.lookup('Bohemian Rhapsody') is None
+
+
+def test_library_misses_fall_back_to_search(monkeypatch, mirror):
+    search = {'tracks': {'items': [{'uri': 'spotify:track:searched'}]}}
+    session = FakeSession({'https://api.spotify.com/v1/search': search})
+    monkeypatch.setattr(spotify, 'library', mirror)
+    monkeypatch.setattr(spotify, 'oauth2', session)
+    assert spotify.get_track_uri('Yesterday', 'The Beatles') == 'spotify:track:yesterday'
+    assert session.urls == []
+    assert spotify.get_track_uri('Yesterday', 'Carpenters') == 'spotify:track:searched'
+    assert session.urls == [('https://api.spotify.com/v1/search',
+                             {'q': 'track:Yesterday artist:Carpenters', 'type': 'track'})]
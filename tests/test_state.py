@@ -0,0 +1,77 @@
+import multiprocessing
+from time import sleep, time
+
+import pytest
+
+from sam.state import InProcessBackend, SQLiteBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return InProcessBackend()
+    return SQLiteBackend(str(tmp_path / 'state.db'))
+
+
+def test_get_set_delete(backend):
+    assert backend.get('ns', 'key', 'default') == 'default'
+    backend.set('ns', 'key', {'value': 1})
+    assert backend.get('ns', 'key') == {'value': 1}
+    # Namespaces are separate
+    assert backend.get('other', 'key') is None
+    backend.delete('ns', 'key')
+    assert backend.get('ns', 'key') is None
+
+
+def test_expiry(backend):
+    backend.set('ns', 'short', 'value', ttl=0.05)
+    backend.set('ns', 'long', 'value', ttl=60)
+    assert backend.get('ns', 'short') == 'value'
+    sleep(0.1)
+    assert backend.get('ns', 'short') is None
+    assert backend.get('ns', 'long') == 'value'
+
+
+def test_versions(backend):
+    assert backend.version('ns') == 0
+    backend.set('ns', 'key', 'value')
+    after_set = backend.version('ns')
+    backend.delete('ns', 'key')
+    assert 0 < after_set < backend.version('ns')
+    assert backend.version('other') == 0
+
+
+def test_expired_rows_are_purged(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'state.db'))
+    backend.set('ns', 'key', 'value', ttl=0.01)
+    sleep(0.05)
+    backend._purged_at = 0
+    backend.set('ns', 'other', 'value')
+    assert backend._connection().execute('SELECT key FROM state').fetchall() == [('other',)]
+
+
+def test_workers_share_the_sqlite_state(tmp_path):
+    worker_a, worker_b = SQLiteBackend(str(tmp_path / 'state.db')), SQLiteBackend(str(tmp_path / 'state.db'))
+    version = worker_b.version('tokens')
+    worker_a.set('tokens', 'spotify', {'access_token': 'abc'})
+    assert worker_b.get('tokens', 'spotify') == {'access_token': 'abc'}
+    assert worker_b.version('tokens') != version
+
+
+def hold_lock(path, acquired):
+    with SQLiteBackend(path).lock('tokens'):
+        acquired.put(time())
+
+
+def test_lock_is_exclusive_across_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteBackend(path)
+    context = multiprocessing.get_context('fork')
+    acquired = context.Queue()
+    with backend.lock('tokens'):
+        process = context.Process(target=hold_lock, args=(path, acquired))
+        process.start()
+        sleep(0.2)
+        released = time()
+    process.join(5)
+    assert acquired.get(timeout=1) >= released
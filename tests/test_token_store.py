@@ -0,0 +1,28 @@
+from sam.constants import SPOTIFY_WRAPPER_STR
+from sam.context import DEFAULT_USER
+from sam.sessions.token_store import StateTokenStore, token_key
+from sam.state import InProcessBackend
+
+
+def test_token_key():
+    assert token_key(SPOTIFY_WRAPPER_STR, DEFAULT_USER) == SPOTIFY_WRAPPER_STR
+    assert token_key(SPOTIFY_WRAPPER_STR, 'a') == f'{SPOTIFY_WRAPPER_STR}:a'
+
+
+def test_save_and_load():
+    store = StateTokenStore(InProcessBackend())
+    version = store.version()
+    token = {'access_token': 'abc'}
+    store.save('key', token)
+    token['access_token'] = 'changed'
+    # Tokens are copied when saved
+    assert store.load('key') == {'access_token': 'abc'}
+    assert store.version() != version
+    assert store.load('other') is None
+
+
+def test_has_token():
+    store = StateTokenStore(InProcessBackend())
+    store.save(token_key(SPOTIFY_WRAPPER_STR, 'a'), {'access_token': 'abc'})
+    assert store.has_token('a')
+    assert not store.has_token('b')
@@ -0,0 +1,114 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import monotonic, sleep
+
+import pytest
+from requests import Session
+
+from sam.constants import UPSTREAM_POOL_SIZES
+from sam.deadline import deadline
+from sam.exceptions import DeadlineExceededError
+from sam.sessions import resilience
+from sam.sessions.transport import (DEFAULT_POOL_SIZE, TransportAdapter,
+                                    mount_transport, transport_stats)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Status codes to answer with, before answering 200
+    statuses = []
+
+    def answer(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = b'{"ok": true}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.path == '/slow':
+            # A byte at a time, each well within the read timeout
+            for byte in body:
+                sleep(0.05)
+                self.wfile.write(bytes([byte]))
+                self.wfile.flush()
+        else:
+            self.wfile.write(body)
+
+    do_GET = answer
+    do_POST = answer
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def upstream():
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    resilience._breakers.pop('127.0.0.1', None)
+    yield f'http://127.0.0.1:{server.server_port}/'
+    Handler.statuses = []
+    server.shutdown()
+    server.server_close()
+
+
+def counters():
+    return transport_stats().get('127.0.0.1', {'requests': 0, 'new_connections': 0, 'reused_connections': 0})
+
+
+def test_connections_are_reused_and_counted(upstream):
+    session = Session()
+    session.mount('http://', TransportAdapter())
+    before = counters()
+    for _ in range(3):
+        assert session.get(upstream).json() == {'ok': True}
+    after = counters()
+    assert after['requests'] - before['requests'] == 3
+    assert after['new_connections'] - before['new_connections'] == 1
+    assert after['reused_connections'] - before['reused_connections'] == 2
+
+
+def test_gateway_errors_of_reads_are_retried(upstream):
+    session = Session()
+    session.mount('http://', TransportAdapter())
+    Handler.statuses = [503]
+    before = counters()
+    assert session.get(upstream).status_code == 200
+    assert counters()['requests'] - before['requests'] == 2
+
+
+def test_writes_are_not_retried(upstream):
+    session = Session()
+    session.mount('http://', TransportAdapter())
+    Handler.statuses = [503]
+    before = counters()
+    assert session.post(upstream).status_code == 503
+    assert counters()['requests'] - before['requests'] == 1
+
+
+def test_bodies_are_read_under_the_deadline(upstream):
+    session = Session()
+    session.mount('http://', TransportAdapter())
+    with deadline(5):
+        assert session.get(upstream).json() == {'ok': True}
+
+
+def test_slow_bodies_are_cut_off_at_the_deadline(upstream):
+    session = Session()
+    session.mount('http://', TransportAdapter())
+    start = monotonic()
+    with pytest.raises(DeadlineExceededError), deadline(0.2):
+        session.get(upstream + 'slow')
+    assert monotonic() - start < 0.4
+
+
+def test_pools_are_sized_per_host():
+    session = mount_transport(Session())
+    for host, size in UPSTREAM_POOL_SIZES.items():
+        assert session.get_adapter(f'https://{host}/v1')._pool_maxsize == size
+    assert session.get_adapter('https://example.com/')._pool_maxsize == DEFAULT_POOL_SIZE
@@ -0,0 +1,22 @@
+from sam.warmup import Warmup
+
+
+def test_warmup_reports_every_step():
+    warmup = Warmup()
+    warmup.add('ok', lambda: {'connections': 2})
+    warmup.add('failing', lambda: 1 / 0)
+    assert warmup.ready
+    warmup.start('blocking')
+    assert warmup.ready
+    steps = warmup.status()['steps']
+    assert steps['ok']['status'] == 'ok' and steps['ok']['detail'] == {'connections': 2}
+    assert steps['failing']['status'] == 'failed'
+
+
+def test_warmup_runs_once():
+    calls = []
+    warmup = Warmup()
+    warmup.add('step', lambda: calls.append(1))
+    warmup.start('blocking')
+    warmup.start('blocking')
+    assert calls == [1]